@@ -0,0 +1,309 @@
+import math
+
+from django.db.models import Subquery
+from django.utils import dateformat, timezone
+
+from . import chrono, diffusion, signatures, statistiques
+from .models import Incident, MelangeMortier, MesureComposants, RetourExperience, Tache
+
+# Registre des actions POST de fiche_detail : nom -> Action. Les actions à
+# préfixe (ex. "valider_tache_operateur_<id>") sont rangées à part.
+_actions = {}
+_actions_prefixees = {}
+
+CHAMPS_MESURE = ('ciment', 'sable', 'agent_moussant', 'fibre_verre', 'dsp_xl', 'hdr', 'eau')
+ETAPES_MELANGE = (
+    'etape_verser_eau',
+    'etape_ajouter_fibre',
+    'etape_melanger_1min',
+    'etape_verser_ciment',
+    'etape_ajuster_eau',
+    'etape_mesurer_densite',
+)
+MESSAGE_VALEURS_INVALIDES = "Les valeurs saisies ne sont pas valides. Veuillez vérifier vos données."
+
+
+class ActionRefusee(Exception):
+    pass
+
+
+class Action:
+    def __init__(self, nom, fonction, charge, controleur):
+        self.nom = nom
+        self.fonction = fonction
+        # Relations de la fiche à charger avec select_related avant l'appel
+        self.charge = charge
+        # Action ouverte au contrôleur de la fiche, et pas seulement à l'opérateur
+        self.controleur = controleur
+
+
+def action(nom, charge=(), prefixe=False, controleur=False):
+    def decorateur(fonction):
+        registre = _actions_prefixees if prefixe else _actions
+        registre[nom] = Action(nom, fonction, tuple(charge), controleur)
+        return fonction
+    return decorateur
+
+
+def resoudre(nom):
+    """Renvoie (action, argument) pour un nom d'action POST, ou (None, None)."""
+    if not nom:
+        return None, None
+    if nom in _actions:
+        return _actions[nom], None
+    for prefixe, act in _actions_prefixees.items():
+        if nom.startswith(prefixe):
+            return act, nom[len(prefixe):]
+    return None, None
+
+
+def _nombre(donnees, nom):
+    # Valeur numérique saisie, None si vide ; ActionRefusee pour du texte ou
+    # un type JSON inattendu (objet, liste)
+    valeur = donnees.get(nom)
+    if valeur in (None, ''):
+        return None
+    try:
+        nombre = float(valeur)
+    except (TypeError, ValueError):
+        raise ActionRefusee(MESSAGE_VALEURS_INVALIDES)
+    if not math.isfinite(nombre):
+        raise ActionRefusee(MESSAGE_VALEURS_INVALIDES)
+    return nombre
+
+
+def _coche(donnees, nom):
+    # Case à cocher : présente dans un formulaire, ou booléen dans du JSON
+    return nom in donnees and donnees.get(nom) not in (None, False, '', 'false', '0')
+
+
+def _diffuser_validation(fiche, objet, role, utilisateur, quand):
+    diffusion.publier(
+        fiche.id, 'validation', objet=objet, role=role,
+        par=utilisateur.get_full_name(), date=dateformat.format(timezone.localtime(quand), 'd/m/Y H:i'),
+    )
+
+
+def relation(fiche, nom):
+    try:
+        return getattr(fiche, nom)
+    except (MesureComposants.DoesNotExist, MelangeMortier.DoesNotExist):
+        return None
+
+
+# --- Incidents et retour d'expérience ---
+
+@action('add_incident', controleur=True)
+def ajouter_incident(request, fiche, donnees, argument):
+    description = donnees.get('incident_description')
+    if description:
+        incident = Incident.objects.create(description=description)
+        fiche.incidents.add(incident)
+        diffusion.publier(
+            fiche.id, 'incident', description=description,
+            date=dateformat.format(timezone.localtime(incident.date), 'd/m/Y H:i'),
+        )
+
+
+@action('add_retour', charge=('retour_experience',), controleur=True)
+def ajouter_retour(request, fiche, donnees, argument):
+    commentaire = donnees.get('retour_commentaire')
+    if not commentaire:
+        return
+    if fiche.retour_experience:
+        fiche.retour_experience.commentaire = commentaire
+        fiche.retour_experience.save()
+    else:
+        fiche.retour_experience = RetourExperience.objects.create(commentaire=commentaire)
+        fiche.save(update_fields=['retour_experience'])
+    diffusion.publier(fiche.id, 'retour', commentaire=commentaire)
+
+
+# --- Validations globales et par étape ---
+
+@action('valider_fiche_operateur')
+def valider_fiche_operateur(request, fiche, donnees, argument):
+    quand = timezone.now()
+    if request.user.id == fiche.operateur_id and type(fiche).objects.filter(id=fiche.id, valide_par_operateur__isnull=True).update(
+        valide_par_operateur=request.user, date_validation_operateur=quand
+    ):
+        _diffuser_validation(fiche, 'fiche', 'operateur', request.user, quand)
+
+
+@action('valider_fiche_controleur', controleur=True)
+def valider_fiche_controleur(request, fiche, donnees, argument):
+    quand = timezone.now()
+    if request.user.id == fiche.controleur_id and type(fiche).objects.filter(id=fiche.id, valide_par_controleur__isnull=True).update(
+        valide_par_controleur=request.user, date_validation_controleur=quand
+    ):
+        _diffuser_validation(fiche, 'fiche', 'controleur', request.user, quand)
+
+
+@action('valider_tache_operateur_', prefixe=True)
+def valider_tache_operateur(request, fiche, donnees, tache_id):
+    quand = timezone.now()
+    if tache_id.isdigit() and request.user.id == fiche.operateur_id and Tache.objects.filter(
+        id=tache_id, fiche=fiche, valide_par_operateur__isnull=True
+    ).update(
+        valide_par_operateur=request.user, date_validation_operateur=quand,
+        # La tâche reprend la dernière signature déposée, sans copie d'image
+        signature_operateur=Subquery(signatures.derniere(request.user)),
+    ):
+        _diffuser_validation(fiche, f'tache-{tache_id}', 'operateur', request.user, quand)
+
+
+@action('valider_tache_controleur_', prefixe=True, controleur=True)
+def valider_tache_controleur(request, fiche, donnees, tache_id):
+    quand = timezone.now()
+    if tache_id.isdigit() and request.user.id == fiche.controleur_id and Tache.objects.filter(
+        id=tache_id, fiche=fiche, valide_par_controleur__isnull=True
+    ).update(
+        valide_par_controleur=request.user, date_validation_controleur=quand,
+        signature_controleur=Subquery(signatures.derniere(request.user)),
+    ):
+        _diffuser_validation(fiche, f'tache-{tache_id}', 'controleur', request.user, quand)
+
+
+# --- Étape fixe : mesure des composants ---
+
+@action('save_mesure_composants')
+def enregistrer_mesure_composants(request, fiche, donnees, argument):
+    data = {champ: _nombre(donnees, champ) for champ in CHAMPS_MESURE}
+    data['commentaires'] = donnees.get('commentaires_mesure', '')
+    MesureComposants.objects.update_or_create(fiche=fiche, defaults=data)
+    diffusion.publier(fiche.id, 'saisie', etape='mesure_composants')
+
+
+@action('valider_mesure_composants', charge=('mesure_composants',))
+def valider_mesure_composants(request, fiche, donnees, argument):
+    mesure = relation(fiche, 'mesure_composants')
+    if mesure is None:
+        raise ActionRefusee("Vous devez d'abord saisir les données de mesure des composants.")
+    for champ in CHAMPS_MESURE:
+        valeur = _nombre(donnees, champ)
+        if valeur is not None:
+            setattr(mesure, champ, valeur)
+    if 'commentaires_mesure' in donnees:
+        mesure.commentaires = donnees.get('commentaires_mesure')
+    mesure.save()
+
+    # Vérifier que tous les champs sont remplis
+    if not all(getattr(mesure, champ) is not None for champ in CHAMPS_MESURE) or not mesure.commentaires:
+        raise ActionRefusee("Tous les champs doivent être remplis avant de valider cette étape.")
+
+    mesure.valide = True
+    mesure.date_validation = timezone.now()
+    mesure.valide_par = request.user
+    mesure.save()
+    _diffuser_validation(fiche, 'mesure_composants', 'operateur', request.user, mesure.date_validation)
+    return {'message': "Étape de mesure des composants validée avec succès."}
+
+
+# --- Étape fixe : mélange du mortier ---
+
+def _densite_modifiee(melange):
+    # La densité d'un mélange déjà terminé entre dans les statistiques du jour
+    if melange.date_fin:
+        statistiques.planifier_recalcul(melange.fiche_id, melange.date_fin)
+
+
+def _lire_melange(melange, donnees):
+    densite = _nombre(donnees, 'densite')
+    if densite is not None:
+        melange.densite = densite
+    for etape in ETAPES_MELANGE:
+        setattr(melange, etape, _coche(donnees, etape))
+
+
+@action('save_melange_mortier', charge=('melange_mortier',))
+def enregistrer_melange_mortier(request, fiche, donnees, argument):
+    melange = relation(fiche, 'melange_mortier') or MelangeMortier(fiche=fiche)
+    melange.commentaires = donnees.get('commentaires_melange', '')
+    _lire_melange(melange, donnees)
+    melange.save()
+    _densite_modifiee(melange)
+    diffusion.publier(fiche.id, 'saisie', etape='melange_mortier')
+    return {'message': "Données du mélange du mortier enregistrées avec succès."}
+
+
+@action('valider_melange_mortier', charge=('mesure_composants', 'melange_mortier'))
+def valider_melange_mortier(request, fiche, donnees, argument):
+    verifier_mesure_validee(relation(fiche, 'mesure_composants'))
+    melange = relation(fiche, 'melange_mortier')
+    if melange is None:
+        raise ActionRefusee("Vous devez d'abord saisir les données de mélange du mortier.")
+    if 'commentaires_melange' in donnees:
+        melange.commentaires = donnees.get('commentaires_melange')
+    _lire_melange(melange, donnees)
+    melange.save()
+    _densite_modifiee(melange)
+
+    # Vérifier que tous les champs sont remplis
+    if melange.densite is None or not melange.commentaires or not all(getattr(melange, etape) for etape in ETAPES_MELANGE):
+        raise ActionRefusee("Tous les champs doivent être remplis et toutes les étapes doivent être cochées avant de valider cette étape.")
+
+    melange.valide = True
+    melange.date_validation = timezone.now()
+    melange.valide_par = request.user
+    melange.save()
+    _diffuser_validation(fiche, 'melange_mortier', 'operateur', request.user, melange.date_validation)
+    return {'message': "Étape de mélange du mortier validée avec succès."}
+
+
+# --- Gestion du temps des étapes fixes ---
+
+def _chrono(request, fiche, cible, transition):
+    objets = chrono.CIBLES[cible].objects.filter(fiche=fiche)
+    try:
+        return chrono.actionner(cible, objets, transition, request.user, fiche.id)
+    except chrono.TransitionRefusee as e:
+        raise ActionRefusee(str(e))
+
+
+@action('start_mesure_composants')
+def demarrer_mesure_composants(request, fiche, donnees, argument):
+    return _chrono(request, fiche, 'mesure_composants', 'start')
+
+
+@action('pause_mesure_composants')
+def pause_mesure_composants(request, fiche, donnees, argument):
+    return _chrono(request, fiche, 'mesure_composants', 'pause')
+
+
+@action('resume_mesure_composants')
+def reprendre_mesure_composants(request, fiche, donnees, argument):
+    return _chrono(request, fiche, 'mesure_composants', 'resume')
+
+
+@action('finish_mesure_composants')
+def terminer_mesure_composants(request, fiche, donnees, argument):
+    return _chrono(request, fiche, 'mesure_composants', 'finish')
+
+
+def verifier_mesure_validee(mesure):
+    # Le mélange ne peut démarrer qu'après validation de la mesure des composants
+    if mesure is None:
+        raise ActionRefusee("Vous devez d'abord compléter et valider l'étape de mesure des composants.")
+    if not mesure.valide:
+        raise ActionRefusee("Vous devez d'abord valider l'étape de mesure des composants.")
+
+
+@action('start_melange_mortier', charge=('mesure_composants',))
+def demarrer_melange_mortier(request, fiche, donnees, argument):
+    verifier_mesure_validee(relation(fiche, 'mesure_composants'))
+    return _chrono(request, fiche, 'melange_mortier', 'start')
+
+
+@action('pause_melange_mortier')
+def pause_melange_mortier(request, fiche, donnees, argument):
+    return _chrono(request, fiche, 'melange_mortier', 'pause')
+
+
+@action('resume_melange_mortier')
+def reprendre_melange_mortier(request, fiche, donnees, argument):
+    return _chrono(request, fiche, 'melange_mortier', 'resume')
+
+
+@action('finish_melange_mortier')
+def terminer_melange_mortier(request, fiche, donnees, argument):
+    return _chrono(request, fiche, 'melange_mortier', 'finish')
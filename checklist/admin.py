@@ -1,9 +1,226 @@
 from django.contrib import admin
-from .models import Atelier
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+from import_export.admin import ImportExportModelAdmin
+
+from .models import (
+    ActionSynchronisee, Atelier, DepotSignature, Etape, ExportLotPDF, ExportPDF, FicheArchivee, FicheSuivi, Incident,
+    MelangeMortier, MesureComposants, RetourExperience, Signature, StatistiqueJournaliere, Tache, TimerEvent,
+)
+from .resources import AtelierResource, EtapeResource, FicheSuiviResource, MesureComposantsResource
+
+# En dessous de ce nombre de lignes, le compte exact reste bon marché
+SEUIL_COMPTE_EXACT = 10000
+
+
+class PaginationEstimee(Paginator):
+    """
+    Paginator dont le nombre total est estimé pour une liste non filtrée :
+    statistiques du planificateur sous PostgreSQL, plus grand identifiant sous
+    SQLite. Une liste filtrée ou une petite table garde le COUNT(*) exact.
+    """
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimation = self._estimation(self.object_list)
+            if estimation is not None and estimation > SEUIL_COMPTE_EXACT:
+                return estimation
+        return super().count
+
+    @staticmethod
+    def _estimation(queryset):
+        connexion = connections[queryset.db]
+        if connexion.vendor == 'postgresql':
+            with connexion.cursor() as cursor:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+                ligne = cursor.fetchone()
+            return ligne[0] if ligne and ligne[0] > 0 else None
+        # Identifiants auto-incrémentés : un seul saut dans l'index de clé primaire
+        return queryset.model._default_manager.using(queryset.db).aggregate(n=Max('pk'))['n']
+
+
+class GrandeTableAdmin(admin.ModelAdmin):
+    # Pas de second COUNT(*) pour le total non filtré, nombre de pages estimé
+    paginator = PaginationEstimee
+    show_full_result_count = False
+    # Champ de la fiche : un numéro saisi dans la recherche passe par son
+    # index, au lieu d'un CAST en texte qui parcourt toute la table
+    recherche_fiche = None
+    ordering = ("-pk",)
+
+    def get_search_results(self, request, queryset, search_term):
+        terme = search_term.strip()
+        if self.recherche_fiche and terme.isdigit():
+            return queryset.filter(**{self.recherche_fiche: int(terme)}), False
+        return super().get_search_results(request, queryset, search_term)
+
 
-# Register your models here.
 @admin.register(Atelier)
-class AtelierAdmin(admin.ModelAdmin):
+class AtelierAdmin(ImportExportModelAdmin):
+    resource_classes = [AtelierResource]
     list_display = ("id", "nom")
     search_fields = ("nom",)
     list_filter = ("nom",)
+
+
+@admin.register(Etape)
+class EtapeAdmin(ImportExportModelAdmin):
+    resource_classes = [EtapeResource]
+    list_display = ("ordre", "nom")
+    search_fields = ("nom",)
+    ordering = ("ordre",)
+
+
+@admin.register(FicheSuivi)
+class FicheSuiviAdmin(GrandeTableAdmin, ImportExportModelAdmin):
+    resource_classes = [FicheSuiviResource]
+    list_display = ("id", "atelier", "operateur", "controleur", "date_creation", "date_validation_operateur", "date_validation_controleur")
+    list_select_related = ("atelier", "operateur", "controleur")
+    list_filter = ("atelier",)
+    search_fields = ("atelier__nom", "operateur__username", "controleur__username")
+    recherche_fiche = "id"
+    date_hierarchy = "date_creation"
+    ordering = ("-date_creation",)
+    autocomplete_fields = ("atelier", "operateur", "controleur", "valide_par_operateur", "valide_par_controleur", "incidents")
+    raw_id_fields = ("retour_experience",)
+
+
+@admin.register(Tache)
+class TacheAdmin(GrandeTableAdmin):
+    list_display = ("id", "fiche", "etape", "validation", "date_debut", "date_fin", "duree")
+    list_select_related = ("fiche__atelier", "etape")
+    list_filter = ("validation", "etape")
+    search_fields = ("etape__nom",)
+    recherche_fiche = "fiche_id"
+    autocomplete_fields = ("fiche", "etape", "valide_par_operateur", "valide_par_controleur", "signature_operateur", "signature_controleur")
+
+    def get_queryset(self, request):
+        # str(tache) lit l'étape, y compris dans les listes d'autocomplétion ;
+        # la liste ne rajoute pas list_select_related à une requête déjà jointe
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
+
+@admin.register(Signature)
+class SignatureAdmin(admin.ModelAdmin):
+    # Déposées par l'application (image normalisée, nommée par son empreinte)
+    list_display = ("empreinte", "utilisateur", "largeur", "hauteur", "date_depot")
+    list_select_related = ("utilisateur",)
+    search_fields = ("empreinte", "utilisateur__username")
+    readonly_fields = ("empreinte", "fichier", "largeur", "hauteur")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(DepotSignature)
+class DepotSignatureAdmin(admin.ModelAdmin):
+    list_display = ("utilisateur", "signature", "date_depot")
+    list_select_related = ("utilisateur", "signature")
+    search_fields = ("utilisateur__username", "signature__empreinte")
+    autocomplete_fields = ("utilisateur", "signature")
+    ordering = ("-date_depot",)
+
+
+@admin.register(MesureComposants)
+class MesureComposantsAdmin(GrandeTableAdmin, ImportExportModelAdmin):
+    resource_classes = [MesureComposantsResource]
+    list_display = ("fiche", "valide", "date_validation", "duree")
+    list_select_related = ("fiche__atelier",)
+    list_filter = ("valide",)
+    search_fields = ("fiche__atelier__nom",)
+    recherche_fiche = "fiche_id"
+    autocomplete_fields = ("fiche", "valide_par")
+
+
+@admin.register(MelangeMortier)
+class MelangeMortierAdmin(GrandeTableAdmin):
+    list_display = ("fiche", "densite", "valide", "date_validation", "duree")
+    list_select_related = ("fiche__atelier",)
+    list_filter = ("valide",)
+    search_fields = ("fiche__atelier__nom",)
+    recherche_fiche = "fiche_id"
+    autocomplete_fields = ("fiche", "valide_par")
+
+
+@admin.register(Incident)
+class IncidentAdmin(GrandeTableAdmin):
+    list_display = ("id", "date", "description")
+    search_fields = ("description",)
+    date_hierarchy = "date"
+
+
+@admin.register(RetourExperience)
+class RetourExperienceAdmin(GrandeTableAdmin):
+    list_display = ("id", "date", "commentaire")
+    search_fields = ("commentaire",)
+
+
+@admin.register(TimerEvent)
+class TimerEventAdmin(GrandeTableAdmin):
+    list_display = ("id", "fiche_id", "etape", "tache_id", "type", "horodatage", "utilisateur")
+    list_select_related = ("utilisateur",)
+    list_filter = ("etape", "type")
+    search_fields = ("fiche__atelier__nom",)
+    recherche_fiche = "fiche_id"
+    autocomplete_fields = ("fiche", "tache", "utilisateur")
+
+
+@admin.register(ExportPDF)
+class ExportPDFAdmin(GrandeTableAdmin):
+    list_display = ("id", "fiche_id", "archive_id", "statut", "date_demande", "date_fin")
+    list_filter = ("statut",)
+    search_fields = ("fiche__atelier__nom",)
+    recherche_fiche = "fiche_id"
+    autocomplete_fields = ("fiche", "archive")
+
+
+@admin.register(ExportLotPDF)
+class ExportLotPDFAdmin(admin.ModelAdmin):
+    list_display = ("id", "utilisateur", "atelier", "debut", "fin", "statut", "date_demande", "date_fin")
+    list_select_related = ("utilisateur", "atelier")
+    list_filter = ("statut",)
+    autocomplete_fields = ("utilisateur", "atelier")
+
+
+@admin.register(StatistiqueJournaliere)
+class StatistiqueJournaliereAdmin(GrandeTableAdmin):
+    list_display = ("jour", "atelier", "type_etape", "etape", "nombre", "duree_totale", "nombre_non_conforme")
+    list_select_related = ("atelier", "etape")
+    list_filter = ("type_etape", "atelier")
+    date_hierarchy = "jour"
+    autocomplete_fields = ("atelier", "etape")
+    readonly_fields = ("cle",)
+
+    def save_model(self, request, obj, form, change):
+        obj.cle = StatistiqueJournaliere.calculer_cle(obj.jour, obj.atelier_id, obj.type_etape, obj.etape_id)
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(ActionSynchronisee)
+class ActionSynchroniseeAdmin(GrandeTableAdmin):
+    list_display = ("id", "utilisateur", "fiche_id", "action", "statut", "horodatage_client", "date_reception")
+    list_select_related = ("utilisateur",)
+    list_filter = ("statut",)
+    search_fields = ("cle",)
+    recherche_fiche = "fiche_id"
+    autocomplete_fields = ("utilisateur", "fiche")
+
+
+@admin.register(FicheArchivee)
+class FicheArchiveeAdmin(GrandeTableAdmin):
+    list_display = ("id", "atelier", "operateur", "controleur", "date_creation", "date_archivage")
+    list_select_related = ("atelier", "operateur", "controleur")
+    list_filter = ("atelier",)
+    search_fields = ("atelier__nom", "operateur__username", "controleur__username")
+    recherche_fiche = "id"
+    date_hierarchy = "date_creation"
+    # L'instantané compressé n'est lisible que par archives.restaurer
+    exclude = ("contenu",)
+    readonly_fields = ("id", "atelier", "operateur", "controleur", "date_creation", "date_archivage")
+
+    def has_add_permission(self, request):
+        return False
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ChecklistConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'checklist'
+
+    def ready(self):
+        # Enregistrement des signaux d'invalidation du cache de référence
+        # et des versions de fiches, des vérifications de configuration et
+        # instrumentation des connexions
+        from . import cache_fiches, checks, metriques, referentiel, requetes  # noqa: F401
@@ -0,0 +1,156 @@
+import logging
+import multiprocessing
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import exports, pdf, rendu_pdf
+from .models import ExportLotPDF
+
+logger = logging.getLogger(__name__)
+
+# Export PDF d'un lot de fiches dans une seule archive ZIP. Le HTML est rendu
+# ici (ORM et gabarits Django) ; la conversion en PDF, qui prend le CPU, part
+# dans des processus de travail déjà chauds. Les PDF déjà en cache sur disque
+# sont repris tels quels. Les archives demandées depuis le site sont construites
+# par traiter_exports_pdf (generer_lot), jamais dans un processus web.
+
+
+def nombre_processus():
+    return settings.PDF_LOT_PROCESSUS or os.cpu_count() or 1
+
+
+def _nouveau_pool(processus):
+    # spawn : les processus ne partagent ni les connexions ni les threads du serveur
+    return ProcessPoolExecutor(
+        max_workers=processus,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=rendu_pdf.prechauffer,
+    )
+
+
+class _Tampon:
+    # Sortie de ZipFile sans seek : les octets écrits sont repris après chaque fichier
+    def __init__(self):
+        self.morceaux = []
+        self.position = 0
+
+    def write(self, donnees):
+        self.morceaux.append(bytes(donnees))
+        self.position += len(donnees)
+        return len(donnees)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def vider(self):
+        contenu = b''.join(self.morceaux)
+        self.morceaux = []
+        return contenu
+
+
+def _pages(fiches, archivees):
+    # (identifiant, HTML) des fiches courantes, tâches et incidents préchargés
+    # par paquet de TAILLE_LOT fiches, puis des fiches archivées
+    for fiche in pdf.pour_rendu(fiches).order_by('id').iterator(chunk_size=exports.TAILLE_LOT):
+        yield fiche.id, pdf.rendre_html(fiche)
+    if archivees is not None:
+        for restauree in exports.restaurees(archivees):
+            yield restauree.fiche.id, pdf.rendre_html_archive(restauree)
+
+
+def flux_zip(fiches, processus, archivees=None):
+    """
+    Archive ZIP des PDF des fiches, produite morceau par morceau. Au plus deux
+    conversions par processus sont en cours : la mémoire ne dépend pas du
+    nombre de fiches. Une fiche en échec est remplacée par un fichier .txt.
+    Les fiches archivées (`archivees`) suivent les fiches courantes.
+
+    Le pool de `processus` processus est créé pour l'export puis arrêté.
+    """
+    pool = _nouveau_pool(processus)
+    taille_fenetre = 2 * processus
+    fenetre = deque()
+    tampon = _Tampon()
+
+    def ecrire(archive):
+        fiche_id, empreinte, resultat = fenetre.popleft()
+        try:
+            if empreinte is None:
+                contenu = resultat.read_bytes()
+            else:
+                contenu = resultat.result()
+                pdf.ecrire_cache(empreinte, contenu)
+        except (OSError, rendu_pdf.ErreurRenduPDF) as e:
+            logger.exception("Échec de l'export PDF de la fiche %s", fiche_id)
+            archive.writestr(f'fiche_{fiche_id}.erreur.txt', str(e))
+        else:
+            archive.writestr(f'fiche_{fiche_id}.pdf', contenu)
+
+    try:
+        # Les PDF sont déjà compressés : stockés sans recompression
+        with zipfile.ZipFile(tampon, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for fiche_id, html in _pages(fiches, archivees):
+                empreinte = pdf.calculer_empreinte(html)
+                chemin = pdf.en_cache(empreinte)
+                if chemin:
+                    fenetre.append((fiche_id, None, chemin))
+                else:
+                    fenetre.append((fiche_id, empreinte, pool.submit(rendu_pdf.convertir, html)))
+                while len(fenetre) >= taille_fenetre:
+                    ecrire(archive)
+                    yield tampon.vider()
+            while fenetre:
+                ecrire(archive)
+                yield tampon.vider()
+        yield tampon.vider()
+    finally:
+        # Client parti en cours de route : les conversions en attente sont abandonnées
+        for _, empreinte, resultat in fenetre:
+            if empreinte is not None:
+                resultat.cancel()
+        pool.shutdown(cancel_futures=True)
+
+
+def chemin_lot(export_id):
+    return Path(settings.PDF_EXPORT_DIR) / 'lots' / f'{export_id}.zip'
+
+
+def generer_lot(export, processus):
+    """Construit l'archive d'un export par lot et met à jour son statut dans la file."""
+    ExportLotPDF.objects.filter(id=export.id).update(statut='en_cours')
+    filtres = (export.atelier_id, export.debut, export.fin)
+    chemin = chemin_lot(export.id)
+    chemin.parent.mkdir(parents=True, exist_ok=True)
+    # Écriture atomique : l'archive n'est servie qu'une fois complète
+    temporaire = chemin.with_suffix('.tmp')
+    try:
+        with open(temporaire, 'wb') as sortie:
+            for morceau in flux_zip(exports.filtrer_fiches(*filtres), processus, exports.filtrer_archives(*filtres)):
+                sortie.write(morceau)
+        os.replace(temporaire, chemin)
+    except Exception as e:
+        logger.exception("Échec de l'export PDF par lot %s", export.id)
+        temporaire.unlink(missing_ok=True)
+        ExportLotPDF.objects.filter(id=export.id).update(statut='erreur', erreur=str(e), date_fin=timezone.now())
+        return False
+    ExportLotPDF.objects.filter(id=export.id).update(statut='termine', erreur='', date_fin=timezone.now())
+    return True
+
+
+def purger_lots(age_max):
+    """Supprime les exports par lot finis depuis `age_max` (timedelta) et leurs archives ; renvoie leur nombre."""
+    anciens = ExportLotPDF.objects.filter(statut__in=['termine', 'erreur'], date_fin__lt=timezone.now() - age_max)
+    identifiants = list(anciens.values_list('id', flat=True))
+    for export_id in identifiants:
+        chemin_lot(export_id).unlink(missing_ok=True)
+    ExportLotPDF.objects.filter(id__in=identifiants).delete()
+    return len(identifiants)
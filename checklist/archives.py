@@ -0,0 +1,187 @@
+import json
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from . import cache_fiches
+from .models import (
+    ActionSynchronisee, Atelier, Etape, ExportPDF, FicheArchivee, FicheSuivi, Incident, MelangeMortier,
+    MesureComposants, RetourExperience, Tache, TimerEvent,
+)
+
+# Archivage des fiches closes : chaque fiche validée par l'opérateur et le
+# contrôleur devient une ligne de FicheArchivee (instantané JSON compressé)
+# et quitte les tables courantes avec ses tâches, mesures et incidents.
+
+# Version du format de l'instantané
+FORMAT = 1
+# Seuls ces champs des comptes sont copiés dans l'instantané, jamais le mot de passe
+CHAMPS_COMPTE = ('username', 'first_name', 'last_name')
+# Identifiants par requête DELETE : sous la limite de paramètres de SQLite
+PAQUET = 500
+
+
+def archivables(jours):
+    """Fiches validées des deux côtés, créées il y a plus de `jours` jours."""
+    return FicheSuivi.objects.filter(
+        valide_par_operateur__isnull=False,
+        valide_par_controleur__isnull=False,
+        date_creation__lt=timezone.now() - timedelta(days=jours),
+    )
+
+
+def _pour_instantane(fiches):
+    return fiches.select_related(
+        'atelier', 'operateur', 'controleur', 'valide_par_operateur', 'valide_par_controleur', 'retour_experience',
+        'mesure_composants__valide_par', 'melange_mortier__valide_par',
+    ).prefetch_related(
+        Prefetch('taches', queryset=Tache.objects.select_related('etape', 'valide_par_operateur', 'valide_par_controleur')),
+        'incidents',
+        Prefetch('evenements_chrono', queryset=TimerEvent.objects.select_related('utilisateur')),
+    )
+
+
+def _relation(objet, nom):
+    try:
+        return getattr(objet, nom)
+    except (MesureComposants.DoesNotExist, MelangeMortier.DoesNotExist):
+        return None
+
+
+def instantane(fiche):
+    """Instantané compressé d'une fiche lue par _pour_instantane."""
+    taches = list(fiche.taches.all())
+    evenements = list(fiche.evenements_chrono.all())
+    etapes = {tache.etape_id: tache.etape for tache in taches}
+    annexes = [
+        objet for objet in (
+            fiche.retour_experience, _relation(fiche, 'mesure_composants'), _relation(fiche, 'melange_mortier'),
+        ) if objet is not None
+    ]
+    comptes = {
+        compte.id: compte for compte in (
+            fiche.operateur, fiche.controleur, fiche.valide_par_operateur, fiche.valide_par_controleur,
+            *(getattr(objet, 'valide_par', None) for objet in annexes),
+            *(compte for tache in taches for compte in (tache.valide_par_operateur, tache.valide_par_controleur)),
+            *(evenement.utilisateur for evenement in evenements),
+        ) if compte is not None
+    }
+    objets = [fiche, fiche.atelier, *annexes, *etapes.values(), *taches, *fiche.incidents.all(), *evenements]
+    donnees = {
+        'format': FORMAT,
+        'objets': serializers.serialize('python', objets),
+        'comptes': serializers.serialize('python', comptes.values(), fields=CHAMPS_COMPTE),
+    }
+    return zlib.compress(json.dumps(donnees, cls=DjangoJSONEncoder, separators=(',', ':')).encode())
+
+
+class FicheRestauree:
+    """
+    Fiche archivée remise en objets du modèle, sans lecture en base : les
+    gabarits et les exports la lisent comme une fiche courante.
+    """
+
+    def __init__(self, contenu):
+        donnees = json.loads(zlib.decompress(contenu))
+        comptes = {objet.object.pk: objet.object for objet in serializers.deserialize('python', donnees['comptes'])}
+        par_modele = defaultdict(list)
+        for objet in serializers.deserialize('python', donnees['objets']):
+            par_modele[type(objet.object)].append(objet.object)
+
+        self.fiche = fiche = par_modele[FicheSuivi][0]
+        fiche.atelier = par_modele[Atelier][0]
+        for champ in ('operateur', 'controleur', 'valide_par_operateur', 'valide_par_controleur'):
+            setattr(fiche, champ, comptes.get(getattr(fiche, f'{champ}_id')))
+        self.retour_experience = next(iter(par_modele[RetourExperience]), None)
+        fiche.retour_experience = self.retour_experience
+        self.mesure_composants = next(iter(par_modele[MesureComposants]), None)
+        self.melange_mortier = next(iter(par_modele[MelangeMortier]), None)
+        for objet in (self.mesure_composants, self.melange_mortier):
+            if objet is not None:
+                objet.valide_par = comptes.get(objet.valide_par_id)
+
+        etapes = {etape.id: etape for etape in par_modele[Etape]}
+        for tache in par_modele[Tache]:
+            tache.etape = etapes[tache.etape_id]
+            tache.valide_par_operateur = comptes.get(tache.valide_par_operateur_id)
+            tache.valide_par_controleur = comptes.get(tache.valide_par_controleur_id)
+        self.taches = sorted(par_modele[Tache], key=lambda tache: tache.etape.ordre)
+        self.incidents = sorted(par_modele[Incident], key=lambda incident: incident.date, reverse=True)
+        self.evenements = sorted(par_modele[TimerEvent], key=lambda evenement: evenement.horodatage)
+
+
+def restaurer(archive):
+    return FicheRestauree(archive.contenu)
+
+
+def _par_paquets(ids):
+    for i in range(0, len(ids), PAQUET):
+        yield ids[i:i + PAQUET]
+
+
+def _supprimer(cursor, modele, colonne, ids):
+    qn = connection.ops.quote_name
+    for paquet in _par_paquets(ids):
+        cursor.execute(
+            f"DELETE FROM {qn(modele._meta.db_table)} WHERE {qn(colonne)} IN ({', '.join(['%s'] * len(paquet))})", paquet,
+        )
+
+
+def _derniere_fin(fiche):
+    # Fin de la dernière étape terminée, repère des statistiques conservées
+    fins = [
+        objet.date_fin for objet in (
+            *fiche.taches.all(), _relation(fiche, 'mesure_composants'), _relation(fiche, 'melange_mortier'),
+        ) if objet is not None and objet.date_fin
+    ]
+    return max(fins, default=None)
+
+
+def archiver(fiche_ids):
+    """
+    Archive les fiches archivables parmi `fiche_ids`, à appeler dans une
+    transaction. Les lignes courantes sont supprimées en SQL, dépendances
+    d'abord : les signaux ligne par ligne sont remplacés par une
+    invalidation du cache par fiche. Renvoie le nombre de fiches archivées.
+    """
+    fiches = list(_pour_instantane(
+        FicheSuivi.objects.filter(id__in=fiche_ids, valide_par_operateur__isnull=False, valide_par_controleur__isnull=False)
+    ).order_by('id'))
+    if not fiches:
+        return 0
+    FicheArchivee.objects.bulk_create([
+        FicheArchivee(
+            id=fiche.id, operateur_id=fiche.operateur_id, controleur_id=fiche.controleur_id,
+            atelier_id=fiche.atelier_id, date_creation=fiche.date_creation, derniere_fin=_derniere_fin(fiche),
+            contenu=instantane(fiche),
+        )
+        for fiche in fiches
+    ])
+
+    ids = [fiche.id for fiche in fiches]
+    liens = FicheSuivi.incidents.through
+    incidents = sorted({incident.id for fiche in fiches for incident in fiche.incidents.all()})
+    retours = [fiche.retour_experience_id for fiche in fiches if fiche.retour_experience_id]
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for modele in (TimerEvent, ExportPDF, ActionSynchronisee, Tache, MesureComposants, MelangeMortier):
+            _supprimer(cursor, modele, 'fiche_id', ids)
+        _supprimer(cursor, liens, 'fichesuivi_id', ids)
+        # Un incident encore lié à une fiche courante est conservé
+        table, table_liens = qn(Incident._meta.db_table), qn(liens._meta.db_table)
+        for paquet in _par_paquets(incidents):
+            cursor.execute(
+                f"DELETE FROM {table} WHERE {qn('id')} IN ({', '.join(['%s'] * len(paquet))}) "
+                f"AND NOT EXISTS (SELECT 1 FROM {table_liens} l WHERE l.{qn('incident_id')} = {table}.{qn('id')})",
+                paquet,
+            )
+        _supprimer(cursor, FicheSuivi, 'id', ids)
+        _supprimer(cursor, RetourExperience, 'id', retours)
+    cache_fiches.invalider(*ids)
+    return len(fiches)
@@ -0,0 +1,135 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from django.contrib.auth.models import User
+
+from .models import Atelier, Etape, FicheSuivi, Incident, MelangeMortier, MesureComposants, RetourExperience, Tache
+
+# Chaque fiche a un numéro de version dans le cache. Les fragments et pages
+# mis en cache portent ce numéro dans leur clé : changer la version rend
+# toutes les anciennes entrées inaccessibles, sans avoir à les retrouver.
+# Une génération commune s'y ajoute, pour les données affichées sur toutes
+# les fiches (noms d'étapes, d'ateliers, d'utilisateurs).
+_GENERATION = 'fiches:generation'
+
+
+def _cle(fiche_id):
+    return f'fiche:{fiche_id}:version'
+
+
+def _initialiser(cle):
+    # Une version perdue (expiration, redémarrage) repart d'une valeur
+    # jamais utilisée, pour ne pas retomber sur d'anciennes entrées.
+    cache.add(cle, time.time_ns(), None)
+    return cache.get(cle)
+
+
+def version(fiche_id):
+    """Version courante d'une fiche, à lire avant les données qu'elle protège."""
+    valeurs = cache.get_many([_GENERATION, _cle(fiche_id)])
+    generation = valeurs.get(_GENERATION) or _initialiser(_GENERATION)
+    valeur = valeurs.get(_cle(fiche_id)) or _initialiser(_cle(fiche_id))
+    return f'{generation}.{valeur}'
+
+
+def _renouveler(cles):
+    # Nouvelle valeur unique plutôt que cache.incr : sur le cache fichier,
+    # incr lit puis réécrit la valeur, et deux invalidations simultanées
+    # écriraient le même N+1, la seconde laissant la version inchangée.
+    cache.set_many({cle: time.time_ns() for cle in cles}, None)
+
+
+def invalider(*fiche_ids):
+    """Change la version des fiches une fois la transaction en cours validée."""
+    fiche_ids = {fiche_id for fiche_id in fiche_ids if fiche_id}
+    if fiche_ids:
+        transaction.on_commit(lambda: _renouveler([_cle(fiche_id) for fiche_id in fiche_ids]))
+
+
+def invalider_tout():
+    """Change la version de toutes les fiches une fois la transaction en cours validée."""
+    transaction.on_commit(lambda: _renouveler([_GENERATION]))
+
+
+def cle_client(request):
+    """
+    Partie de clé propre au client : utilisateur et cookie CSRF.
+
+    Les formulaires mis en cache contiennent un jeton CSRF dérivé du cookie ;
+    sans cookie il n'y a rien à réutiliser et None est renvoyé.
+    """
+    cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if not cookie:
+        return None
+    return f'{request.user.id}:{cookie}'
+
+
+def cle_page(fiche_id, version_fiche, client):
+    return f'fiche:{fiche_id}:page:{version_fiche}:{client}'
+
+
+@receiver(post_save, sender=FicheSuivi)
+@receiver(post_delete, sender=FicheSuivi)
+def _fiche_modifiee(sender, instance, **kwargs):
+    invalider(instance.id)
+
+
+@receiver(post_save, sender=Tache)
+@receiver(post_delete, sender=Tache)
+@receiver(post_save, sender=MesureComposants)
+@receiver(post_delete, sender=MesureComposants)
+@receiver(post_save, sender=MelangeMortier)
+@receiver(post_delete, sender=MelangeMortier)
+def _etape_modifiee(sender, instance, **kwargs):
+    invalider(instance.fiche_id)
+
+
+# pre_delete : après la suppression, le lien avec les fiches n'existe plus.
+# Un objet tout juste créé n'est encore lié à aucune fiche : le lien
+# (m2m_changed, enregistrement de la fiche) invalide lui-même.
+@receiver(post_save, sender=Incident)
+@receiver(pre_delete, sender=Incident)
+def _incident_modifie(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    invalider(*FicheSuivi.objects.filter(incidents=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=RetourExperience)
+@receiver(pre_delete, sender=RetourExperience)
+def _retour_modifie(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    invalider(*FicheSuivi.objects.filter(retour_experience=instance).values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=FicheSuivi.incidents.through)
+def _incidents_modifies(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # Vidage depuis un incident : les fiches ne sont connues qu'avant
+        invalider(*FicheSuivi.objects.filter(incidents=instance).values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        invalider(*(pk_set or ()) if reverse else (instance.id,))
+
+
+# Noms affichés sur les fiches : une modification périme toutes les fiches
+@receiver(post_save, sender=Etape)
+@receiver(post_delete, sender=Etape)
+@receiver(post_save, sender=Atelier)
+@receiver(post_delete, sender=Atelier)
+def _reference_modifiee(sender, **kwargs):
+    invalider_tout()
+
+
+@receiver(post_save, sender=User)
+def _utilisateur_modifie(sender, created, update_fields=None, **kwargs):
+    # Un nouveau compte ne figure sur aucune fiche ; la mise à jour de
+    # last_login à chaque connexion ne change pas les noms affichés.
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    invalider_tout()
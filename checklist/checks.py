@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache propre à chaque processus : les versions des fiches et du référentiel
+# n'y sont pas partagées, les autres processus servent des données périmées.
+CACHES_LOCAUX = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def verifier_cache_partage(app_configs, **kwargs):
+    if settings.CACHES['default']['BACKEND'] not in CACHES_LOCAUX:
+        return []
+    return [Warning(
+        "Le cache par défaut n'est pas partagé entre les processus du serveur.",
+        hint="Avec plusieurs processus, utilisez un cache fichier (CACHE_DIR) ou Redis (REDIS_URL).",
+        id='checklist.W001',
+    )]
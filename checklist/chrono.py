@@ -0,0 +1,159 @@
+from datetime import timedelta
+
+from django.db.models import Case, DateTimeField, DurationField, F, Q, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import cache_fiches, diffusion, statistiques
+from .models import MelangeMortier, MesureComposants, Tache, TimerEvent
+
+# Étapes chronométrées, par nom d'URL
+CIBLES = {
+    'mesure_composants': MesureComposants,
+    'melange_mortier': MelangeMortier,
+    'tache': Tache,
+}
+
+TRANSITIONS = ('start', 'pause', 'resume', 'finish')
+
+ETATS = {
+    'non_demarre': {'status': 'Non démarré', 'has_pause': False, 'has_finish': False, 'has_start': True, 'has_resume': False},
+    'en_cours': {'status': 'En cours', 'has_pause': True, 'has_finish': True, 'has_start': False, 'has_resume': False},
+    'en_pause': {'status': 'En pause', 'has_pause': False, 'has_finish': True, 'has_start': False, 'has_resume': True},
+    'termine': {'status': 'Terminé', 'has_pause': False, 'has_finish': False, 'has_start': False, 'has_resume': False},
+}
+
+CHAMPS_ETAT = ('date_debut', 'date_pause', 'date_fin', 'duree', 'duree_pause')
+# Champ qui reçoit l'heure de chaque transition
+CHAMPS_TRANSITION = {'start': 'date_debut', 'pause': 'date_pause', 'resume': 'date_reprise', 'finish': 'date_fin'}
+
+
+class TransitionRefusee(Exception):
+    def __init__(self, message, etat=None):
+        super().__init__(message)
+        # État courant du chronomètre, renvoyé au client pour qu'il se recale
+        self.etat = etat
+
+
+class ChronometreIntrouvable(TransitionRefusee):
+    pass
+
+
+def _cumul(champ, ajout):
+    return Coalesce(F(champ), Value(timedelta(0)), output_field=DurationField()) + ajout
+
+
+def _au_plus_tot(quand, *champs):
+    # Une heure de tablette antérieure à la transition précédente (actions
+    # hors ligne rejouées dans le désordre) y est ramenée : pas de durée négative
+    return Greatest(quand, Coalesce(*(F(champ) for champ in champs), quand), output_field=DateTimeField())
+
+
+def _changement(transition, quand):
+    """
+    Condition de départ et valeurs à écrire pour une transition du chronomètre.
+
+    Les durées sont cumulées au fil des transitions : le temps actif dans
+    ``duree`` à chaque pause ou fin, le temps en pause dans ``duree_pause``
+    à chaque reprise ou fin. L'heure d'une transition n'est jamais antérieure
+    à celle de la précédente.
+    """
+    maintenant = Value(quand, output_field=DateTimeField())
+    if transition == 'start':
+        return Q(date_debut__isnull=True), {'date_debut': maintenant, 'date_reprise': maintenant}
+    if transition == 'pause':
+        pause = _au_plus_tot(maintenant, 'date_reprise')
+        return Q(date_debut__isnull=False, date_fin__isnull=True, date_pause__isnull=True), {
+            'date_pause': pause,
+            'duree': _cumul('duree', pause - F('date_reprise')),
+        }
+    if transition == 'resume':
+        reprise = _au_plus_tot(maintenant, 'date_pause')
+        return Q(date_pause__isnull=False, date_fin__isnull=True), {
+            'date_pause': None,
+            'date_reprise': reprise,
+            'duree_pause': _cumul('duree_pause', reprise - F('date_pause')),
+        }
+    if transition == 'finish':
+        # Si en pause, la durée active s'est arrêtée au moment de la pause
+        fin = _au_plus_tot(maintenant, 'date_pause', 'date_reprise')
+        return Q(date_debut__isnull=False, date_fin__isnull=True), {
+            'date_fin': fin,
+            'date_pause': None,
+            'duree': Case(
+                When(date_pause__isnull=True, then=_cumul('duree', fin - F('date_reprise'))),
+                default=F('duree'),
+            ),
+            'duree_pause': Case(
+                When(date_pause__isnull=False, then=_cumul('duree_pause', fin - F('date_pause'))),
+                default=F('duree_pause'),
+            ),
+        }
+    raise ValueError(transition)
+
+
+def appliquer(queryset, transition, quand=None):
+    """Applique une transition en un seul UPDATE conditionnel ; renvoie le nombre de lignes modifiées."""
+    condition, valeurs = _changement(transition, quand or timezone.now())
+    return queryset.filter(condition).update(**valeurs)
+
+
+def etat(valeurs):
+    """État affichable d'un chronomètre à partir de ses champs (dict ou None)."""
+    if not valeurs or not valeurs['date_debut']:
+        cle = 'non_demarre'
+    elif valeurs['date_fin']:
+        cle = 'termine'
+    elif valeurs['date_pause']:
+        cle = 'en_pause'
+    else:
+        cle = 'en_cours'
+    duree = valeurs['duree'] if valeurs else None
+    duree_pause = valeurs['duree_pause'] if valeurs else None
+    return dict(
+        ETATS[cle],
+        duree=str(duree) if duree else None,
+        duree_pause=str(duree_pause) if duree_pause else None,
+    )
+
+
+def actionner(cible, queryset, transition, utilisateur=None, fiche_id=None, quand=None):
+    """
+    Applique une transition, l'inscrit au journal et renvoie le nouvel état.
+
+    Pour un démarrage, l'objet de l'étape fixe est créé s'il n'existe pas
+    encore (fiche_id est alors requis). Une fin d'étape met à jour les
+    statistiques du jour ; le nouvel état est diffusé aux autres appareils
+    ouverts sur la fiche.
+
+    Lève ChronometreIntrouvable si le queryset est vide, TransitionRefusee si
+    l'état ne permet pas la transition (un clic concurrent déjà appliqué
+    n'ajoute donc pas d'événement).
+    """
+    modele = CIBLES[cible]
+    quand = quand or timezone.now()
+    modifie = appliquer(queryset, transition, quand)
+    valeurs = queryset.values('id', 'fiche_id', 'date_reprise', *CHAMPS_ETAT).first()
+    if valeurs is None and transition == 'start' and fiche_id is not None and modele is not Tache:
+        objet, modifie = modele.objects.get_or_create(fiche_id=fiche_id, defaults={'date_debut': quand, 'date_reprise': quand})
+        valeurs = {champ: getattr(objet, champ) for champ in ('id', 'fiche_id', 'date_reprise') + CHAMPS_ETAT}
+    if valeurs is None:
+        raise ChronometreIntrouvable("Chronomètre introuvable.")
+    if not modifie:
+        courant = etat(valeurs)
+        raise TransitionRefusee(f"Action impossible : chronomètre {courant['status'].lower()}.", courant)
+    # Heure retenue pour la transition, après recalage sur la précédente
+    quand = valeurs[CHAMPS_TRANSITION[transition]]
+    cache_fiches.invalider(valeurs['fiche_id'])
+    TimerEvent.objects.create(
+        fiche_id=valeurs['fiche_id'],
+        etape=cible,
+        tache_id=valeurs['id'] if modele is Tache else None,
+        type=transition,
+        horodatage=quand,
+        utilisateur=utilisateur,
+    )
+    if transition == 'finish':
+        statistiques.planifier_recalcul(valeurs['fiche_id'], quand)
+    diffusion.publier(valeurs['fiche_id'], 'chrono', cible=cible, id=valeurs['id'], **etat(valeurs))
+    return etat(valeurs)
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+# Diffusion en direct des changements d'une fiche aux navigateurs abonnés
+# (flux SSE). Les abonnements vivent dans la boucle asyncio du serveur ASGI ;
+# les publications viennent des vues synchrones, exécutées dans d'autres
+# threads. Avec REDIS_URL, les événements passent par Redis (pub/sub) et
+# atteignent les abonnés de tous les processus ; sans, la diffusion est
+# propre au processus.
+
+TAILLE_FILE = 100
+CANAL = 'checklist:fiche:'
+
+logger = logging.getLogger(__name__)
+
+_abonnes = defaultdict(set)
+_verrou = threading.Lock()
+# Client Redis des publications, et tâche d'écoute du processus
+_client = None
+_ecoute = None
+
+
+class Abonnement:
+    """File d'événements d'une fiche pour un client, à utiliser avec ``async with``."""
+
+    def __init__(self, fiche_id):
+        self.fiche_id = fiche_id
+        self.boucle = None
+        self.file = asyncio.Queue(TAILLE_FILE)
+
+    async def __aenter__(self):
+        self.boucle = asyncio.get_running_loop()
+        if settings.REDIS_URL:
+            _ecouter_redis()
+        with _verrou:
+            _abonnes[self.fiche_id].add(self)
+        return self
+
+    async def __aexit__(self, *exc):
+        with _verrou:
+            abonnes = _abonnes.get(self.fiche_id)
+            if abonnes is not None:
+                abonnes.discard(self)
+                if not abonnes:
+                    del _abonnes[self.fiche_id]
+
+    def deposer(self, evenement):
+        # Appelé dans la boucle de l'abonné. Un client trop lent ne reçoit
+        # plus que l'ordre de recharger la page, plutôt que des trous.
+        if self.file.full():
+            while not self.file.empty():
+                self.file.get_nowait()
+            evenement = {'type': 'recharger'}
+        self.file.put_nowait(evenement)
+
+
+def _diffuser(fiche_id, evenement):
+    with _verrou:
+        abonnes = list(_abonnes.get(fiche_id, ()))
+    for abonnement in abonnes:
+        try:
+            abonnement.boucle.call_soon_threadsafe(abonnement.deposer, evenement)
+        except RuntimeError:
+            # Boucle fermée : le client est parti
+            pass
+
+
+def _publier_redis(fiche_id, evenement):
+    global _client
+    import redis
+
+    try:
+        if _client is None:
+            _client = redis.Redis.from_url(settings.REDIS_URL)
+        _client.publish(f'{CANAL}{fiche_id}', json.dumps(evenement, default=str))
+    except redis.RedisError:
+        # La modification est validée : les clients verront la nouvelle
+        # version à leur prochaine connexion.
+        logger.exception("Échec de la publication d'un événement de la fiche %s", fiche_id)
+
+
+def _ecouter_redis():
+    # Une seule tâche d'écoute par processus, relancée si elle s'est arrêtée
+    global _ecoute
+    boucle = asyncio.get_running_loop()
+    if _ecoute is None or _ecoute.done() or _ecoute.get_loop() is not boucle:
+        _ecoute = boucle.create_task(_relayer_redis())
+
+
+async def _relayer_redis():
+    import redis.asyncio as redis
+
+    while True:
+        try:
+            async with redis.Redis.from_url(settings.REDIS_URL) as client, client.pubsub() as abonnement:
+                await abonnement.psubscribe(f'{CANAL}*')
+                async for message in abonnement.listen():
+                    if message['type'] == 'pmessage':
+                        fiche_id = int(message['channel'].decode().removeprefix(CANAL))
+                        _diffuser(fiche_id, json.loads(message['data']))
+        except redis.RedisError:
+            logger.exception("Écoute Redis des événements de fiches interrompue")
+            await asyncio.sleep(1)
+
+
+def publier(fiche_id, type, **donnees):
+    """Envoie un événement aux abonnés de la fiche, une fois la transaction validée."""
+    evenement = {'type': type, **donnees}
+    if settings.REDIS_URL:
+        transaction.on_commit(lambda: _publier_redis(fiche_id, evenement))
+    else:
+        transaction.on_commit(lambda: _diffuser(fiche_id, evenement))
+
+
+def formater(evenement):
+    """Message SSE : le type en nom d'événement, le reste en JSON."""
+    donnees = {cle: valeur for cle, valeur in evenement.items() if cle != 'type'}
+    return f"event: {evenement['type']}\ndata: {json.dumps(donnees, default=str)}\n\n"
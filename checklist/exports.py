@@ -0,0 +1,141 @@
+import csv
+import pickle
+import tempfile
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from . import archives
+from .models import FicheArchivee, FicheSuivi, MesureComposants, Tache
+
+# Taille des lots lus en base : la mémoire reste constante quel que soit le volume
+TAILLE_LOT = 2000
+# Au-delà de cette taille (octets), les lignes mises de côté passent sur disque
+TAILLE_TAMPON = 4 * 1024 * 1024
+
+
+class Echo:
+    # Pseudo-fichier pour csv.writer : renvoie la ligne au lieu de l'écrire
+    def write(self, value):
+        return value
+
+
+def _filtrer(fiches, atelier_id, debut, fin):
+    if atelier_id:
+        fiches = fiches.filter(atelier_id=atelier_id)
+    if debut:
+        fiches = fiches.filter(date_creation__gte=timezone.make_aware(datetime.combine(debut, time.min)))
+    if fin:
+        fiches = fiches.filter(date_creation__lt=timezone.make_aware(datetime.combine(fin + timedelta(days=1), time.min)))
+    return fiches
+
+
+def filtrer_fiches(atelier_id=None, debut=None, fin=None):
+    """Fiches d'un atelier créées entre deux dates (incluses), filtres optionnels."""
+    return _filtrer(FicheSuivi.objects.all(), atelier_id, debut, fin)
+
+
+def filtrer_archives(atelier_id=None, debut=None, fin=None):
+    """Fiches archivées répondant aux mêmes filtres que filtrer_fiches."""
+    return _filtrer(FicheArchivee.objects.all(), atelier_id, debut, fin)
+
+
+def restaurees(archives_filtrees):
+    # Lues par paquets, décompressées une à une : la mémoire reste constante
+    for archive in archives_filtrees.order_by('id').iterator(chunk_size=TAILLE_LOT):
+        yield archives.restaurer(archive)
+
+
+class _Tampon:
+    # Lignes d'une section suivante, mises de côté pendant la lecture des archives
+    def __init__(self):
+        self.fichier = tempfile.SpooledTemporaryFile(max_size=TAILLE_TAMPON)
+
+    def ajouter(self, ligne):
+        pickle.dump(ligne, self.fichier, pickle.HIGHEST_PROTOCOL)
+
+    def relire(self):
+        self.fichier.seek(0)
+        while True:
+            try:
+                yield pickle.load(self.fichier)
+            except EOFError:
+                return
+
+    def fermer(self):
+        self.fichier.close()
+
+
+def _nom(prenom, nom, identifiant):
+    return f"{prenom} {nom}".strip() or identifiant
+
+
+def lignes(fiches, archivees=None):
+    """
+    Lignes CSV des fiches, tâches, incidents et mesures, section par section.
+    Les fiches archivées (`archivees`, de filtrer_archives) suivent les
+    fiches courantes dans chaque section : chacune est décompressée une
+    seule fois, ses lignes des sections suivantes sont mises de côté.
+    """
+    if archivees is None:
+        archivees = FicheArchivee.objects.none()
+    champs_mesure = ['ciment', 'sable', 'agent_moussant', 'fibre_verre', 'dsp_xl', 'hdr', 'eau', 'commentaires', 'valide', 'duree']
+    taches_archivees, incidents_archives, mesures_archivees = _Tampon(), _Tampon(), _Tampon()
+    try:
+        yield ['type', 'fiche', 'atelier', 'operateur', 'controleur', 'date_creation', 'validation_operateur', 'validation_controleur']
+        for row in fiches.order_by('id').values_list(
+            'id', 'atelier__nom',
+            'operateur__first_name', 'operateur__last_name', 'operateur__username',
+            'controleur__first_name', 'controleur__last_name', 'controleur__username',
+            'date_creation', 'date_validation_operateur', 'date_validation_controleur',
+        ).iterator(chunk_size=TAILLE_LOT):
+            yield ['fiche', row[0], row[1], _nom(*row[2:5]), _nom(*row[5:8]), row[8], row[9], row[10]]
+        for r in restaurees(archivees):
+            f = r.fiche
+            yield [
+                'fiche', f.id, f.atelier.nom,
+                _nom(f.operateur.first_name, f.operateur.last_name, f.operateur.username),
+                _nom(f.controleur.first_name, f.controleur.last_name, f.controleur.username),
+                f.date_creation, f.date_validation_operateur, f.date_validation_controleur,
+            ]
+            for t in r.taches:
+                taches_archivees.ajouter(
+                    ['tache', t.fiche_id, t.etape.ordre, t.etape.nom, t.date_debut, t.date_fin, t.duree, t.duree_pause, t.validation, t.observations]
+                )
+            for i in reversed(r.incidents):
+                incidents_archives.ajouter(['incident', f.id, i.date, i.description])
+            if r.mesure_composants is not None:
+                mesures_archivees.ajouter(['mesure', f.id, *(getattr(r.mesure_composants, champ) for champ in champs_mesure)])
+
+        yield []
+        yield ['type', 'fiche', 'ordre', 'etape', 'debut', 'fin', 'duree', 'duree_pause', 'validation', 'observations']
+        for row in Tache.objects.filter(fiche__in=fiches).order_by('fiche_id', 'etape__ordre').values_list(
+            'fiche_id', 'etape__ordre', 'etape__nom', 'date_debut', 'date_fin', 'duree', 'duree_pause', 'validation', 'observations',
+        ).iterator(chunk_size=TAILLE_LOT):
+            yield ['tache', *row]
+        yield from taches_archivees.relire()
+
+        yield []
+        yield ['type', 'fiche', 'date', 'description']
+        for row in FicheSuivi.incidents.through.objects.filter(fichesuivi__in=fiches).order_by('fichesuivi_id', 'incident__date').values_list(
+            'fichesuivi_id', 'incident__date', 'incident__description',
+        ).iterator(chunk_size=TAILLE_LOT):
+            yield ['incident', *row]
+        yield from incidents_archives.relire()
+
+        yield []
+        yield ['type', 'fiche', *champs_mesure]
+        for row in MesureComposants.objects.filter(fiche__in=fiches).order_by('fiche_id').values_list(
+            'fiche_id', *champs_mesure,
+        ).iterator(chunk_size=TAILLE_LOT):
+            yield ['mesure', *row]
+        yield from mesures_archivees.relire()
+    finally:
+        for tampon in (taches_archivees, incidents_archives, mesures_archivees):
+            tampon.fermer()
+
+
+def flux_csv(fiches, archivees=None):
+    writer = csv.writer(Echo())
+    for ligne in lignes(fiches, archivees):
+        yield writer.writerow(ligne)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from checklist import archives
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive les fiches validées par l'opérateur et le contrôleur depuis plus de --jours jours : "
+        "elles quittent les tables courantes et restent consultables et exportables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jours', type=int, default=365, help="Âge minimal des fiches archivées, en jours")
+        parser.add_argument('--lot', type=int, default=500, help="Nombre de fiches archivées par transaction")
+        parser.add_argument('--essai', action='store_true', help="Compte les fiches archivables sans rien modifier")
+
+    def handle(self, *args, **options):
+        if options['lot'] < 1 or options['jours'] < 0:
+            raise CommandError("--lot doit être positif et --jours ne peut pas être négatif.")
+        archivables = archives.archivables(options['jours'])
+        if options['essai']:
+            self.stdout.write(f"{archivables.count()} fiches archivables.")
+            return
+
+        # Parcours par identifiant croissant : chaque lot est court et ne
+        # bloque pas les écritures des fiches en cours
+        total = 0
+        dernier = 0
+        while True:
+            ids = list(archivables.filter(id__gt=dernier).order_by('id').values_list('id', flat=True)[:options['lot']])
+            if not ids:
+                break
+            with transaction.atomic():
+                total += archives.archiver(ids)
+            dernier = ids[-1]
+            self.stdout.write(f"{total} fiches archivées")
+        self.stdout.write(self.style.SUCCESS(f"{total} fiches archivées."))
@@ -0,0 +1,128 @@
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from checklist.models import ExportPDF
+
+# Pages en lecture seule servies par les vues asynchrones
+PAGES = ('checklist:accueil', 'checklist:controle', 'checklist:atelier_list')
+
+
+def _session(utilisateur):
+    # Session ouverte directement en base : les deux déploiements la partagent
+    session = SessionStore()
+    session[SESSION_KEY] = str(utilisateur.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = utilisateur.get_session_auth_hash()
+    session.create()
+    return session.session_key
+
+
+def _centile(valeurs, centile):
+    return valeurs[min(len(valeurs) - 1, int(len(valeurs) * centile))] if valeurs else 0.0
+
+
+def _client(base, chemins, cookie, fin, latences, erreurs, verrou):
+    """Un client HTTP/1.1 avec connexion persistante, qui enchaîne les pages jusqu'à l'échéance."""
+    adresse = urlsplit(base)
+    connexion_classe = http.client.HTTPSConnection if adresse.scheme == 'https' else http.client.HTTPConnection
+    connexion = connexion_classe(adresse.netloc, timeout=30)
+    mesures, echecs, i = [], 0, 0
+    while time.perf_counter() < fin:
+        chemin = chemins[i % len(chemins)]
+        i += 1
+        debut = time.perf_counter()
+        for _ in range(2):
+            try:
+                connexion.request('GET', chemin, headers={'Cookie': cookie})
+                reponse = connexion.getresponse()
+                reponse.read()
+                break
+            except (OSError, http.client.HTTPException):
+                # Connexion persistante fermée par le serveur : un nouvel essai
+                connexion.close()
+                connexion = connexion_classe(adresse.netloc, timeout=30)
+        else:
+            echecs += 1
+            time.sleep(0.1)
+            continue
+        if reponse.status != 200:
+            echecs += 1
+        mesures.append(time.perf_counter() - debut)
+    connexion.close()
+    with verrou:
+        latences.extend(mesures)
+        erreurs.append(echecs)
+
+
+def mesurer(base, chemins, cookie, clients, duree):
+    latences, erreurs, verrou = [], [], threading.Lock()
+    fin = time.perf_counter() + duree
+    fils = [
+        threading.Thread(target=_client, args=(base, chemins, cookie, fin, latences, erreurs, verrou))
+        for _ in range(clients)
+    ]
+    debut = time.perf_counter()
+    for fil in fils:
+        fil.start()
+    for fil in fils:
+        fil.join()
+    ecoule = time.perf_counter() - debut
+    latences.sort()
+    return {
+        'requetes': len(latences),
+        'erreurs': sum(erreurs),
+        'rps': len(latences) / ecoule,
+        'p50_ms': 1000 * _centile(latences, 0.50),
+        'p99_ms': 1000 * _centile(latences, 0.99),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Banc de charge HTTP des pages en lecture seule (accueil, contrôle, ateliers, statut d'export) : "
+        "compare requêtes par seconde et latence p99 entre un déploiement WSGI et un déploiement ASGI "
+        "déjà lancés sur la même base, par exemple « gunicorn mtb_checklist.wsgi -w 4 -b :8001 » et "
+        "« uvicorn mtb_checklist.asgi:application --port 8002 »."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', help="URL de base du déploiement WSGI (ex. http://127.0.0.1:8001)")
+        parser.add_argument('--asgi', help="URL de base du déploiement ASGI (ex. http://127.0.0.1:8002)")
+        parser.add_argument('--utilisateur', required=True, help="Compte utilisé pour les requêtes")
+        parser.add_argument('--clients', type=int, default=32, help="Clients simultanés")
+        parser.add_argument('--duree', type=float, default=20, help="Durée de chaque mesure (secondes)")
+        parser.add_argument('--echauffement', type=float, default=2, help="Durée de chauffe avant mesure (secondes)")
+
+    def handle(self, *args, **options):
+        cibles = [(nom, options[nom]) for nom in ('wsgi', 'asgi') if options[nom]]
+        if not cibles:
+            raise CommandError("Indiquez au moins --wsgi ou --asgi.")
+        try:
+            utilisateur = User.objects.get(username=options['utilisateur'])
+        except User.DoesNotExist:
+            raise CommandError(f"Utilisateur inconnu : {options['utilisateur']}")
+
+        cookie = f'{settings.SESSION_COOKIE_NAME}={_session(utilisateur)}'
+        chemins = [reverse(page) for page in PAGES]
+        export_id = ExportPDF.objects.values_list('id', flat=True).first()
+        if export_id:
+            chemins.append(reverse('checklist:export_pdf_statut', args=[export_id]))
+
+        for nom, base in cibles:
+            base = base.rstrip('/')
+            chemins_complets = [urlsplit(base).path + chemin for chemin in chemins]
+            mesurer(base, chemins_complets, cookie, options['clients'], options['echauffement'])
+            r = mesurer(base, chemins_complets, cookie, options['clients'], options['duree'])
+            self.stdout.write(
+                f"{nom.upper():<5} {r['rps']:8.1f} req/s  p50 {r['p50_ms']:7.1f} ms  p99 {r['p99_ms']:7.1f} ms  "
+                f"{r['requetes']} requêtes, {r['erreurs']} erreurs"
+            )
@@ -0,0 +1,166 @@
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import reverse
+
+from checklist import pdf, rendu_pdf
+from checklist.models import FicheSuivi
+from checklist.requetes import CompteurRequetes
+
+from .banc_charge import _centile
+
+
+def _preparer():
+    """Fiches du banc : la plus récente fiche en cours et une fiche validée du même opérateur."""
+    en_cours = FicheSuivi.objects.filter(
+        valide_par_operateur__isnull=True, taches__date_debut__isnull=True,
+    ).select_related('operateur').order_by('-date_creation', '-id').first()
+    if en_cours is None:
+        raise CommandError("Aucune fiche en cours : générez d'abord les données (manage.py generer_donnees).")
+    validee = pdf.pour_rendu(FicheSuivi.objects.filter(
+        operateur=en_cours.operateur_id, valide_par_controleur__isnull=False,
+    )).order_by('-date_creation', '-id').first()
+    if validee is None:
+        raise CommandError(f"Aucune fiche validée pour {en_cours.operateur} : générez d'abord les données.")
+    tache = en_cours.taches.filter(date_debut__isnull=True).order_by('etape__ordre').first()
+    return en_cours, validee, tache
+
+
+def _scenarios(en_cours, validee, tache):
+    """
+    Requêtes d'une répétition, dans l'ordre : (nom, méthode, URL, données).
+    Les actions s'enchaînent (démarrage puis pause du chronomètre...) et
+    sont annulées à la fin de chaque répétition.
+    """
+    jour = validee.date_creation.date()
+    export_lot = reverse('checklist:export_csv_lot') + f'?atelier={validee.atelier_id}&debut={jour}&fin={jour}'
+    scenarios = [
+        ('accueil', 'get', reverse('checklist:accueil'), None),
+        ('fiche_detail', 'get', reverse('checklist:fiche_detail', args=[en_cours.id]), None),
+        ('fiche_detail_post', 'post', reverse('checklist:fiche_detail', args=[en_cours.id]),
+         {'action': 'add_incident', 'incident_description': "Incident du banc de performances"}),
+    ]
+    for transition in ('start', 'pause', 'resume', 'finish'):
+        scenarios.append((
+            f'chrono_{transition}', 'post',
+            reverse('checklist:chrono_tache', args=[en_cours.id, 'tache', tache.id, transition]), {},
+        ))
+    scenarios += [
+        ('export_csv', 'get', reverse('checklist:export_csv', args=[validee.id]), None),
+        ('export_csv_lot', 'get', export_lot, None),
+        ('export_pdf', 'get', reverse('checklist:export_pdf', args=[validee.id]), None),
+    ]
+    return scenarios
+
+
+def _executer(client, methode, url, donnees):
+    compteur = CompteurRequetes()
+    debut = time.perf_counter()
+    with connection.execute_wrapper(compteur):
+        response = getattr(client, methode)(url, donnees)
+        # Réponses en flux (exports) : la lecture complète fait partie de la
+        # mesure ; le client de test ferme la réponse en fin de lecture
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+    duree = time.perf_counter() - debut
+    if response.status_code >= 400:
+        raise CommandError(f"{methode.upper()} {url} : statut {response.status_code}")
+    return duree, compteur.nombre
+
+
+def mesurer(client, scenarios, repetitions, echauffement):
+    latences = {nom: [] for nom, *_ in scenarios}
+    requetes = {}
+    for repetition in range(echauffement + repetitions):
+        # Chaque répétition part du même état : ses écritures sont annulées
+        with transaction.atomic():
+            for nom, methode, url, donnees in scenarios:
+                duree, nombre = _executer(client, methode, url, donnees)
+                if repetition >= echauffement:
+                    latences[nom].append(duree)
+                    requetes[nom] = max(requetes.get(nom, 0), nombre)
+            transaction.set_rollback(True)
+    resultats = {}
+    for nom, valeurs in latences.items():
+        valeurs.sort()
+        resultats[nom] = {
+            'requetes': requetes[nom],
+            'p50_ms': round(1000 * _centile(valeurs, 0.50), 2),
+            'p95_ms': round(1000 * _centile(valeurs, 0.95), 2),
+        }
+    return resultats
+
+
+def regressions(resultats, reference, tolerance, marge_ms):
+    """Écarts à la référence : plus de requêtes SQL, ou une latence au-delà de la tolérance."""
+    ecarts = []
+    for nom, mesure in resultats.items():
+        attendu = reference.get(nom)
+        if attendu is None:
+            continue
+        if mesure['requetes'] > attendu['requetes']:
+            ecarts.append(f"{nom} : {mesure['requetes']} requêtes SQL au lieu de {attendu['requetes']}")
+        for centile in ('p50_ms', 'p95_ms'):
+            plafond = attendu[centile] * (1 + tolerance) + marge_ms
+            if mesure[centile] > plafond:
+                ecarts.append(f"{nom} : {centile} {mesure[centile]:.1f} ms au lieu de {attendu[centile]:.1f} ms")
+    return ecarts
+
+
+class Command(BaseCommand):
+    help = (
+        "Banc de performances des vues (accueil, fiche_detail GET/POST, chronomètre, exports CSV et PDF) : "
+        "nombre de requêtes SQL et latences p50/p95, comparés à une référence enregistrée. "
+        "Échoue si une vue régresse. À lancer sur les données de manage.py generer_donnees."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reference', default=str(settings.BASE_DIR / 'banc_performances.json'),
+                            help="Fichier JSON de la référence")
+        parser.add_argument('--enregistrer', action='store_true', help="Enregistre les mesures comme nouvelle référence")
+        parser.add_argument('--repetitions', type=int, default=30, help="Répétitions mesurées de chaque scénario")
+        parser.add_argument('--echauffement', type=int, default=3, help="Répétitions de chauffe, non mesurées")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Hausse de latence admise (0.25 = +25 %%)")
+        parser.add_argument('--marge-ms', type=float, default=10.0, help="Hausse de latence admise en plus, en millisecondes")
+        parser.add_argument('--hote', default='localhost', help="En-tête Host des requêtes (doit figurer dans ALLOWED_HOSTS)")
+
+    def handle(self, *args, **options):
+        if options['repetitions'] < 1:
+            raise CommandError("Il faut au moins une répétition.")
+        en_cours, validee, tache = _preparer()
+        # PDF de la fiche validée déjà en cache : le banc mesure la vue, pas xhtml2pdf
+        html = pdf.rendre_html(validee)
+        empreinte = pdf.calculer_empreinte(html)
+        if not pdf.chemin_cache(empreinte).exists():
+            pdf.ecrire_cache(empreinte, rendu_pdf.convertir(html))
+
+        client = Client(HTTP_HOST=options['hote'])
+        client.force_login(en_cours.operateur)
+        resultats = mesurer(client, _scenarios(en_cours, validee, tache), options['repetitions'], options['echauffement'])
+
+        chemin = Path(options['reference'])
+        reference = json.loads(chemin.read_text(encoding='utf-8')) if chemin.exists() else {}
+        for nom, mesure in resultats.items():
+            attendu = reference.get(nom)
+            self.stdout.write(
+                f"{nom:<18} {mesure['requetes']:4d} requêtes  p50 {mesure['p50_ms']:8.1f} ms  p95 {mesure['p95_ms']:8.1f} ms"
+                + (f"   (référence : {attendu['requetes']} requêtes, p50 {attendu['p50_ms']:.1f} ms, p95 {attendu['p95_ms']:.1f} ms)"
+                   if attendu else '')
+            )
+
+        if options['enregistrer']:
+            chemin.write_text(json.dumps(resultats, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f"Référence enregistrée dans {chemin}"))
+            return
+        if not reference:
+            raise CommandError(f"Pas de référence dans {chemin} : lancez d'abord le banc avec --enregistrer.")
+        ecarts = regressions(resultats, reference, options['tolerance'], options['marge_ms'])
+        if ecarts:
+            raise CommandError("Régressions par rapport à la référence :\n" + '\n'.join(f"  {e}" for e in ecarts))
+        self.stdout.write(self.style.SUCCESS("Aucune régression par rapport à la référence."))
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Profil par défaut de Django avant réglage : journal DELETE, FULL, BEGIN différé
+PROFIL_DEFAUT = {'init_command': '', 'timeout': 5, 'transaction_mode': None}
+
+
+def _profil_production():
+    options = settings.SQLITE_OPTIONS
+    return {
+        'init_command': options.get('init_command', ''),
+        'timeout': options.get('timeout', 5),
+        'transaction_mode': options.get('transaction_mode'),
+    }
+
+
+def _connecter(chemin, profil):
+    conn = sqlite3.connect(chemin, timeout=profil['timeout'], isolation_level=None, check_same_thread=False)
+    for commande in profil['init_command'].split(';'):
+        if commande.strip():
+            conn.execute(commande)
+    return conn
+
+
+def _preparer(chemin, fiches):
+    conn = sqlite3.connect(chemin, isolation_level=None)
+    conn.executescript("""
+        CREATE TABLE tache (id INTEGER PRIMARY KEY, fiche_id INTEGER, date_debut REAL, date_fin REAL, duree REAL);
+        CREATE INDEX tache_fiche ON tache (fiche_id);
+        CREATE TABLE evenement (id INTEGER PRIMARY KEY, fiche_id INTEGER, tache_id INTEGER, type TEXT, horodatage REAL);
+    """)
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO tache (fiche_id) VALUES (?)',
+        [(fiche,) for fiche in range(fiches) for _ in range(10)],
+    )
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def _tablette(chemin, profil, numero, operations, lecteurs, resultats):
+    """Simule une tablette : clics de chronomètre (lecture, UPDATE, journal) ou affichage de fiche."""
+    conn = _connecter(chemin, profil)
+    debut_transaction = 'BEGIN ' + profil['transaction_mode'] if profil['transaction_mode'] else 'BEGIN'
+    reussies = verrouillees = 0
+    latences = []
+    for i in range(operations):
+        fiche = (numero * 7919 + i) % 1000
+        debut = time.perf_counter()
+        try:
+            if numero < lecteurs:
+                conn.execute('SELECT id, date_debut, date_fin, duree FROM tache WHERE fiche_id = ?', (fiche,)).fetchall()
+            else:
+                conn.execute(debut_transaction)
+                tache = conn.execute('SELECT id FROM tache WHERE fiche_id = ? LIMIT 1', (fiche,)).fetchone()[0]
+                conn.execute('UPDATE tache SET date_debut = ?, duree = coalesce(duree, 0) + 1 WHERE id = ?', (time.time(), tache))
+                conn.execute(
+                    'INSERT INTO evenement (fiche_id, tache_id, type, horodatage) VALUES (?, ?, ?, ?)',
+                    (fiche, tache, 'start', time.time()),
+                )
+                conn.execute('COMMIT')
+            reussies += 1
+        except sqlite3.OperationalError:
+            # "database is locked" : l'opération est perdue pour la tablette
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            verrouillees += 1
+        latences.append(time.perf_counter() - debut)
+    conn.close()
+    resultats.append((reussies, verrouillees, latences))
+
+
+def mesurer(profil, tablettes, operations, lecteurs):
+    with tempfile.TemporaryDirectory() as dossier:
+        chemin = os.path.join(dossier, 'bench.sqlite3')
+        _preparer(chemin, 1000)
+        resultats = []
+        fils = [
+            threading.Thread(target=_tablette, args=(chemin, profil, n, operations, lecteurs, resultats))
+            for n in range(tablettes)
+        ]
+        debut = time.perf_counter()
+        for fil in fils:
+            fil.start()
+        for fil in fils:
+            fil.join()
+        duree = time.perf_counter() - debut
+    latences = sorted(latence for _, _, liste in resultats for latence in liste)
+    return {
+        'reussies': sum(r for r, _, _ in resultats),
+        'verrouillees': sum(v for _, v, _ in resultats),
+        'debit': sum(r for r, _, _ in resultats) / duree,
+        'p95_ms': 1000 * latences[int(len(latences) * 0.95)] if latences else 0,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare le débit SQLite en accès concurrent entre le profil par défaut et le profil de production."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tablettes', type=int, default=16, help="Nombre de connexions concurrentes")
+        parser.add_argument('--operations', type=int, default=200, help="Opérations par connexion")
+        parser.add_argument('--lecteurs', type=int, default=8, help="Connexions en lecture seule parmi les tablettes")
+
+    def handle(self, *args, **options):
+        for nom, profil in (('défaut', PROFIL_DEFAUT), ('production', _profil_production())):
+            r = mesurer(profil, options['tablettes'], options['operations'], options['lecteurs'])
+            self.stdout.write(
+                f"{nom:<11} {r['debit']:8.0f} op/s  p95 {r['p95_ms']:7.1f} ms  "
+                f"{r['reussies']} réussies, {r['verrouillees']} « database is locked »"
+            )
@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, models, transaction
+from django.db.migrations.executor import MigrationExecutor
+
+SOURCE = 'source_sqlite'
+
+
+@contextmanager
+def _dates_conservees(modeles):
+    # bulk_create recalcule auto_now/auto_now_add : on garde les dates d'origine
+    champs = [
+        champ for modele in modeles for champ in modele._meta.concrete_fields
+        if isinstance(champ, models.DateField) and (champ.auto_now or champ.auto_now_add)
+    ]
+    etats = [(champ, champ.auto_now, champ.auto_now_add) for champ in champs]
+    for champ in champs:
+        champ.auto_now = champ.auto_now_add = False
+    try:
+        yield
+    finally:
+        for champ, auto_now, auto_now_add in etats:
+            champ.auto_now, champ.auto_now_add = auto_now, auto_now_add
+
+
+def _modeles():
+    # Tables des modèles et des relations many-to-many, parents avant enfants
+    modeles = [m for m in apps.get_models(include_auto_created=True) if m._meta.managed and not m._meta.proxy]
+    ordonnes = []
+    restants = list(modeles)
+    while restants:
+        for modele in restants:
+            parents = {
+                champ.related_model for champ in modele._meta.concrete_fields
+                if champ.is_relation and champ.related_model is not modele
+            }
+            if all(parent in ordonnes or parent not in modeles for parent in parents):
+                ordonnes.append(modele)
+                restants.remove(modele)
+                break
+        else:
+            # Cycle : l'ordre n'importe plus, les clés étrangères sont vérifiées au COMMIT
+            ordonnes.extend(restants)
+            break
+    return ordonnes
+
+
+class Command(BaseCommand):
+    help = (
+        "Copie une base SQLite existante dans la base configurée (PostgreSQL), par lots. "
+        "La base cible doit être migrée ; son contenu est remplacé."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(settings.BASE_DIR / 'db.sqlite3'), help="Fichier SQLite à copier")
+        parser.add_argument('--lot', type=int, default=2000, help="Nombre de lignes insérées par requête")
+        parser.add_argument('--noinput', action='store_false', dest='interactive', help="Ne pas demander de confirmation")
+
+    def handle(self, *args, **options):
+        source = Path(options['source'])
+        if not source.exists():
+            raise CommandError(f"Base SQLite introuvable : {source}")
+        cible = connections['default']
+        if cible.vendor == 'sqlite' and Path(cible.settings_dict['NAME']).resolve() == source.resolve():
+            raise CommandError("La base cible est la base source : définissez DB_ENGINE=postgresql.")
+        if options['interactive']:
+            reponse = input(f"Le contenu de la base {cible.settings_dict['NAME']} ({cible.vendor}) sera remplacé. Continuer ? [o/N] ")
+            if reponse.lower() not in ('o', 'oui'):
+                raise CommandError("Copie annulée.")
+
+        connections.databases[SOURCE] = dict(connections.databases['default'], ENGINE='django.db.backends.sqlite3', NAME=str(source), OPTIONS={})
+        modeles = _modeles()
+        lot = options['lot']
+        try:
+            executor = MigrationExecutor(connections[SOURCE])
+            if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+                raise CommandError(f"La base source n'est pas à jour : lancez d'abord « DB_NAME={source} manage.py migrate ».")
+            with transaction.atomic(using='default'), _dates_conservees(modeles):
+                # Vide la cible sans recréer types de contenu et permissions : ils sont copiés avec leurs id
+                call_command('flush', interactive=False, inhibit_post_migrate=True, verbosity=0)
+                for modele in modeles:
+                    objets = modele._base_manager.using(SOURCE).order_by('pk').iterator(chunk_size=lot)
+                    total = 0
+                    paquet = []
+                    for objet in objets:
+                        paquet.append(objet)
+                        if len(paquet) >= lot:
+                            modele._base_manager.using('default').bulk_create(paquet, batch_size=lot)
+                            total += len(paquet)
+                            paquet = []
+                    if paquet:
+                        modele._base_manager.using('default').bulk_create(paquet, batch_size=lot)
+                        total += len(paquet)
+                    if total:
+                        self.stdout.write(f"{modele._meta.label} : {total}")
+
+                # Les séquences d'identifiants repartent après le plus grand id copié
+                with cible.cursor() as cursor:
+                    for sql in cible.ops.sequence_reset_sql(no_style(), modeles):
+                        cursor.execute(sql)
+        finally:
+            connections[SOURCE].close()
+            del connections.databases[SOURCE]
+        self.stdout.write(self.style.SUCCESS("Copie terminée."))
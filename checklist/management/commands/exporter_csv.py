@@ -0,0 +1,38 @@
+import argparse
+import sys
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from checklist import exports
+
+
+def _date(valeur):
+    try:
+        date = parse_date(valeur)
+    except ValueError:
+        date = None
+    if date is None:
+        raise argparse.ArgumentTypeError(f"Date invalide : {valeur} (format attendu AAAA-MM-JJ)")
+    return date
+
+
+class Command(BaseCommand):
+    help = "Exporte en CSV les fiches, tâches, incidents et mesures d'un atelier sur une période, archivées comprises."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--atelier', type=int, help="Identifiant de l'atelier")
+        parser.add_argument('--debut', type=_date, help="Première date de création incluse (AAAA-MM-JJ)")
+        parser.add_argument('--fin', type=_date, help="Dernière date de création incluse (AAAA-MM-JJ)")
+        parser.add_argument('--sortie', help="Fichier de sortie (sortie standard par défaut)")
+
+    def handle(self, *args, **options):
+        filtres = (options['atelier'], options['debut'], options['fin'])
+        fiches, archivees = exports.filtrer_fiches(*filtres), exports.filtrer_archives(*filtres)
+        sortie = open(options['sortie'], 'w', newline='', encoding='utf-8') if options['sortie'] else sys.stdout
+        try:
+            for ligne in exports.flux_csv(fiches, archivees):
+                sortie.write(ligne)
+        finally:
+            if sortie is not sys.stdout:
+                sortie.close()
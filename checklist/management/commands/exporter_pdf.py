@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from checklist import archive_pdf, exports
+from checklist.management.commands.exporter_csv import _date
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporte dans une archive ZIP le PDF de chaque fiche d'un atelier sur une période. "
+        "Les conversions sont réparties sur plusieurs processus ; les PDF déjà en cache sont repris."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--atelier', type=int, help="Identifiant de l'atelier")
+        parser.add_argument('--debut', type=_date, help="Première date de création incluse (AAAA-MM-JJ)")
+        parser.add_argument('--fin', type=_date, help="Dernière date de création incluse (AAAA-MM-JJ)")
+        parser.add_argument('--sortie', required=True, help="Archive ZIP à écrire")
+        parser.add_argument('--processus', type=int, help="Processus de conversion (un par cœur par défaut)")
+
+    def handle(self, *args, **options):
+        if options['processus'] is not None and options['processus'] < 1:
+            raise CommandError("--processus doit être au moins 1.")
+        filtres = (options['atelier'], options['debut'], options['fin'])
+        fiches, archivees = exports.filtrer_fiches(*filtres), exports.filtrer_archives(*filtres)
+        nombre = fiches.count() + archivees.count()
+        debut = time.perf_counter()
+        with open(options['sortie'], 'wb') as sortie:
+            for morceau in archive_pdf.flux_zip(fiches, options['processus'] or archive_pdf.nombre_processus(), archivees):
+                sortie.write(morceau)
+        ecoule = time.perf_counter() - debut
+        self.stdout.write(self.style.SUCCESS(
+            f"{nombre} fiche(s) exportée(s) dans {options['sortie']} en {ecoule:.1f} s."
+        ))
@@ -0,0 +1,164 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from checklist import referentiel
+from checklist.models import Atelier, Etape, FicheSuivi, Incident, MesureComposants, Tache
+
+# Fiches créées puis enregistrées par lot, chacune dans sa transaction
+TAILLE_LOT = 2000
+# Part des fiches les plus récentes encore en cours (ni validées, ni chronométrées)
+PART_EN_COURS = 0.02
+
+INCIDENTS = (
+    "Arrêt du malaxeur",
+    "Livraison de ciment en retard",
+    "Moule endommagé au démoulage",
+    "Densité hors tolérance, gâchée reprise",
+    "Panne de la balance",
+)
+
+
+@contextmanager
+def _dates_imposees(*champs):
+    # auto_now_add remplacerait les dates générées par l'heure courante
+    for champ in champs:
+        champ.auto_now_add = False
+    try:
+        yield
+    finally:
+        for champ in champs:
+            champ.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Génère un jeu de données synthétique aux volumes de production (ateliers, comptes, fiches, "
+        "tâches, incidents, mesures) pour le banc de performances. À lancer sur une base dédiée."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ateliers', type=int, default=2000, help="Nombre d'ateliers")
+        parser.add_argument('--utilisateurs', type=int, default=5000, help="Nombre de comptes, dont un sur dix contrôleur")
+        parser.add_argument('--fiches', type=int, default=300000, help="Nombre de fiches (une tâche par étape et par fiche)")
+        parser.add_argument('--incidents', type=int, default=1000000, help="Nombre d'incidents, répartis sur les fiches")
+        parser.add_argument('--jours', type=int, default=365, help="Période couverte par les fiches, jusqu'à aujourd'hui")
+        parser.add_argument('--etapes', type=int, default=12, help="Étapes créées si la table est vide")
+        parser.add_argument('--prefixe', default='banc', help="Préfixe des noms de comptes générés")
+        parser.add_argument('--graine', type=int, default=0, help="Graine du générateur aléatoire (jeu reproductible)")
+
+    def handle(self, *args, **options):
+        if options['utilisateurs'] < 2 or options['ateliers'] < 1:
+            raise CommandError("Il faut au moins un atelier et deux comptes.")
+        prefixe = options['prefixe']
+        if User.objects.filter(username__startswith=f'{prefixe}_').exists():
+            raise CommandError(f"Des comptes « {prefixe}_… » existent déjà : choisissez un autre --prefixe.")
+        rng = random.Random(options['graine'])
+
+        if not Etape.objects.exists():
+            Etape.objects.bulk_create([
+                Etape(nom=f'Étape {ordre}', consignes=f'Consignes de l\'étape {ordre}', ordre=ordre)
+                for ordre in range(1, options['etapes'] + 1)
+            ])
+            referentiel.invalider('etapes')
+        nombre_etapes = Etape.objects.count()
+
+        ateliers = Atelier.objects.bulk_create(
+            [Atelier(nom=f'Atelier {prefixe} {n}') for n in range(1, options['ateliers'] + 1)],
+            batch_size=TAILLE_LOT,
+        )
+        ateliers = [atelier.id for atelier in ateliers]
+        operateurs, controleurs = self._utilisateurs(prefixe, options['utilisateurs'])
+        self.stdout.write(f"{len(ateliers)} ateliers, {len(operateurs)} opérateurs, {len(controleurs)} contrôleurs")
+
+        total = options['fiches']
+        fin = timezone.now()
+        debut = fin - timedelta(days=options['jours'])
+        pas = (fin - debut) / max(total, 1)
+        en_cours = total - int(total * PART_EN_COURS)
+        incidents_par_fiche = options['incidents'] / max(total, 1)
+        incidents_crees = 0
+        with _dates_imposees(FicheSuivi._meta.get_field('date_creation'), Incident._meta.get_field('date')):
+            for premier in range(0, total, TAILLE_LOT):
+                rangs = range(premier, min(premier + TAILLE_LOT, total))
+                # Incidents répartis au prorata, sans dérive d'arrondi d'un lot à l'autre
+                nombre_incidents = round(incidents_par_fiche * rangs.stop) - incidents_crees
+                with transaction.atomic():
+                    self._lot(rng, rangs, debut, pas, en_cours, ateliers, operateurs, controleurs, nombre_incidents)
+                incidents_crees += nombre_incidents
+                self.stdout.write(f"{rangs.stop}/{total} fiches")
+
+        referentiel.invalider('ateliers')
+        referentiel.invalider('controleurs')
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} fiches, {total * nombre_etapes} tâches et {incidents_crees} incidents générés."
+        ))
+
+    def _utilisateurs(self, prefixe, nombre):
+        # Mot de passe inutilisable, calculé une fois : le banc ouvre ses sessions sans mot de passe
+        mot_de_passe = make_password(None)
+        nombre_controleurs = max(1, nombre // 10)
+        comptes = [
+            User(username=f'{prefixe}_controleur_{n}', first_name='controleur', password=mot_de_passe)
+            for n in range(nombre_controleurs)
+        ] + [
+            User(username=f'{prefixe}_operateur_{n}', password=mot_de_passe)
+            for n in range(nombre - nombre_controleurs)
+        ]
+        comptes = User.objects.bulk_create(comptes, batch_size=TAILLE_LOT)
+        return [u.id for u in comptes[nombre_controleurs:]], [u.id for u in comptes[:nombre_controleurs]]
+
+    def _lot(self, rng, rangs, debut, pas, en_cours, ateliers, operateurs, controleurs, nombre_incidents):
+        fiches = []
+        for rang in rangs:
+            date = debut + pas * rang
+            fiche = FicheSuivi(
+                date_creation=date,
+                atelier_id=rng.choice(ateliers),
+                operateur_id=rng.choice(operateurs),
+                controleur_id=rng.choice(controleurs),
+            )
+            if rang < en_cours:
+                fiche.valide_par_operateur_id = fiche.operateur_id
+                fiche.date_validation_operateur = date + timedelta(hours=4)
+                fiche.valide_par_controleur_id = fiche.controleur_id
+                fiche.date_validation_controleur = date + timedelta(hours=5)
+            fiches.append(fiche)
+        fiches = FicheSuivi.objects.bulk_create(fiches)
+        FicheSuivi.generer_taches_en_lot([f.id for f in fiches])
+
+        terminees = [f for f in fiches if f.valide_par_operateur_id]
+        if terminees:
+            # Tâches des fiches validées : conformes et chronométrées
+            Tache.objects.filter(fiche_id__in=[f.id for f in terminees]).update(
+                validation='conforme',
+                date_debut=terminees[0].date_creation,
+                date_fin=terminees[0].date_creation + timedelta(minutes=20),
+                duree=timedelta(minutes=rng.randint(10, 30)),
+            )
+            MesureComposants.objects.bulk_create([
+                MesureComposants(
+                    fiche_id=f.id, ciment=round(rng.uniform(20, 30), 1), sable=round(rng.uniform(40, 60), 1),
+                    agent_moussant=round(rng.uniform(0.5, 1.5), 2), fibre_verre=round(rng.uniform(1, 3), 2),
+                    eau=round(rng.uniform(8, 12), 1), valide=True, valide_par_id=f.operateur_id,
+                    date_validation=f.date_creation + timedelta(hours=1),
+                )
+                for f in terminees
+            ])
+
+        if nombre_incidents > 0:
+            liees = [rng.choice(fiches) for _ in range(nombre_incidents)]
+            incidents = Incident.objects.bulk_create([
+                Incident(description=rng.choice(INCIDENTS), date=f.date_creation + timedelta(hours=2))
+                for f in liees
+            ])
+            FicheSuivi.incidents.through.objects.bulk_create([
+                FicheSuivi.incidents.through(fichesuivi_id=f.id, incident_id=i.id)
+                for f, i in zip(liees, incidents)
+            ])
@@ -0,0 +1,45 @@
+import time
+
+import tablib
+from django.core.management.base import BaseCommand, CommandError
+
+from checklist.resources import RESSOURCES
+
+
+class Command(BaseCommand):
+    help = (
+        "Importe un fichier CSV, XLSX ou JSON dans une table (ateliers, étapes, fiches ou mesures) "
+        "par insertions groupées. Les fiches importées reçoivent leurs tâches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('ressource', choices=sorted(RESSOURCES), help="Table à alimenter")
+        parser.add_argument('fichier', help="Fichier à importer")
+        parser.add_argument('--essai', action='store_true', help="Valide le fichier sans rien enregistrer")
+
+    def handle(self, *args, **options):
+        fichier = options['fichier']
+        format = fichier.rsplit('.', 1)[-1].lower()
+        mode = 'rb' if format == 'xlsx' else 'r'
+        try:
+            with open(fichier, mode, **({} if mode == 'rb' else {'encoding': 'utf-8-sig'})) as f:
+                donnees = tablib.Dataset().load(f.read(), format=format)
+        except (OSError, tablib.UnsupportedFormat) as e:
+            raise CommandError(f"Lecture impossible de {fichier} : {e}")
+
+        debut = time.perf_counter()
+        resultat = RESSOURCES[options['ressource']]().import_data(donnees, dry_run=options['essai'])
+        ecoule = time.perf_counter() - debut
+
+        if resultat.has_errors() or resultat.has_validation_errors():
+            for ligne in resultat.invalid_rows[:20]:
+                self.stderr.write(f"Ligne {ligne.number} : {ligne.error_dict}")
+            for numero, erreurs in resultat.row_errors()[:20]:
+                for erreur in erreurs:
+                    self.stderr.write(f"Ligne {numero} : {erreur.error}")
+            raise CommandError("Import annulé : le fichier contient des erreurs.")
+        totaux = resultat.totals
+        self.stdout.write(
+            f"{len(donnees)} lignes en {ecoule:.1f} s : {totaux['new']} créées, {totaux['update']} mises à jour"
+            + (" (essai, rien n'est enregistré)" if options['essai'] else "")
+        )
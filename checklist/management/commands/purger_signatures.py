@@ -0,0 +1,33 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from checklist.models import Signature
+
+# Dossier des images de signature d'avant la migration 0015 (une par tâche) ;
+# les signatures actuelles sont rangées dans ses sous-dossiers
+DOSSIER = 'signatures'
+
+
+class Command(BaseCommand):
+    help = (
+        "Supprime les images de signature d'avant la migration 0015, une fois celle-ci appliquée : "
+        "les tâches pointent désormais sur les signatures dédoublonnées."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--essai', action='store_true', help="Compte les fichiers à supprimer sans rien modifier")
+
+    def handle(self, *args, **options):
+        try:
+            _, fichiers = default_storage.listdir(DOSSIER)
+        except FileNotFoundError:
+            fichiers = []
+        noms = {f'{DOSSIER}/{fichier}' for fichier in fichiers}
+        # Une signature rangée à la racine du dossier reste en place
+        anciens = noms - set(Signature.objects.filter(fichier__in=noms).values_list('fichier', flat=True))
+        if options['essai']:
+            self.stdout.write(f"{len(anciens)} ancienne(s) image(s) de signature à supprimer.")
+            return
+        for nom in sorted(anciens):
+            default_storage.delete(nom)
+        self.stdout.write(self.style.SUCCESS(f"{len(anciens)} ancienne(s) image(s) de signature supprimée(s)."))
@@ -0,0 +1,49 @@
+import argparse
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from checklist import statistiques
+from checklist.chrono import CIBLES
+
+
+def _date(valeur):
+    try:
+        date = parse_date(valeur)
+    except ValueError:
+        date = None
+    if date is None:
+        raise argparse.ArgumentTypeError(f"Date invalide : {valeur} (format attendu AAAA-MM-JJ)")
+    return date
+
+
+class Command(BaseCommand):
+    help = "Recalcule les statistiques journalières de production sur une période (tout l'historique par défaut)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debut', type=_date, help="Premier jour recalculé (AAAA-MM-JJ)")
+        parser.add_argument('--fin', type=_date, help="Dernier jour recalculé (AAAA-MM-JJ, aujourd'hui par défaut)")
+        parser.add_argument('--atelier', type=int, help="Identifiant de l'atelier")
+        parser.add_argument('--jours', type=int, default=31, help="Nombre de jours recalculés par transaction")
+
+    def handle(self, *args, **options):
+        fin = options['fin'] or timezone.localdate()
+        debut = options['debut']
+        if debut is None:
+            premieres = [modele.objects.aggregate(premiere=Min('date_fin'))['premiere'] for modele in CIBLES.values()]
+            premieres = [date for date in premieres if date]
+            if not premieres:
+                self.stdout.write("Aucune étape terminée.")
+                return
+            debut = timezone.localdate(min(premieres))
+
+        total = 0
+        while debut <= fin:
+            fin_lot = min(debut + timedelta(days=options['jours'] - 1), fin)
+            total += statistiques.recalculer(debut, fin_lot, options['atelier'])
+            self.stdout.write(f"{debut} → {fin_lot}")
+            debut = fin_lot + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f"{total} lignes de statistiques écrites."))
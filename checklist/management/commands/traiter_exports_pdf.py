@@ -0,0 +1,87 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from checklist import archive_pdf, archives, pdf
+from checklist.models import ExportLotPDF, ExportPDF
+
+
+class Command(BaseCommand):
+    help = (
+        "Génère les exports PDF restés en attente, par exemple après un redémarrage du serveur, "
+        "construit les archives ZIP des exports par lot demandés depuis le site, "
+        "puis purge le cache disque des PDF et les archives expirées."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--age-max', type=int, default=settings.PDF_CACHE_AGE_MAX,
+            help="Supprime les PDF non servis depuis ce nombre de jours",
+        )
+        parser.add_argument(
+            '--taille-max', type=int, default=settings.PDF_CACHE_TAILLE_MAX,
+            help="Taille maximale du cache en Mo : les PDF les plus anciens sont supprimés au-delà",
+        )
+        parser.add_argument(
+            '--age-max-lots', type=int, default=settings.PDF_LOT_AGE_MAX,
+            help="Supprime les archives des exports par lot finis depuis ce nombre de jours",
+        )
+        parser.add_argument(
+            '--processus', type=int,
+            help="Processus de conversion des exports par lot (PDF_LOT_PROCESSUS par défaut)",
+        )
+        parser.add_argument(
+            '--boucle', type=int, metavar='SECONDES',
+            help="Recommence le traitement toutes les SECONDES secondes, sans s'arrêter",
+        )
+
+    def handle(self, *args, **options):
+        if any(options[nom] is not None and options[nom] < 0 for nom in ('age_max', 'taille_max', 'age_max_lots')):
+            raise CommandError("--age-max, --taille-max et --age-max-lots ne peuvent pas être négatifs.")
+        if any(options[nom] is not None and options[nom] < 1 for nom in ('processus', 'boucle')):
+            raise CommandError("--processus et --boucle doivent être au moins 1.")
+        while True:
+            self.traiter(options)
+            if not options['boucle']:
+                return
+            # Pas de connexion gardée ouverte pendant l'attente
+            connections.close_all()
+            time.sleep(options['boucle'])
+
+    def traiter(self, options):
+        generes = obsoletes = 0
+        en_file = ExportPDF.objects.filter(statut__in=['en_attente', 'en_cours'])
+        exports = list(pdf.pour_rendu(en_file.filter(archive__isnull=True), 'fiche__'))
+        exports += en_file.filter(archive__isnull=False).select_related('archive')
+        for export in exports:
+            if export.archive_id:
+                # Fiche archivée, rendue depuis son instantané
+                html = pdf.rendre_html_archive(archives.restaurer(export.archive))
+            else:
+                html = pdf.rendre_html(export.fiche)
+            if pdf.calculer_empreinte(html) != export.empreinte:
+                # La fiche a changé depuis la demande : une nouvelle demande sera faite au prochain export
+                export.delete()
+                obsoletes += 1
+                continue
+            pdf.generer(export.id, html)
+            generes += 1
+        # Un lot à la fois, chacun avec son pool de conversion
+        processus = options['processus'] or archive_pdf.nombre_processus()
+        lots = 0
+        for export in ExportLotPDF.objects.filter(statut__in=['en_attente', 'en_cours']).order_by('id'):
+            archive_pdf.generer_lot(export, processus)
+            lots += 1
+        # Un export terminé dont le PDF est purgé est régénéré à la demande suivante
+        purges = pdf.purger_cache(
+            age_max=timedelta(days=options['age_max']) if options['age_max'] is not None else None,
+            taille_max=options['taille_max'] * 1024 * 1024 if options['taille_max'] is not None else None,
+        )
+        lots_purges = archive_pdf.purger_lots(timedelta(days=options['age_max_lots'])) if options['age_max_lots'] is not None else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{generes} export(s) généré(s), {obsoletes} obsolète(s) supprimé(s), {lots} archive(s) par lot "
+            f"construite(s), {purges} PDF purgé(s) du cache, {lots_purges} archive(s) expirée(s) supprimée(s)."
+        ))
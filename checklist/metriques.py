@@ -0,0 +1,202 @@
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+from . import actions
+from .requetes import CompteurRequetes
+
+logger = logging.getLogger(__name__)
+
+# Mesures par requête HTTP, agrégées en histogrammes en mémoire et exposées
+# au format texte Prometheus. Chaque processus tient les siennes.
+
+SECONDES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+NOMBRES = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HISTOGRAMMES = {
+    'checklist_requete_duree_secondes': ("Durée totale de traitement de la requête", SECONDES),
+    'checklist_requete_sql_secondes': ("Temps passé dans les requêtes SQL", SECONDES),
+    'checklist_requete_gabarits_secondes': ("Temps de rendu des gabarits", SECONDES),
+    'checklist_requete_sql_nombre': ("Nombre de requêtes SQL", NOMBRES),
+}
+
+_histogrammes = {}
+_verrou = threading.Lock()
+
+# Mesure de la requête en cours ; suit la requête dans les threads de sync_to_async
+_mesure = contextvars.ContextVar('checklist_mesure', default=None)
+
+
+class Mesure:
+    def __init__(self):
+        self.compteur = CompteurRequetes()
+        self.duree_gabarits = 0.0
+        self.profondeur_gabarits = 0
+
+
+def _sql(execute, sql, params, many, context):
+    mesure = _mesure.get()
+    if mesure is None:
+        return execute(sql, params, many, context)
+    return mesure.compteur(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def _instrumenter_connexion(sender, connection, **kwargs):
+    # Les wrappers survivent à une reconnexion : un seul par connexion
+    if _sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql)
+
+
+class _GabaritMesure:
+    def __init__(self, gabarit):
+        self.gabarit = gabarit
+
+    def __getattr__(self, nom):
+        return getattr(self.gabarit, nom)
+
+    def render(self, context=None, request=None):
+        mesure = _mesure.get()
+        if mesure is None:
+            return self.gabarit.render(context, request)
+        # Seul le rendu le plus externe compte, un gabarit rendu dans un autre n'est pas compté deux fois
+        mesure.profondeur_gabarits += 1
+        debut = time.perf_counter()
+        try:
+            return self.gabarit.render(context, request)
+        finally:
+            mesure.profondeur_gabarits -= 1
+            if not mesure.profondeur_gabarits:
+                mesure.duree_gabarits += time.perf_counter() - debut
+
+
+class GabaritsMesures(DjangoTemplates):
+    """Moteur de gabarits Django qui chronomètre les rendus de la requête en cours."""
+
+    def from_string(self, template_code):
+        return _GabaritMesure(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _GabaritMesure(super().get_template(template_name))
+
+
+def observer(nom, valeur, **etiquettes):
+    cle = (nom, tuple(sorted(etiquettes.items())))
+    bornes = HISTOGRAMMES[nom][1]
+    with _verrou:
+        histogramme = _histogrammes.get(cle)
+        if histogramme is None:
+            histogramme = _histogrammes[cle] = {'compte': [0] * (len(bornes) + 1), 'somme': 0.0, 'nombre': 0}
+        histogramme['compte'][bisect_left(bornes, valeur)] += 1
+        histogramme['somme'] += valeur
+        histogramme['nombre'] += 1
+
+
+def reinitialiser():
+    with _verrou:
+        _histogrammes.clear()
+
+
+def _echapper(valeur):
+    return str(valeur).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquettes(etiquettes, **autres):
+    return ','.join(f'{cle}="{_echapper(valeur)}"' for cle, valeur in (*etiquettes, *autres.items()))
+
+
+def exposition():
+    """Histogrammes au format texte Prometheus (version 0.0.4)."""
+    with _verrou:
+        instantane = {cle: {**h, 'compte': list(h['compte'])} for cle, h in _histogrammes.items()}
+    lignes = []
+    for nom, (aide, bornes) in HISTOGRAMMES.items():
+        lignes.append(f'# HELP {nom} {aide}')
+        lignes.append(f'# TYPE {nom} histogram')
+        for (cle_nom, etiquettes), h in sorted(instantane.items()):
+            if cle_nom != nom:
+                continue
+            cumul = 0
+            for borne, compte in zip((*bornes, '+Inf'), h['compte']):
+                cumul += compte
+                lignes.append(f'{nom}_bucket{{{_etiquettes(etiquettes, le=borne)}}} {cumul}')
+            lignes.append(f'{nom}_sum{{{_etiquettes(etiquettes)}}} {h["somme"]}')
+            lignes.append(f'{nom}_count{{{_etiquettes(etiquettes)}}} {h["nombre"]}')
+    return '\n'.join(lignes) + '\n'
+
+
+def _action(request):
+    # Nom d'action de fiche_detail, ramené au nom enregistré : une action à
+    # préfixe (« valider_tache_operateur_12 ») ne crée pas une série par tâche
+    if request.method != 'POST' or request.content_type not in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        return ''
+    nom = request.POST.get('action')
+    if not nom:
+        return ''
+    action, _ = actions.resoudre(nom)
+    return action.nom if action is not None else 'inconnue'
+
+
+def _enregistrer(request, response, mesure, duree):
+    vue = request.resolver_match.view_name if request.resolver_match else 'non_resolue'
+    etiquettes = {'vue': vue, 'action': _action(request)}
+    compteur = mesure.compteur
+    observer('checklist_requete_duree_secondes', duree, **etiquettes)
+    observer('checklist_requete_sql_secondes', compteur.duree_sql, **etiquettes)
+    observer('checklist_requete_gabarits_secondes', mesure.duree_gabarits, **etiquettes)
+    observer('checklist_requete_sql_nombre', compteur.nombre, **etiquettes)
+    if duree >= settings.METRIQUES_SEUIL_LENT:
+        lentes = sorted(compteur.requetes, key=lambda r: r[0], reverse=True)[:5]
+        logger.warning(
+            "Requête lente %s %s (vue %s, action %s, statut %s) : %.0f ms dont %d requêtes SQL en %.0f ms et %.0f ms de gabarits\n%s",
+            request.method, request.path, vue, etiquettes['action'] or '-', response.status_code,
+            1000 * duree, compteur.nombre, 1000 * compteur.duree_sql, 1000 * mesure.duree_gabarits,
+            '\n'.join(f"  {1000 * d:.1f} ms : {sql}" for d, sql in lentes),
+        )
+
+
+class MetriquesMiddleware:
+    """
+    Mesure chaque requête : durée totale, nombre et temps des requêtes SQL,
+    temps de rendu des gabarits, par nom d'URL et par action POST. Pour une
+    réponse en flux, seule la préparation est mesurée, pas l'envoi.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mesure = Mesure()
+        jeton = _mesure.set(mesure)
+        debut = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _mesure.reset(jeton)
+        _enregistrer(request, response, mesure, time.perf_counter() - debut)
+        return response
+
+    async def __acall__(self, request):
+        mesure = Mesure()
+        jeton = _mesure.set(mesure)
+        debut = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _mesure.reset(jeton)
+        _enregistrer(request, response, mesure, time.perf_counter() - debut)
+        return response
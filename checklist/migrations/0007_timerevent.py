@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def convertir_chronometres(apps, schema_editor):
+    # Les chronomètres en cours avaient une date de début décalée de la durée
+    # des pauses : elle devient le début de l'intervalle actif, et le temps
+    # actif déjà écoulé des chronomètres en pause est reporté dans la durée.
+    for nom in ('MesureComposants', 'MelangeMortier', 'Tache'):
+        modele = apps.get_model('checklist', nom)
+        en_cours = modele.objects.filter(date_debut__isnull=False, date_fin__isnull=True)
+        en_cours.filter(date_pause__isnull=False).update(duree=F('date_pause') - F('date_debut'))
+        en_cours.update(date_reprise=F('date_debut'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0006_melangemortier_etape_ajouter_fibre_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='melangemortier',
+            name='date_reprise',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='melangemortier',
+            name='duree_pause',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mesurecomposants',
+            name='date_reprise',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mesurecomposants',
+            name='duree_pause',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tache',
+            name='date_reprise',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tache',
+            name='duree_pause',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TimerEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('etape', models.CharField(choices=[('mesure_composants', 'Mesure des composants'), ('melange_mortier', 'Mélange du mortier'), ('tache', 'Tâche')], max_length=20)),
+                ('type', models.CharField(choices=[('start', 'Démarrage'), ('pause', 'Pause'), ('resume', 'Reprise'), ('finish', 'Fin')], max_length=10)),
+                ('horodatage', models.DateTimeField(default=django.utils.timezone.now)),
+                ('fiche', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='evenements_chrono', to='checklist.fichesuivi')),
+                ('tache', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='evenements_chrono', to='checklist.tache')),
+                ('utilisateur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fiche', 'etape', 'horodatage'], name='timerevent_fiche_etape_idx')],
+            },
+        ),
+        migrations.RunPython(convertir_chronometres, migrations.RunPython.noop),
+    ]
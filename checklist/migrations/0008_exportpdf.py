@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0007_timerevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportPDF',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('empreinte', models.CharField(max_length=64)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('erreur', 'Erreur')], default='en_attente', max_length=12)),
+                ('date_demande', models.DateTimeField(auto_now_add=True)),
+                ('date_fin', models.DateTimeField(blank=True, null=True)),
+                ('erreur', models.TextField(blank=True)),
+                ('fiche', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exports_pdf', to='checklist.fichesuivi')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('fiche', 'empreinte'), name='export_pdf_unique_par_empreinte')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def supprimer_taches_en_double(apps, schema_editor):
+    # Avant la contrainte d'unicité : garder la première tâche de chaque (fiche, étape)
+    Tache = apps.get_model('checklist', 'Tache')
+    doublons = (
+        Tache.objects.values('fiche_id', 'etape_id')
+        .annotate(premiere=Min('id'), nombre=Count('id'))
+        .filter(nombre__gt=1)
+    )
+    for doublon in doublons:
+        Tache.objects.filter(fiche_id=doublon['fiche_id'], etape_id=doublon['etape_id']).exclude(id=doublon['premiere']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0008_exportpdf'),
+    ]
+
+    operations = [
+        migrations.RunPython(supprimer_taches_en_double, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0009_taches_sans_doublon'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='etape',
+            index=models.Index(fields=['ordre'], name='etape_ordre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fichesuivi',
+            index=models.Index(fields=['operateur', '-date_creation'], name='fiche_operateur_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fichesuivi',
+            index=models.Index(fields=['controleur', 'valide_par_controleur'], name='fiche_controleur_valid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fichesuivi',
+            index=models.Index(fields=['atelier', 'date_creation'], name='fiche_atelier_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tache',
+            constraint=models.UniqueConstraint(fields=('fiche', 'etape'), name='tache_unique_par_etape'),
+        ),
+    ]
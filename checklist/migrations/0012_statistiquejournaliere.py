@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0011_tache_attente_controle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatistiqueJournaliere',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour', models.DateField()),
+                ('type_etape', models.CharField(choices=[('mesure_composants', 'Mesure des composants'), ('melange_mortier', 'Mélange du mortier'), ('tache', 'Tâche')], max_length=20)),
+                ('nombre', models.PositiveIntegerField(default=0)),
+                ('duree_totale', models.DurationField(blank=True, null=True)),
+                ('pause_totale', models.DurationField(blank=True, null=True)),
+                ('nombre_non_conforme', models.PositiveIntegerField(default=0)),
+                ('nombre_densite', models.PositiveIntegerField(default=0)),
+                ('densite_somme', models.FloatField(blank=True, null=True)),
+                ('densite_somme_carres', models.FloatField(blank=True, null=True)),
+                ('densite_min', models.FloatField(blank=True, null=True)),
+                ('densite_max', models.FloatField(blank=True, null=True)),
+                ('densite_histogramme', models.JSONField(blank=True, default=dict)),
+                ('atelier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statistiques', to='checklist.atelier')),
+                ('etape', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='statistiques', to='checklist.etape')),
+                ('cle', models.CharField(max_length=64, unique=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['jour', 'atelier'], name='statistique_jour_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='melangemortier',
+            index=models.Index(fields=['date_fin'], name='melange_date_fin_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mesurecomposants',
+            index=models.Index(fields=['date_fin'], name='mesure_date_fin_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tache',
+            index=models.Index(fields=['date_fin'], name='tache_date_fin_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0012_statistiquejournaliere'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActionSynchronisee',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cle', models.CharField(max_length=64)),
+                ('action', models.CharField(max_length=100)),
+                ('horodatage_client', models.DateTimeField(blank=True, null=True)),
+                ('date_reception', models.DateTimeField(auto_now_add=True)),
+                ('statut', models.CharField(choices=[('appliquee', 'Appliquée'), ('refusee', 'Refusée')], max_length=10)),
+                ('resultat', models.JSONField(blank=True, default=dict)),
+                ('fiche', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actions_synchronisees', to='checklist.fichesuivi')),
+                ('utilisateur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('utilisateur', 'cle'), name='action_synchronisee_unique_par_cle')],
+            },
+        ),
+    ]
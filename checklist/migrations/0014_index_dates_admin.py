@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0013_actionsynchronisee'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fichesuivi',
+            index=models.Index(fields=['date_creation'], name='fiche_date_creation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['date'], name='incident_date_idx'),
+        ),
+    ]
@@ -0,0 +1,149 @@
+import hashlib
+from io import BytesIO
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+from PIL import Image, UnidentifiedImageError
+
+# Normalisation des signatures telle qu'à cette migration (checklist.signatures
+# peut évoluer, les empreintes déjà calculées ne doivent pas changer)
+LARGEUR_MAX = 600
+SEUIL_ENCRE = 160
+# Tâches relues et mises à jour par paquet
+TAILLE_LOT = 1000
+
+
+def normaliser(contenu):
+    """PNG 1 bit cadré sur le trait, ou None si l'image est illisible ou vide."""
+    try:
+        image = Image.open(BytesIO(contenu))
+        image.load()
+    except (UnidentifiedImageError, OSError):
+        return None
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        fond = Image.new('RGBA', image.size, 'white')
+        image = Image.alpha_composite(fond, image)
+    gris = image.convert('L')
+    cadre = gris.point(lambda p: 255 if p < SEUIL_ENCRE else 0).getbbox()
+    if cadre is None:
+        return None
+    gris = gris.crop(cadre)
+    if gris.width > LARGEUR_MAX:
+        gris = gris.resize((LARGEUR_MAX, max(1, round(gris.height * LARGEUR_MAX / gris.width))), Image.LANCZOS)
+    trait = gris.point(lambda p: 255 if p >= SEUIL_ENCRE else 0).convert('1', dither=Image.NONE)
+    sortie = BytesIO()
+    trait.save(sortie, format='PNG', optimize=True)
+    return sortie.getvalue(), trait.size
+
+
+def chemin(empreinte):
+    return f'signatures/{empreinte[:2]}/{empreinte}.png'
+
+
+def convertir(apps, schema_editor):
+    # Une Signature par image distincte. Les fichiers d'origine restent en
+    # place (la migration peut encore être annulée) : la commande
+    # purger_signatures les supprime une fois la migration validée.
+    Signature = apps.get_model('checklist', 'Signature')
+    Tache = apps.get_model('checklist', 'Tache')
+    par_fichier = {}
+
+    def signature_de(nom, utilisateur_id):
+        if nom not in par_fichier:
+            par_fichier[nom] = None
+            try:
+                with default_storage.open(nom, 'rb') as f:
+                    normalisee = normaliser(f.read())
+            except OSError:
+                return None
+            if normalisee is None:
+                return None
+            png, (largeur, hauteur) = normalisee
+            empreinte = hashlib.sha256(png).hexdigest()
+            signature = Signature.objects.filter(empreinte=empreinte).first()
+            if signature is None:
+                if not default_storage.exists(chemin(empreinte)):
+                    default_storage.save(chemin(empreinte), ContentFile(png))
+                signature = Signature.objects.create(
+                    empreinte=empreinte, fichier=chemin(empreinte), utilisateur_id=utilisateur_id,
+                    largeur=largeur, hauteur=hauteur,
+                )
+            par_fichier[nom] = signature.id
+        return par_fichier[nom]
+
+    taches = Tache.objects.filter(models.Q(signature_operateur__gt='') | models.Q(signature_controleur__gt=''))
+    lot = []
+    for tache in taches.iterator(chunk_size=TAILLE_LOT):
+        if tache.signature_operateur:
+            tache.signature_operateur_ref_id = signature_de(tache.signature_operateur.name, tache.valide_par_operateur_id)
+        if tache.signature_controleur:
+            tache.signature_controleur_ref_id = signature_de(tache.signature_controleur.name, tache.valide_par_controleur_id)
+        lot.append(tache)
+        if len(lot) == TAILLE_LOT:
+            Tache.objects.bulk_update(lot, ['signature_operateur_ref', 'signature_controleur_ref'])
+            lot = []
+    Tache.objects.bulk_update(lot, ['signature_operateur_ref', 'signature_controleur_ref'])
+
+
+def restaurer(apps, schema_editor):
+    # Retour aux champs image : chaque tâche pointe sur le fichier partagé
+    Tache = apps.get_model('checklist', 'Tache')
+    taches = Tache.objects.filter(
+        models.Q(signature_operateur_ref__isnull=False) | models.Q(signature_controleur_ref__isnull=False)
+    ).select_related('signature_operateur_ref', 'signature_controleur_ref')
+    lot = []
+    for tache in taches.iterator(chunk_size=TAILLE_LOT):
+        if tache.signature_operateur_ref:
+            tache.signature_operateur = tache.signature_operateur_ref.fichier.name
+        if tache.signature_controleur_ref:
+            tache.signature_controleur = tache.signature_controleur_ref.fichier.name
+        lot.append(tache)
+        if len(lot) == TAILLE_LOT:
+            Tache.objects.bulk_update(lot, ['signature_operateur', 'signature_controleur'])
+            lot = []
+    Tache.objects.bulk_update(lot, ['signature_operateur', 'signature_controleur'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0014_index_dates_admin'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Signature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('empreinte', models.CharField(max_length=64, unique=True)),
+                ('fichier', models.FileField(upload_to='signatures/')),
+                ('largeur', models.PositiveIntegerField()),
+                ('hauteur', models.PositiveIntegerField()),
+                ('date_depot', models.DateTimeField(default=django.utils.timezone.now)),
+                ('utilisateur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='signatures', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['utilisateur', '-date_depot'], name='signature_utilisateur_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='tache',
+            name='signature_operateur_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='checklist.signature'),
+        ),
+        migrations.AddField(
+            model_name='tache',
+            name='signature_controleur_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='checklist.signature'),
+        ),
+        # Les anciens champs sont retirés par 0016, dans une autre transaction :
+        # sous PostgreSQL, les contrôles de clés étrangères différés laissés
+        # par ces mises à jour interdisent l'ALTER TABLE qui suivrait ici.
+        migrations.RunPython(convertir, restaurer),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+# Suite de 0015, dans sa propre transaction : les tâches pointent sur les
+# signatures, les anciens champs image sont retirés et les nouveaux prennent leur nom.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0015_signature'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='tache',
+            name='signature_operateur',
+        ),
+        migrations.RemoveField(
+            model_name='tache',
+            name='signature_controleur',
+        ),
+        migrations.RenameField(
+            model_name='tache',
+            old_name='signature_operateur_ref',
+            new_name='signature_operateur',
+        ),
+        migrations.RenameField(
+            model_name='tache',
+            old_name='signature_controleur_ref',
+            new_name='signature_controleur',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0016_tache_signature'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FicheArchivee',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('date_creation', models.DateTimeField()),
+                ('date_archivage', models.DateTimeField(default=django.utils.timezone.now)),
+                ('derniere_fin', models.DateTimeField(blank=True, null=True)),
+                ('contenu', models.BinaryField()),
+                ('atelier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='checklist.atelier')),
+                ('controleur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('operateur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['atelier', 'date_creation'], name='archive_atelier_date_idx'), models.Index(fields=['date_creation'], name='archive_date_creation_idx'), models.Index(fields=['atelier', 'derniere_fin'], name='archive_atelier_fin_idx'), models.Index(fields=['derniere_fin'], name='archive_derniere_fin_idx')],
+            },
+        ),
+    ]
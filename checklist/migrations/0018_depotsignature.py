@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def copier_depots(apps, schema_editor):
+    # Dépôts connus : le dernier déposant de chaque signature, et les
+    # validants des tâches qui l'ont reprise (un dépôt plus récent de la même
+    # image par un autre utilisateur leur avait pris la signature)
+    Signature = apps.get_model('checklist', 'Signature')
+    Tache = apps.get_model('checklist', 'Tache')
+    DepotSignature = apps.get_model('checklist', 'DepotSignature')
+    depots = {}
+
+    def ajouter(utilisateur_id, signature_id, date):
+        if utilisateur_id and signature_id and date:
+            cle = (utilisateur_id, signature_id)
+            depots[cle] = max(depots.get(cle, date), date)
+
+    for utilisateur_id, signature_id, date in Signature.objects.values_list('utilisateur_id', 'id', 'date_depot'):
+        ajouter(utilisateur_id, signature_id, date)
+    for role in ('operateur', 'controleur'):
+        utilisations = Tache.objects.filter(**{f'signature_{role}__isnull': False}).values_list(
+            f'valide_par_{role}_id', f'signature_{role}_id',
+        ).annotate(date=Max(f'date_validation_{role}')).order_by()
+        for utilisateur_id, signature_id, date in utilisations:
+            ajouter(utilisateur_id, signature_id, date)
+    DepotSignature.objects.bulk_create([
+        DepotSignature(utilisateur_id=utilisateur_id, signature_id=signature_id, date_depot=date)
+        for (utilisateur_id, signature_id), date in depots.items()
+    ], batch_size=1000)
+
+
+def restaurer_deposants(apps, schema_editor):
+    # Retour à un seul déposant par signature : le plus récent
+    Signature = apps.get_model('checklist', 'Signature')
+    DepotSignature = apps.get_model('checklist', 'DepotSignature')
+    signatures = []
+    for depot in DepotSignature.objects.order_by('signature_id', '-date_depot').iterator(chunk_size=1000):
+        if not signatures or signatures[-1].id != depot.signature_id:
+            signatures.append(Signature(id=depot.signature_id, utilisateur_id=depot.utilisateur_id, date_depot=depot.date_depot))
+    Signature.objects.bulk_update(signatures, ['utilisateur', 'date_depot'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0017_fiche_archivee'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepotSignature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_depot', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='signature',
+            name='signature_utilisateur_idx',
+        ),
+        migrations.AddField(
+            model_name='depotsignature',
+            name='signature',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='depots', to='checklist.signature'),
+        ),
+        migrations.AddField(
+            model_name='depotsignature',
+            name='utilisateur',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='depots_signature', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='depotsignature',
+            index=models.Index(fields=['utilisateur', '-date_depot'], name='depot_utilisateur_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='depotsignature',
+            constraint=models.UniqueConstraint(fields=('utilisateur', 'signature'), name='depot_signature_unique'),
+        ),
+        migrations.RunPython(copier_depots, restaurer_deposants),
+    ]
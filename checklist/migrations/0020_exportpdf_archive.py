@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checklist', '0019_exportlotpdf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportpdf',
+            name='archive',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='exports_pdf', to='checklist.fichearchivee'),
+        ),
+        migrations.AlterField(
+            model_name='exportpdf',
+            name='fiche',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='exports_pdf', to='checklist.fichesuivi'),
+        ),
+        migrations.AddConstraint(
+            model_name='exportpdf',
+            constraint=models.UniqueConstraint(fields=('archive', 'empreinte'), name='export_pdf_archive_unique_par_empreinte'),
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Create your models here.
 
@@ -12,6 +13,10 @@ class Atelier(models.Model):
 class Incident(models.Model):
     description = models.TextField()
     date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Navigation par date dans l'administration
+        indexes = [models.Index(fields=['date'], name='incident_date_idx')]
     
     def __str__(self):
         return f"Incident du {self.date.strftime('%d/%m/%Y %H:%M')}"
@@ -36,37 +41,146 @@ class FicheSuivi(models.Model):
     valide_par_controleur = models.ForeignKey(User, null=True, blank=True, related_name='fiches_validees_controleur', on_delete=models.SET_NULL)
     date_validation_controleur = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Accueil : fiches d'un opérateur, les plus récentes d'abord
+            models.Index(fields=['operateur', '-date_creation'], name='fiche_operateur_date_idx'),
+            # File du contrôleur : fiches en attente de validation
+            models.Index(fields=['controleur', 'valide_par_controleur'], name='fiche_controleur_valid_idx'),
+            # Exports par atelier et période
+            models.Index(fields=['atelier', 'date_creation'], name='fiche_atelier_date_idx'),
+            # Navigation par date dans l'administration, tous ateliers confondus
+            models.Index(fields=['date_creation'], name='fiche_date_creation_idx'),
+        ]
+
     def __str__(self):
         return f"Fiche {self.id} - {self.atelier}"
 
+    def generer_taches(self):
+        # Une tâche par étape, insérées en une seule requête INSERT ... SELECT :
+        # bulk_create la découperait selon la limite de paramètres de la base.
+        # Les tâches suivent les étapes en base au moment de l'insertion ; le
+        # référentiel en cache sert ensuite à leur rattacher les étapes.
+        from .referentiel import etapes_ordonnees
+        try:
+            with transaction.atomic():
+                FicheSuivi.generer_taches_en_lot([self.id])
+        except IntegrityError:
+            # Générées entre-temps par une requête concurrente
+            pass
+        etapes = {etape.id: etape for etape in etapes_ordonnees()}
+        taches = list(self.taches.all())
+        if any(tache.etape_id not in etapes for tache in taches):
+            # Étape ajoutée depuis la mise en cache
+            return list(self.taches.select_related('etape').order_by('etape__ordre'))
+        for tache in taches:
+            tache.etape = etapes[tache.etape_id]
+        return sorted(taches, key=lambda tache: tache.etape.ordre)
+
+    @staticmethod
+    def generer_taches_en_lot(fiche_ids):
+        """
+        Tâches de fiches tout juste créées, en une requête INSERT ... SELECT par
+        paquet de fiches : le produit fiches x étapes est fait par la base.
+        """
+        fiche_ids = list(fiche_ids)
+        # Toutes les autres colonnes reçoivent la valeur qu'aurait un Tache()
+        # enregistré (default, y compris appelable, ou auto_now), comme avec bulk_create
+        modele = Tache()
+        champs = [
+            champ for champ in Tache._meta.concrete_fields
+            if not champ.primary_key and champ.name not in ('fiche', 'etape')
+        ]
+        qn = connection.ops.quote_name
+        colonnes = ', '.join(qn(champ.column) for champ in champs)
+        valeurs = [champ.get_db_prep_save(champ.pre_save(modele, True), connection) for champ in champs]
+        with connection.cursor() as cursor:
+            for i in range(0, len(fiche_ids), 500):
+                paquet = fiche_ids[i:i + 500]
+                cursor.execute(
+                    f"INSERT INTO {qn(Tache._meta.db_table)} ({qn('fiche_id')}, {qn('etape_id')}, {colonnes}) "
+                    f"SELECT f.{qn('id')}, e.{qn('id')}, {', '.join(['%s'] * len(champs))} "
+                    f"FROM {qn(FicheSuivi._meta.db_table)} f CROSS JOIN {qn(Etape._meta.db_table)} e "
+                    f"WHERE f.{qn('id')} IN ({', '.join(['%s'] * len(paquet))})",
+                    valeurs + paquet,
+                )
+
 class Etape(models.Model):
     nom = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     consignes = models.TextField(blank=True)
     ordre = models.PositiveIntegerField()
-    
+
+    class Meta:
+        indexes = [models.Index(fields=['ordre'], name='etape_ordre_idx')]
+
     def __str__(self):
         return f"{self.ordre}. {self.nom}"
 
+class Signature(models.Model):
+    # Image de signature stockée une seule fois, nommée par l'empreinte
+    # SHA-256 de son PNG normalisé ; les tâches y font référence.
+    empreinte = models.CharField(max_length=64, unique=True)
+    fichier = models.FileField(upload_to='signatures/')
+    # Premier déposant de l'image ; chaque déposant a son DepotSignature
+    utilisateur = models.ForeignKey(User, null=True, blank=True, related_name='signatures', on_delete=models.SET_NULL)
+    largeur = models.PositiveIntegerField()
+    hauteur = models.PositiveIntegerField()
+    date_depot = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Signature {self.empreinte[:12]}"
+
+class DepotSignature(models.Model):
+    # Signature déposée par un utilisateur : deux utilisateurs qui déposent la
+    # même image partagent le fichier, chacun garde son dépôt.
+    utilisateur = models.ForeignKey(User, on_delete=models.CASCADE, related_name='depots_signature')
+    signature = models.ForeignKey(Signature, on_delete=models.CASCADE, related_name='depots')
+    # Dernier dépôt : une image déjà déposée redevient la signature courante
+    date_depot = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['utilisateur', 'signature'], name='depot_signature_unique')]
+        # Dernière signature déposée par un utilisateur
+        indexes = [models.Index(fields=['utilisateur', '-date_depot'], name='depot_utilisateur_idx')]
+
+    def __str__(self):
+        return f"{self.utilisateur} - {self.signature}"
+
 class Tache(models.Model):
     fiche = models.ForeignKey(FicheSuivi, on_delete=models.CASCADE, related_name='taches')
     etape = models.ForeignKey(Etape, on_delete=models.CASCADE)
     date_debut = models.DateTimeField(null=True, blank=True)
     date_pause = models.DateTimeField(null=True, blank=True)
     date_fin = models.DateTimeField(null=True, blank=True)
+    # Début du dernier intervalle actif (démarrage ou reprise)
+    date_reprise = models.DateTimeField(null=True, blank=True)
     validation = models.CharField(max_length=20, choices=[('conforme', 'Conforme'), ('non_conforme', 'Non conforme'), ('en_attente', 'En attente')], default='en_attente')
     observations = models.TextField(blank=True)
     duree = models.DurationField(null=True, blank=True)
-    signature_operateur = models.ImageField(upload_to='signatures/', null=True, blank=True)
-    signature_controleur = models.ImageField(upload_to='signatures/', null=True, blank=True)
+    duree_pause = models.DurationField(null=True, blank=True)
+    signature_operateur = models.ForeignKey(Signature, null=True, blank=True, related_name='+', on_delete=models.PROTECT)
+    signature_controleur = models.ForeignKey(Signature, null=True, blank=True, related_name='+', on_delete=models.PROTECT)
     # Validation opérateur/contrôleur pour l'étape
     valide_par_operateur = models.ForeignKey(User, null=True, blank=True, related_name='taches_validees_operateur', on_delete=models.SET_NULL)
     date_validation_operateur = models.DateTimeField(null=True, blank=True)
     valide_par_controleur = models.ForeignKey(User, null=True, blank=True, related_name='taches_validees_controleur', on_delete=models.SET_NULL)
     date_validation_controleur = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            # Une seule tâche par étape d'une fiche ; sert aussi d'index (fiche, etape)
+            models.UniqueConstraint(fields=['fiche', 'etape'], name='tache_unique_par_etape'),
+        ]
+        indexes = [
+            # Index partiel : seules les tâches en attente du contrôleur y figurent
+            models.Index(fields=['fiche'], condition=models.Q(valide_par_controleur__isnull=True), name='tache_attente_controle_idx'),
+            # Étapes terminées d'un jour, relues par le recalcul des statistiques
+            models.Index(fields=['date_fin'], name='tache_date_fin_idx'),
+        ]
+
     def __str__(self):
-        return f"Tâche: {self.etape.nom} (Fiche {self.fiche.id})"
+        return f"Tâche: {self.etape.nom} (Fiche {self.fiche_id})"
 
 class MesureComposants(models.Model):
     fiche = models.OneToOneField(FicheSuivi, on_delete=models.CASCADE, related_name="mesure_composants")
@@ -86,10 +200,16 @@ class MesureComposants(models.Model):
     date_debut = models.DateTimeField(null=True, blank=True)
     date_pause = models.DateTimeField(null=True, blank=True)
     date_fin = models.DateTimeField(null=True, blank=True)
+    date_reprise = models.DateTimeField(null=True, blank=True)
+    # Temps actif et temps en pause, cumulés à chaque pause/reprise/fin
     duree = models.DurationField(null=True, blank=True)
+    duree_pause = models.DurationField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['date_fin'], name='mesure_date_fin_idx')]
 
     def __str__(self):
-        return f"Mesure composants fiche {self.fiche.id}"
+        return f"Mesure composants fiche {self.fiche_id}"
 
 class MelangeMortier(models.Model):
     fiche = models.OneToOneField(FicheSuivi, on_delete=models.CASCADE, related_name="melange_mortier")
@@ -102,7 +222,10 @@ class MelangeMortier(models.Model):
     date_debut = models.DateTimeField(null=True, blank=True)
     date_pause = models.DateTimeField(null=True, blank=True)
     date_fin = models.DateTimeField(null=True, blank=True)
+    date_reprise = models.DateTimeField(null=True, blank=True)
+    # Temps actif et temps en pause, cumulés à chaque pause/reprise/fin
     duree = models.DurationField(null=True, blank=True)
+    duree_pause = models.DurationField(null=True, blank=True)
     
     # Étapes du processus
     etape_verser_eau = models.BooleanField(default=False)
@@ -112,5 +235,159 @@ class MelangeMortier(models.Model):
     etape_ajuster_eau = models.BooleanField(default=False)
     etape_mesurer_densite = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [models.Index(fields=['date_fin'], name='melange_date_fin_idx')]
+
+    def __str__(self):
+        return f"Mélange mortier fiche {self.fiche_id}"
+
+
+class TimerEvent(models.Model):
+    # Journal en ajout seul des actions sur les chronomètres des étapes
+    TYPES = [('start', 'Démarrage'), ('pause', 'Pause'), ('resume', 'Reprise'), ('finish', 'Fin')]
+    ETAPES = [('mesure_composants', 'Mesure des composants'), ('melange_mortier', 'Mélange du mortier'), ('tache', 'Tâche')]
+
+    fiche = models.ForeignKey(FicheSuivi, on_delete=models.CASCADE, related_name='evenements_chrono')
+    etape = models.CharField(max_length=20, choices=ETAPES)
+    tache = models.ForeignKey(Tache, null=True, blank=True, on_delete=models.CASCADE, related_name='evenements_chrono')
+    type = models.CharField(max_length=10, choices=TYPES)
+    horodatage = models.DateTimeField(default=timezone.now)
+    utilisateur = models.ForeignKey(User, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [models.Index(fields=['fiche', 'etape', 'horodatage'], name='timerevent_fiche_etape_idx')]
+
+    def __str__(self):
+        return f"{self.get_type_display()} {self.get_etape_display()} (Fiche {self.fiche_id})"
+
+
+class ExportPDF(models.Model):
+    # File d'attente locale des générations de PDF, une ligne par état de fiche
+    # courante ou archivée
+    STATUTS = [('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('erreur', 'Erreur')]
+
+    fiche = models.ForeignKey(FicheSuivi, null=True, blank=True, on_delete=models.CASCADE, related_name='exports_pdf')
+    # Fiche archivée, rendue depuis son instantané par traiter_exports_pdf
+    archive = models.ForeignKey('FicheArchivee', null=True, blank=True, on_delete=models.CASCADE, related_name='exports_pdf')
+    # Empreinte SHA-256 du HTML rendu : nomme le fichier en cache
+    empreinte = models.CharField(max_length=64)
+    statut = models.CharField(max_length=12, choices=STATUTS, default='en_attente')
+    date_demande = models.DateTimeField(auto_now_add=True)
+    date_fin = models.DateTimeField(null=True, blank=True)
+    erreur = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fiche', 'empreinte'], name='export_pdf_unique_par_empreinte'),
+            models.UniqueConstraint(fields=['archive', 'empreinte'], name='export_pdf_archive_unique_par_empreinte'),
+        ]
+
+    def __str__(self):
+        return f"Export PDF fiche {self.fiche_id or self.archive_id} ({self.get_statut_display()})"
+
+
+class ExportLotPDF(models.Model):
+    # Archive ZIP des PDF d'un lot de fiches, construite par traiter_exports_pdf
+    # hors des processus web : les filtres de la demande sont conservés tels quels
+    utilisateur = models.ForeignKey(User, on_delete=models.CASCADE, related_name='exports_lot_pdf')
+    atelier = models.ForeignKey(Atelier, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    debut = models.DateField(null=True, blank=True)
+    fin = models.DateField(null=True, blank=True)
+    statut = models.CharField(max_length=12, choices=ExportPDF.STATUTS, default='en_attente')
+    date_demande = models.DateTimeField(auto_now_add=True)
+    date_fin = models.DateTimeField(null=True, blank=True)
+    erreur = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['statut'], name='export_lot_statut_idx')]
+
+    def __str__(self):
+        return f"Export PDF par lot {self.id} ({self.get_statut_display()})"
+
+
+class StatistiqueJournaliere(models.Model):
+    # Agrégats par jour, atelier et étape, recalculés quand une étape se termine
+    TYPES_ETAPE = [('mesure_composants', 'Mesure des composants'), ('melange_mortier', 'Mélange du mortier'), ('tache', 'Tâche')]
+
+    jour = models.DateField()
+    atelier = models.ForeignKey(Atelier, on_delete=models.CASCADE, related_name='statistiques')
+    type_etape = models.CharField(max_length=20, choices=TYPES_ETAPE)
+    etape = models.ForeignKey(Etape, null=True, blank=True, on_delete=models.CASCADE, related_name='statistiques')
+    nombre = models.PositiveIntegerField(default=0)
+    duree_totale = models.DurationField(null=True, blank=True)
+    pause_totale = models.DurationField(null=True, blank=True)
+    nombre_non_conforme = models.PositiveIntegerField(default=0)
+    # Distribution de la densité du mortier : moments et histogramme par pas de 0,1 kg/L
+    nombre_densite = models.PositiveIntegerField(default=0)
+    densite_somme = models.FloatField(null=True, blank=True)
+    densite_somme_carres = models.FloatField(null=True, blank=True)
+    densite_min = models.FloatField(null=True, blank=True)
+    densite_max = models.FloatField(null=True, blank=True)
+    densite_histogramme = models.JSONField(default=dict, blank=True)
+    # Jour, atelier et étape (tâche ou étape fixe) en une colonne unique : cible
+    # de l'upsert du recalcul, qu'une contrainte partielle ne peut pas être
+    cle = models.CharField(max_length=64, unique=True)
+
+    class Meta:
+        indexes = [
+            # Lecture du tableau de bord par période
+            models.Index(fields=['jour', 'atelier'], name='statistique_jour_idx'),
+        ]
+
+    def __str__(self):
+        return f"Statistiques du {self.jour:%d/%m/%Y} - {self.atelier_id} - {self.type_etape}"
+
+    @staticmethod
+    def calculer_cle(jour, atelier_id, type_etape, etape_id=None):
+        return f"{jour:%Y-%m-%d}:{atelier_id}:{etape_id if etape_id is not None else type_etape}"
+
+
+class ActionSynchronisee(models.Model):
+    # Clés d'idempotence des actions envoyées par lot depuis les tablettes :
+    # une action rejouée après une coupure renvoie le résultat enregistré.
+    STATUTS = [('appliquee', 'Appliquée'), ('refusee', 'Refusée')]
+
+    utilisateur = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    cle = models.CharField(max_length=64)
+    fiche = models.ForeignKey(FicheSuivi, on_delete=models.CASCADE, related_name='actions_synchronisees')
+    action = models.CharField(max_length=100)
+    horodatage_client = models.DateTimeField(null=True, blank=True)
+    date_reception = models.DateTimeField(auto_now_add=True)
+    statut = models.CharField(max_length=10, choices=STATUTS)
+    resultat = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['utilisateur', 'cle'], name='action_synchronisee_unique_par_cle')]
+
+    def __str__(self):
+        return f"{self.action} ({self.cle}) - fiche {self.fiche_id}"
+
+
+class FicheArchivee(models.Model):
+    # Fiche validée sortie des tables courantes par manage.py archive_fiches :
+    # même identifiant, colonnes d'accès et de filtre des exports, et un
+    # instantané JSON compressé de la fiche avec ses étapes et incidents.
+    id = models.BigIntegerField(primary_key=True)
+    operateur = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    controleur = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    atelier = models.ForeignKey(Atelier, related_name='+', on_delete=models.CASCADE)
+    date_creation = models.DateTimeField()
+    date_archivage = models.DateTimeField(default=timezone.now)
+    # Fin de la dernière étape terminée (tâche, mesure ou mélange) : les jours
+    # des statistiques sont ceux des fins d'étapes
+    derniere_fin = models.DateTimeField(null=True, blank=True)
+    contenu = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            # Exports par atelier et période, comme les fiches courantes
+            models.Index(fields=['atelier', 'date_creation'], name='archive_atelier_date_idx'),
+            # Exports sur une période tous ateliers
+            models.Index(fields=['date_creation'], name='archive_date_creation_idx'),
+            # Dernier jour archivé, par atelier ou tous ateliers (statistiques)
+            models.Index(fields=['atelier', 'derniere_fin'], name='archive_atelier_fin_idx'),
+            models.Index(fields=['derniere_fin'], name='archive_derniere_fin_idx'),
+        ]
+
     def __str__(self):
-        return f"Mélange mortier fiche {self.fiche.id}"
+        return f"Fiche archivée {self.id}"
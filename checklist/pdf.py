@@ -0,0 +1,160 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import rendu_pdf
+from .models import ExportPDF, FicheArchivee, Incident, Tache
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_verrou = threading.Lock()
+
+
+def pour_rendu(queryset, chemin=''):
+    """
+    Queryset chargé de tout ce que lit rendre_html, pour des fiches ou des
+    objets qui y mènent par `chemin` (ex. 'fiche__') : tâches et incidents
+    sont lus en deux requêtes, quel que soit le nombre de fiches.
+    """
+    return queryset.select_related(
+        *(chemin + relation for relation in ('atelier', 'operateur', 'controleur', 'retour_experience'))
+    ).prefetch_related(
+        Prefetch(chemin + 'taches', queryset=Tache.objects.select_related('etape').order_by('etape__ordre')),
+        Prefetch(chemin + 'incidents', queryset=Incident.objects.order_by('-date')),
+    )
+
+
+def rendre_html(fiche):
+    # Fiche lue par pour_rendu : l'ordre des tâches et des incidents vient du préchargement
+    return _html(fiche, fiche.taches.all(), fiche.incidents.all())
+
+
+def rendre_html_archive(restauree):
+    # Fiche archivée (archives.FicheRestauree) : même gabarit, même empreinte pour un même contenu
+    return _html(restauree.fiche, restauree.taches, restauree.incidents)
+
+
+def _html(fiche, taches, incidents):
+    return render_to_string('checklist/export_pdf.html', {
+        'fiche': fiche,
+        'taches': taches,
+        'incidents': incidents,
+        'retour_experience': fiche.retour_experience,
+    })
+
+
+def calculer_empreinte(html):
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+def chemin_cache(empreinte):
+    return Path(settings.PDF_EXPORT_DIR) / empreinte[:2] / f'{empreinte}.pdf'
+
+
+def en_cache(empreinte):
+    """Chemin du PDF s'il est en cache, sinon None ; un PDF servi est marqué récent pour la purge."""
+    chemin = chemin_cache(empreinte)
+    try:
+        os.utime(chemin)
+    except FileNotFoundError:
+        return None
+    return chemin
+
+
+def purger_cache(age_max=None, taille_max=None):
+    """
+    Supprime du cache disque les PDF non servis depuis `age_max` (timedelta),
+    puis les plus anciens tant que le cache dépasse `taille_max` octets.
+    Renvoie le nombre de fichiers supprimés.
+    """
+    fichiers = []
+    for chemin in Path(settings.PDF_EXPORT_DIR).glob('??/*.pdf'):
+        try:
+            etat = chemin.stat()
+        except FileNotFoundError:
+            continue
+        fichiers.append((etat.st_mtime, etat.st_size, chemin))
+    fichiers.sort()
+    limite = time.time() - age_max.total_seconds() if age_max is not None else None
+    taille = sum(octets for _, octets, _ in fichiers)
+    supprimes = 0
+    for date, octets, chemin in fichiers:
+        # Du plus ancien au plus récent : le premier fichier conservé clôt la purge
+        if not (limite is not None and date < limite) and not (taille_max is not None and taille > taille_max):
+            break
+        chemin.unlink(missing_ok=True)
+        taille -= octets
+        supprimes += 1
+    return supprimes
+
+
+def ecrire_cache(empreinte, contenu):
+    # Écriture atomique : un lecteur ne voit jamais un PDF à moitié écrit
+    chemin = chemin_cache(empreinte)
+    chemin.parent.mkdir(parents=True, exist_ok=True)
+    temporaire = chemin.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    temporaire.write_bytes(contenu)
+    os.replace(temporaire, chemin)
+    return chemin
+
+
+def _pool_generation():
+    global _pool
+    with _pool_verrou:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.PDF_EXPORT_WORKERS, thread_name_prefix='export-pdf')
+        return _pool
+
+
+def generer(export_id, html):
+    """Génère le PDF d'un export et met à jour son statut dans la file."""
+    try:
+        ExportPDF.objects.filter(id=export_id).update(statut='en_cours')
+        try:
+            export = ExportPDF.objects.get(id=export_id)
+            ecrire_cache(export.empreinte, rendu_pdf.convertir(html))
+        except Exception as e:
+            logger.exception("Échec de l'export PDF %s", export_id)
+            ExportPDF.objects.filter(id=export_id).update(statut='erreur', erreur=str(e), date_fin=timezone.now())
+        else:
+            ExportPDF.objects.filter(id=export_id).update(statut='termine', erreur='', date_fin=timezone.now())
+    finally:
+        if settings.PDF_EXPORT_WORKERS:
+            connections.close_all()
+
+
+def demander(fiche, html, empreinte):
+    """
+    Inscrit la génération du PDF d'une fiche, courante ou archivée
+    (FicheArchivee), dans la file et la confie au pool.
+
+    Une demande déjà en attente ou en cours pour le même contenu est réutilisée.
+    """
+    cible = {'archive' if isinstance(fiche, FicheArchivee) else 'fiche': fiche, 'empreinte': empreinte}
+    try:
+        export, cree = ExportPDF.objects.get_or_create(**cible)
+    except IntegrityError:
+        export, cree = ExportPDF.objects.get(**cible), False
+    if not cree and export.statut in ('en_attente', 'en_cours'):
+        return export
+    if not cree:
+        # Export terminé dont le fichier a disparu, ou précédent échec
+        ExportPDF.objects.filter(id=export.id).update(statut='en_attente', erreur='', date_fin=None)
+        export.statut = 'en_attente'
+    if settings.PDF_EXPORT_WORKERS:
+        transaction.on_commit(lambda: _pool_generation().submit(generer, export.id, html))
+    else:
+        generer(export.id, html)
+        export.refresh_from_db()
+    return export
@@ -0,0 +1,80 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Atelier, Etape
+
+# Cache de processus pour les données de référence qui ne changent presque
+# jamais : nom -> (version, valeur). La version de chaque donnée est tenue
+# dans le cache partagé, pour qu'une modification faite par un processus
+# soit vue par tous les autres.
+_cache = {}
+
+
+def _cle(nom):
+    return f'referentiel:{nom}:version'
+
+
+def _charger(nom, chargement):
+    version = cache.get(_cle(nom))
+    if version is None:
+        cache.add(_cle(nom), time.time_ns(), None)
+        version = cache.get(_cle(nom))
+    entree = _cache.get(nom)
+    if entree is not None and entree[0] == version:
+        return entree[1]
+    # Version lue avant la requête : une modification concurrente fera
+    # simplement recharger au prochain appel.
+    valeur = chargement()
+    _cache[nom] = (version, valeur)
+    return valeur
+
+
+def invalider(nom):
+    """Périme une donnée de référence : tout de suite pour ce processus, au COMMIT pour les autres."""
+    _cache.pop(nom, None)
+
+    def _renouveler():
+        _cache.pop(nom, None)
+        # Valeur unique, comme pour les versions de fiches : incr n'est pas atomique sur le cache fichier
+        cache.set(_cle(nom), time.time_ns(), None)
+    transaction.on_commit(_renouveler)
+
+
+def etapes_ordonnees():
+    # Modèle des tâches d'une fiche : les étapes dans leur ordre de fabrication
+    return _charger('etapes', lambda: tuple(Etape.objects.order_by('ordre')))
+
+
+def ateliers():
+    return _charger('ateliers', lambda: tuple(Atelier.objects.all()))
+
+
+def controleurs():
+    # Comptes actifs pouvant être désignés comme contrôleur d'une fiche
+    return _charger('controleurs', lambda: tuple(User.objects.filter(is_active=True, first_name="controleur")))
+
+
+@receiver(post_save, sender=Etape)
+@receiver(post_delete, sender=Etape)
+def _invalider_etapes(sender, **kwargs):
+    invalider('etapes')
+
+
+@receiver(post_save, sender=Atelier)
+@receiver(post_delete, sender=Atelier)
+def _invalider_ateliers(sender, **kwargs):
+    invalider('ateliers')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _invalider_controleurs(sender, update_fields=None, **kwargs):
+    # La mise à jour de last_login à chaque connexion ne change pas la liste
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalider('controleurs')
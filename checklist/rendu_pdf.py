@@ -0,0 +1,23 @@
+from io import BytesIO
+
+# Conversion HTML -> PDF isolée de Django, pour pouvoir tourner dans un
+# thread ou un processus de travail sans configuration de l'ORM.
+
+
+class ErreurRenduPDF(Exception):
+    pass
+
+
+def convertir(html):
+    from xhtml2pdf import pisa  # Utilisation de xhtml2pdf qui fonctionne mieux sur Windows
+    resultat = BytesIO()
+    pdf = pisa.pisaDocument(BytesIO(html.encode("UTF-8")), resultat)
+    if pdf.err:
+        raise ErreurRenduPDF("Erreur lors de la génération du PDF")
+    return resultat.getvalue()
+
+
+def prechauffer():
+    # Initialisation d'un processus de travail : xhtml2pdf, ReportLab et les
+    # polices standard sont chargés une fois, avant la première fiche.
+    convertir('<html><body><h1>x</h1><table><tr><td>x</td></tr></table></body></html>')
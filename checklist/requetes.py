@@ -0,0 +1,98 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# Compteur de la vue plafonnée en cours ; suit la requête dans les threads de
+# sync_to_async, que se partagent les requêtes des autres vues asynchrones
+_compteur = contextvars.ContextVar('checklist_plafond', default=None)
+
+
+class CompteurRequetes:
+    """Execute-wrapper qui compte et chronomètre les requêtes SQL d'un bloc."""
+
+    def __init__(self):
+        self.nombre = 0
+        self.duree_sql = 0.0
+        self.requetes = []
+
+    def __call__(self, execute, sql, params, many, context):
+        debut = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duree = time.perf_counter() - debut
+            self.nombre += 1
+            self.duree_sql += duree
+            self.requetes.append((duree, sql))
+
+
+class PlafondRequetesDepasse(Exception):
+    pass
+
+
+def _sql(execute, sql, params, many, context):
+    compteur = _compteur.get()
+    if compteur is None:
+        return execute(sql, params, many, context)
+    return compteur(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def _instrumenter_connexion(sender, connection, **kwargs):
+    # Les wrappers survivent à une reconnexion : un seul par connexion
+    if _sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql)
+
+
+def _verifier(vue, compteur, maximum):
+    if compteur.nombre > maximum:
+        message = "%s a exécuté %d requêtes SQL (plafond : %d)" % (vue.__name__, compteur.nombre, maximum)
+        if settings.DEBUG:
+            raise PlafondRequetesDepasse(message)
+        logger.warning(message)
+
+
+def plafond_requetes(maximum):
+    """
+    Plafonne le nombre de requêtes SQL exécutées par une vue.
+
+    Un dépassement est journalisé ; en DEBUG il lève PlafondRequetesDepasse
+    pour que les régressions N+1 soient vues dès le développement.
+    Le compteur est porté par le contexte de la requête, pas par la
+    connexion : une vue asynchrone ne compte pas les requêtes que les autres
+    vues exécutent sur le même thread de l'ORM asynchrone.
+    """
+    def decorateur(vue):
+        if asyncio.iscoroutinefunction(vue):
+            @functools.wraps(vue)
+            async def _vue_async(request, *args, **kwargs):
+                compteur = CompteurRequetes()
+                jeton = _compteur.set(compteur)
+                try:
+                    response = await vue(request, *args, **kwargs)
+                finally:
+                    _compteur.reset(jeton)
+                _verifier(vue, compteur, maximum)
+                return response
+            return _vue_async
+
+        @functools.wraps(vue)
+        def _vue(request, *args, **kwargs):
+            compteur = CompteurRequetes()
+            jeton = _compteur.set(compteur)
+            try:
+                response = vue(request, *args, **kwargs)
+            finally:
+                _compteur.reset(jeton)
+            _verifier(vue, compteur, maximum)
+            return response
+        return _vue
+    return decorateur
@@ -0,0 +1,118 @@
+from django.contrib.auth.models import User
+from import_export import fields, resources, widgets
+from import_export.instance_loaders import CachedInstanceLoader
+
+from . import cache_fiches, referentiel
+from .actions import CHAMPS_MESURE
+from .models import Atelier, Etape, FicheSuivi, MesureComposants
+
+
+class ImportEnLot(resources.ModelResource):
+    """
+    Import par lots : les lignes existantes sont chargées en une requête, les
+    nouvelles insérées par bulk_create (sans signal post_save) et les clés
+    étrangères résolues sur une seule lecture de la table liée.
+    """
+
+    class Meta:
+        use_bulk = True
+        batch_size = 1000
+        skip_diff = True
+        use_transactions = True
+        instance_loader_class = CachedInstanceLoader
+
+    def before_import(self, dataset, **kwargs):
+        super().before_import(dataset, **kwargs)
+        self.colonnes_importees = set(dataset.headers)
+
+    def get_bulk_update_fields(self):
+        # Seules les colonnes présentes dans le fichier sont réécrites : le coût
+        # de bulk_update croît avec le nombre de champs
+        return [
+            nom for nom in super().get_bulk_update_fields()
+            if not self.fields[nom].readonly and self.fields[nom].column_name in self.colonnes_importees
+        ]
+
+
+class AtelierResource(ImportEnLot):
+    class Meta:
+        model = Atelier
+        fields = ('id', 'nom')
+
+    def after_import(self, dataset, result, **kwargs):
+        super().after_import(dataset, result, **kwargs)
+        referentiel.invalider('ateliers')
+
+
+class EtapeResource(ImportEnLot):
+    class Meta:
+        model = Etape
+        fields = ('id', 'ordre', 'nom', 'description', 'consignes')
+
+    def after_import(self, dataset, result, **kwargs):
+        super().after_import(dataset, result, **kwargs)
+        referentiel.invalider('etapes')
+
+
+class FicheSuiviResource(ImportEnLot):
+    atelier = fields.Field(attribute='atelier', column_name='atelier', widget=widgets.CachedForeignKeyWidget(Atelier, 'nom'))
+    operateur = fields.Field(attribute='operateur', column_name='operateur', widget=widgets.CachedForeignKeyWidget(User, 'username'))
+    controleur = fields.Field(attribute='controleur', column_name='controleur', widget=widgets.CachedForeignKeyWidget(User, 'username'))
+    # Dates tenues par l'application : exportées, jamais importées
+    date_creation = fields.Field(attribute='date_creation', column_name='date_creation', readonly=True, widget=widgets.DateTimeWidget())
+    date_validation_operateur = fields.Field(attribute='date_validation_operateur', column_name='date_validation_operateur', readonly=True, widget=widgets.DateTimeWidget())
+    date_validation_controleur = fields.Field(attribute='date_validation_controleur', column_name='date_validation_controleur', readonly=True, widget=widgets.DateTimeWidget())
+
+    class Meta:
+        model = FicheSuivi
+        fields = ('id', 'atelier', 'operateur', 'controleur', 'date_creation', 'date_validation_operateur', 'date_validation_controleur')
+        export_order = fields
+
+    def get_queryset(self):
+        # str(fiche), affiché pour chaque ligne importée, lit l'atelier
+        return super().get_queryset().select_related('atelier')
+
+    def get_export_queryset(self, request=None):
+        return super().get_export_queryset(request).select_related('atelier', 'operateur', 'controleur')
+
+    def bulk_create(self, using_transactions, dry_run, raise_errors, batch_size=None, result=None):
+        # Les tâches des nouvelles fiches sont créées dans le même lot
+        fiches = list(self.create_instances)
+        super().bulk_create(using_transactions, dry_run, raise_errors, batch_size, result)
+        fiche_ids = [fiche.pk for fiche in fiches if fiche.pk]
+        if fiche_ids:
+            FicheSuivi.generer_taches_en_lot(fiche_ids)
+
+    def bulk_update(self, using_transactions, dry_run, raise_errors, batch_size=None, result=None):
+        cache_fiches.invalider(*(fiche.pk for fiche in self.update_instances))
+        super().bulk_update(using_transactions, dry_run, raise_errors, batch_size, result)
+
+
+class MesureComposantsResource(ImportEnLot):
+    # Une mesure par fiche : la fiche sert d'identifiant d'import
+    fiche = fields.Field(attribute='fiche_id', column_name='fiche', widget=widgets.IntegerWidget())
+    # La validation passe par la fiche, pas par l'import
+    valide = fields.Field(attribute='valide', column_name='valide', readonly=True, widget=widgets.BooleanWidget())
+    date_validation = fields.Field(attribute='date_validation', column_name='date_validation', readonly=True, widget=widgets.DateTimeWidget())
+
+    class Meta:
+        model = MesureComposants
+        fields = ('fiche', *CHAMPS_MESURE, 'commentaires', 'valide', 'date_validation')
+        import_id_fields = ('fiche',)
+
+    def bulk_update(self, using_transactions, dry_run, raise_errors, batch_size=None, result=None):
+        cache_fiches.invalider(*(mesure.fiche_id for mesure in self.update_instances))
+        super().bulk_update(using_transactions, dry_run, raise_errors, batch_size, result)
+
+    def bulk_create(self, using_transactions, dry_run, raise_errors, batch_size=None, result=None):
+        cache_fiches.invalider(*(mesure.fiche_id for mesure in self.create_instances))
+        super().bulk_create(using_transactions, dry_run, raise_errors, batch_size, result)
+
+
+# Ressources par nom, pour la commande importer
+RESSOURCES = {
+    'ateliers': AtelierResource,
+    'etapes': EtapeResource,
+    'fiches': FicheSuiviResource,
+    'mesures': MesureComposantsResource,
+}
@@ -0,0 +1,87 @@
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .models import DepotSignature, Signature
+
+# Largeur maximale conservée : au-delà, le trait n'apporte rien à l'impression
+LARGEUR_MAX = 600
+# En dessous de ce niveau de gris, un pixel est de l'encre
+SEUIL_ENCRE = 160
+
+
+class SignatureInvalide(Exception):
+    pass
+
+
+def normaliser(contenu):
+    """
+    PNG compact d'une signature : fond blanc, cadré sur le trait, réduit à
+    LARGEUR_MAX et en noir et blanc 1 bit. Deux dépôts de la même image
+    donnent les mêmes octets, donc la même empreinte.
+    """
+    try:
+        image = Image.open(BytesIO(contenu))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        raise SignatureInvalide(f"Image de signature illisible : {e}")
+    # Canvas des tablettes : trait opaque sur fond transparent
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        fond = Image.new('RGBA', image.size, 'white')
+        image = Image.alpha_composite(fond, image)
+    gris = image.convert('L')
+    cadre = gris.point(lambda p: 255 if p < SEUIL_ENCRE else 0).getbbox()
+    if cadre is None:
+        raise SignatureInvalide("La signature est vide.")
+    gris = gris.crop(cadre)
+    if gris.width > LARGEUR_MAX:
+        gris = gris.resize((LARGEUR_MAX, max(1, round(gris.height * LARGEUR_MAX / gris.width))), Image.LANCZOS)
+    trait = gris.point(lambda p: 255 if p >= SEUIL_ENCRE else 0).convert('1', dither=Image.NONE)
+    sortie = BytesIO()
+    trait.save(sortie, format='PNG', optimize=True)
+    return sortie.getvalue(), trait.size
+
+
+def chemin(empreinte):
+    return f'signatures/{empreinte[:2]}/{empreinte}.png'
+
+
+def enregistrer(contenu, utilisateur=None):
+    """
+    Signature correspondant à l'image, créée et écrite sur disque au premier
+    dépôt seulement. Chaque dépôt en fait la signature courante du déposant,
+    sans la retirer aux autres utilisateurs qui ont déposé la même image.
+    """
+    png, (largeur, hauteur) = normaliser(contenu)
+    empreinte = hashlib.sha256(png).hexdigest()
+    signature = Signature.objects.filter(empreinte=empreinte).first()
+    if signature is None:
+        nom = chemin(empreinte)
+        if not default_storage.exists(nom):
+            nom = default_storage.save(nom, ContentFile(png))
+        try:
+            with transaction.atomic():
+                signature = Signature.objects.create(
+                    empreinte=empreinte, fichier=nom, utilisateur=utilisateur, largeur=largeur, hauteur=hauteur,
+                )
+        except IntegrityError:
+            # Même image déposée en parallèle
+            signature = Signature.objects.get(empreinte=empreinte)
+    if utilisateur is not None:
+        # Un seul INSERT ... ON CONFLICT : un redépôt avance seulement la date
+        DepotSignature.objects.bulk_create(
+            [DepotSignature(utilisateur=utilisateur, signature=signature, date_depot=timezone.now())],
+            update_conflicts=True, unique_fields=['utilisateur', 'signature'], update_fields=['date_depot'],
+        )
+    return signature
+
+
+def derniere(utilisateur):
+    """Requête de la dernière signature déposée par l'utilisateur, à utiliser en sous-requête."""
+    return DepotSignature.objects.filter(utilisateur=utilisateur).order_by('-date_depot').values('signature_id')[:1]
@@ -0,0 +1,152 @@
+import math
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Max, Min, Q, Sum, Value
+from django.db.models.functions import Cast, Floor, TruncDate
+from django.utils import timezone
+
+from .models import FicheArchivee, FicheSuivi, MelangeMortier, MesureComposants, StatistiqueJournaliere, Tache
+
+# Largeur des classes de l'histogramme de densité (kg/L)
+PAS_DENSITE = 0.1
+
+CHAMPS_AGREGATS = [
+    'nombre', 'duree_totale', 'pause_totale', 'nombre_non_conforme', 'nombre_densite',
+    'densite_somme', 'densite_somme_carres', 'densite_min', 'densite_max', 'densite_histogramme',
+]
+
+
+def _bornes(debut, fin):
+    return (
+        timezone.make_aware(datetime.combine(debut, time.min)),
+        timezone.make_aware(datetime.combine(fin + timedelta(days=1), time.min)),
+    )
+
+
+def _terminees(modele, debut, fin, atelier_id):
+    depuis, jusqu_a = _bornes(debut, fin)
+    objets = modele.objects.filter(date_fin__gte=depuis, date_fin__lt=jusqu_a)
+    if atelier_id:
+        objets = objets.filter(fiche__atelier_id=atelier_id)
+    return objets.values(jour=TruncDate('date_fin'), atelier_ref=F('fiche__atelier_id'))
+
+
+def _durees():
+    return {'nombre': Count('id'), 'duree_totale': Sum('duree'), 'pause_totale': Sum('duree_pause')}
+
+
+def recalculer(debut, fin, atelier_id=None):
+    """
+    Reconstruit les statistiques des jours [debut, fin] à partir des étapes terminées.
+
+    Les agrégats sont calculés en SQL, groupés par jour et par atelier, puis
+    remplacent en une transaction les lignes existantes de la période.
+    Les jours jusqu'à la dernière fin d'étape archivée ne sont pas
+    recalculés : ces étapes ont quitté les tables courantes. Renvoie le
+    nombre de lignes.
+    """
+    archivees = FicheArchivee.objects.filter(atelier_id=atelier_id) if atelier_id else FicheArchivee.objects.all()
+    derniere = archivees.aggregate(derniere=Max('derniere_fin'))['derniere']
+    if derniere is not None:
+        debut = max(debut, timezone.localdate(derniere) + timedelta(days=1))
+    if debut > fin:
+        return 0
+    lignes = {}
+
+    def ligne(jour, atelier_id, type_etape, etape_id=None):
+        cle = (jour, atelier_id, type_etape, etape_id)
+        if cle not in lignes:
+            lignes[cle] = StatistiqueJournaliere(
+                jour=jour, atelier_id=atelier_id, type_etape=type_etape, etape_id=etape_id,
+                cle=StatistiqueJournaliere.calculer_cle(*cle),
+            )
+        return lignes[cle]
+
+    taches = _terminees(Tache, debut, fin, atelier_id).annotate(
+        etape_ref=F('etape_id'),
+        nombre_non_conforme=Count('id', filter=Q(validation='non_conforme')),
+        **_durees(),
+    ).order_by()
+    for r in taches:
+        stat = ligne(r['jour'], r['atelier_ref'], 'tache', r['etape_ref'])
+        stat.nombre, stat.duree_totale, stat.pause_totale = r['nombre'], r['duree_totale'], r['pause_totale']
+        stat.nombre_non_conforme = r['nombre_non_conforme']
+
+    for r in _terminees(MesureComposants, debut, fin, atelier_id).annotate(**_durees()).order_by():
+        stat = ligne(r['jour'], r['atelier_ref'], 'mesure_composants')
+        stat.nombre, stat.duree_totale, stat.pause_totale = r['nombre'], r['duree_totale'], r['pause_totale']
+
+    melanges = _terminees(MelangeMortier, debut, fin, atelier_id)
+    for r in melanges.annotate(
+        nombre_densite=Count('densite'),
+        densite_somme=Sum('densite'),
+        densite_somme_carres=Sum(F('densite') * F('densite'), output_field=FloatField()),
+        densite_min=Min('densite'),
+        densite_max=Max('densite'),
+        **_durees(),
+    ).order_by():
+        stat = ligne(r['jour'], r['atelier_ref'], 'melange_mortier')
+        stat.nombre, stat.duree_totale, stat.pause_totale = r['nombre'], r['duree_totale'], r['pause_totale']
+        stat.nombre_densite, stat.densite_somme, stat.densite_somme_carres = r['nombre_densite'], r['densite_somme'], r['densite_somme_carres']
+        stat.densite_min, stat.densite_max = r['densite_min'], r['densite_max']
+    for r in melanges.filter(densite__isnull=False).annotate(
+        classe=Cast(Floor(F('densite') * Value(round(1 / PAS_DENSITE))), output_field=FloatField()),
+    ).values('jour', 'atelier_ref', 'classe').annotate(nombre=Count('id')).order_by():
+        histogramme = ligne(r['jour'], r['atelier_ref'], 'melange_mortier').densite_histogramme
+        histogramme[f"{r['classe'] * PAS_DENSITE:.1f}"] = r['nombre']
+
+    existantes = StatistiqueJournaliere.objects.filter(jour__range=(debut, fin))
+    if atelier_id:
+        existantes = existantes.filter(atelier_id=atelier_id)
+    with transaction.atomic():
+        # Les jours ou étapes sans fin d'étape disparaissent ; un recalcul
+        # concurrent du même jour, validé entre-temps, est mis à jour par
+        # l'upsert au lieu de heurter l'unicité.
+        existantes.delete()
+        StatistiqueJournaliere.objects.bulk_create(
+            lignes.values(), batch_size=500,
+            update_conflicts=True, unique_fields=['cle'], update_fields=CHAMPS_AGREGATS,
+        )
+    return len(lignes)
+
+
+def planifier_recalcul(fiche_id, quand):
+    """Recalcule, après la transaction en cours, le jour et l'atelier d'une étape terminée."""
+    def _recalculer():
+        atelier_id = FicheSuivi.objects.filter(id=fiche_id).values_list('atelier_id', flat=True).first()
+        if atelier_id:
+            jour = timezone.localdate(quand)
+            recalculer(jour, jour, atelier_id)
+    transaction.on_commit(_recalculer)
+
+
+def tableau(debut, fin):
+    """Indicateurs par atelier et étape sur une période, lus dans les agrégats journaliers."""
+    resultats = (
+        StatistiqueJournaliere.objects.filter(jour__range=(debut, fin))
+        .values('atelier__nom', 'type_etape', 'etape__ordre', 'etape__nom')
+        .annotate(
+            nombre=Sum('nombre'),
+            duree_totale=Sum('duree_totale'),
+            pause_totale=Sum('pause_totale'),
+            nombre_non_conforme=Sum('nombre_non_conforme'),
+            nombre_densite=Sum('nombre_densite'),
+            densite_somme=Sum('densite_somme'),
+            densite_somme_carres=Sum('densite_somme_carres'),
+            densite_min=Min('densite_min'),
+            densite_max=Max('densite_max'),
+        )
+        .order_by('atelier__nom', 'type_etape', 'etape__ordre')
+    )
+    lignes = []
+    for r in resultats:
+        r['duree_moyenne'] = r['duree_totale'] / r['nombre'] if r['nombre'] and r['duree_totale'] else None
+        r['taux_non_conforme'] = 100 * r['nombre_non_conforme'] / r['nombre'] if r['nombre'] else None
+        r['densite_moyenne'] = r['densite_ecart_type'] = None
+        if r['nombre_densite']:
+            moyenne = r['densite_somme'] / r['nombre_densite']
+            r['densite_moyenne'] = moyenne
+            r['densite_ecart_type'] = math.sqrt(max(r['densite_somme_carres'] / r['nombre_densite'] - moyenne ** 2, 0))
+        lignes.append(r)
+    return lignes
@@ -0,0 +1,159 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import actions, cache_fiches, chrono
+from .models import ActionSynchronisee, FicheSuivi, MelangeMortier, MesureComposants, Tache
+
+# Nombre maximal d'actions acceptées dans un lot
+TAILLE_LOT = 500
+LONGUEUR_CLE = ActionSynchronisee._meta.get_field('cle').max_length
+
+
+class LotInvalide(Exception):
+    pass
+
+
+def _horodatage(valeur, maintenant):
+    # Heure de la tablette, ramenée à l'heure du serveur si elle est en avance
+    if not valeur:
+        return maintenant
+    quand = parse_datetime(valeur) if isinstance(valeur, str) else None
+    if quand is None:
+        raise LotInvalide(f"Horodatage invalide : {valeur}")
+    if timezone.is_naive(quand):
+        quand = timezone.make_aware(quand)
+    return min(quand, maintenant)
+
+
+def _demande_chrono(nom):
+    """(transition, cible, tache_id) pour "start_mesure_composants" ou "pause_tache_12", sinon None."""
+    transition, _, cible = nom.partition('_')
+    if transition not in chrono.TRANSITIONS:
+        return None
+    if cible in ('mesure_composants', 'melange_mortier'):
+        return transition, cible, None
+    prefixe, _, tache_id = cible.rpartition('_')
+    if prefixe == 'tache' and tache_id.isdigit():
+        return transition, 'tache', int(tache_id)
+    return None
+
+
+def _appliquer_chrono(request, fiche, transition, cible, tache_id, quand):
+    if request.user.id != fiche.operateur_id:
+        raise actions.ActionRefusee("Seul l'opérateur de la fiche gère les chronomètres.")
+    modele = chrono.CIBLES[cible]
+    objets = modele.objects.filter(fiche=fiche)
+    if tache_id is not None:
+        objets = objets.filter(id=tache_id)
+    if transition == 'start' and modele is MelangeMortier:
+        actions.verifier_mesure_validee(MesureComposants.objects.filter(fiche=fiche).first())
+    try:
+        return chrono.actionner(cible, objets, transition, request.user, fiche.id, quand)
+    except chrono.TransitionRefusee as e:
+        raise actions.ActionRefusee(str(e))
+
+
+def _appliquer(request, fiche_id, nom, donnees, quand):
+    demande = _demande_chrono(nom)
+    if demande is not None:
+        transition, cible, tache_id = demande
+        fiche = FicheSuivi.objects.get(id=fiche_id)
+        return _appliquer_chrono(request, fiche, transition, cible, tache_id, quand)
+    action, argument = actions.resoudre(nom)
+    if action is None:
+        raise actions.ActionRefusee(f"Action inconnue : {nom}")
+    # Fiche relue à chaque action : les précédentes du lot ont pu la modifier
+    fiche = FicheSuivi.objects.select_related(*action.charge).get(id=fiche_id)
+    if not action.controleur and request.user.id != fiche.operateur_id:
+        raise actions.ActionRefusee("Action réservée à l'opérateur de la fiche.")
+    return action.fonction(request, fiche, donnees, argument)
+
+
+def synchroniser(request, fiche_id, lot):
+    """
+    Applique dans l'ordre, en une transaction, un lot d'actions d'une tablette.
+
+    Chaque action est un dict {cle, action, horodatage, donnees}. Une clé déjà
+    reçue n'est pas rejouée : son résultat enregistré est renvoyé. Comme dans
+    fiche_detail, un refus n'annule ni la saisie de l'action ni le reste du
+    lot. Les chronomètres prennent l'heure de la tablette.
+    """
+    if not isinstance(lot, list) or len(lot) > TAILLE_LOT:
+        raise LotInvalide(f"Le lot doit être une liste d'au plus {TAILLE_LOT} actions.")
+    maintenant = timezone.now()
+    demandes = []
+    for element in lot:
+        if not isinstance(element, dict) or not element.get('cle') or not element.get('action'):
+            raise LotInvalide("Chaque action doit avoir une clé et un nom.")
+        donnees = element.get('donnees') or {}
+        if not isinstance(donnees, dict):
+            raise LotInvalide("Les données d'une action doivent être un objet.")
+        cle = str(element['cle'])
+        if len(cle) > LONGUEUR_CLE:
+            # Tronquée, elle pourrait se confondre avec une autre et passer pour un renvoi
+            raise LotInvalide(f"La clé d'une action ne doit pas dépasser {LONGUEUR_CLE} caractères.")
+        demandes.append((cle, str(element['action']), donnees, _horodatage(element.get('horodatage'), maintenant)))
+
+    with transaction.atomic():
+        FicheSuivi.objects.get(Q(operateur=request.user) | Q(controleur=request.user), id=fiche_id)
+        deja_recues = {
+            action.cle: action for action in
+            ActionSynchronisee.objects.filter(utilisateur=request.user, cle__in=[cle for cle, _, _, _ in demandes])
+        }
+        cache_fiches.invalider(fiche_id)
+        resultats, nouvelles = [], []
+        for cle, nom, donnees, quand in demandes:
+            if cle in deja_recues:
+                precedente = deja_recues[cle]
+                resultats.append({'cle': cle, 'statut': precedente.statut, 'deja_recue': True, **precedente.resultat})
+                continue
+            try:
+                resultat = _appliquer(request, fiche_id, nom, donnees, quand) or {}
+                statut = 'appliquee'
+            except actions.ActionRefusee as e:
+                resultat = {'erreur': str(e)}
+                statut = 'refusee'
+            deja_recues[cle] = ActionSynchronisee(
+                utilisateur=request.user, cle=cle, fiche_id=fiche_id, action=nom,
+                horodatage_client=quand, statut=statut, resultat=resultat,
+            )
+            nouvelles.append(deja_recues[cle])
+            resultats.append({'cle': cle, 'statut': statut, **resultat})
+        ActionSynchronisee.objects.bulk_create(nouvelles)
+    return resultats, etat_fiche(fiche_id)
+
+
+def etat_fiche(fiche_id):
+    """État compact d'une fiche pour la tablette : validations, chronomètres et tâches."""
+    fiche = FicheSuivi.objects.values(
+        'id', 'valide_par_operateur_id', 'date_validation_operateur', 'valide_par_controleur_id', 'date_validation_controleur',
+    ).get(id=fiche_id)
+    etapes_fixes = {}
+    for cible, modele in (('mesure_composants', MesureComposants), ('melange_mortier', MelangeMortier)):
+        valeurs = modele.objects.filter(fiche_id=fiche_id).values('id', 'valide', *chrono.CHAMPS_ETAT).first()
+        etapes_fixes[cible] = dict(chrono.etat(valeurs), valide=bool(valeurs and valeurs['valide']))
+    taches = [
+        dict(
+            chrono.etat(valeurs),
+            id=valeurs['id'],
+            ordre=valeurs['etape__ordre'],
+            valide_par_operateur=valeurs['valide_par_operateur_id'] is not None,
+            valide_par_controleur=valeurs['valide_par_controleur_id'] is not None,
+        )
+        for valeurs in Tache.objects.filter(fiche_id=fiche_id).order_by('etape__ordre').values(
+            'id', 'etape__ordre', 'valide_par_operateur_id', 'valide_par_controleur_id', *chrono.CHAMPS_ETAT,
+        )
+    ]
+    return {
+        'fiche': {
+            'id': fiche['id'],
+            'valide_par_operateur': fiche['valide_par_operateur_id'] is not None,
+            'date_validation_operateur': fiche['date_validation_operateur'],
+            'valide_par_controleur': fiche['valide_par_controleur_id'] is not None,
+            'date_validation_controleur': fiche['date_validation_controleur'],
+        },
+        **etapes_fixes,
+        'taches': taches,
+    }
@@ -1,3 +1,1200 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import os
+import re
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from . import actions, archive_pdf, archives, cache_fiches, checks, chrono, pdf, referentiel, signatures, statistiques
+from .models import (
+    ActionSynchronisee, Atelier, DepotSignature, Etape, ExportLotPDF, ExportPDF, FicheArchivee, FicheSuivi, Incident,
+    MelangeMortier, MesureComposants, RetourExperience, Signature, StatistiqueJournaliere, Tache, TimerEvent,
+)
+from .exports import filtrer_fiches
+from .requetes import PlafondRequetesDepasse, plafond_requetes
+from .resources import FicheSuiviResource
 
 # Create your tests here.
+
+# Ligne de plan SQLite qui parcourt une table entière sans index
+SCAN_TABLE = re.compile(r'\bSCAN (?!CONSTANT ROW)\S+(?!.*USING (?:COVERING )?INDEX)')
+
+
+@skipUnless(connection.vendor == 'sqlite', "Plans de requêtes vérifiés sur SQLite")
+class PlansDeRequetesTests(TestCase):
+    """Les requêtes chaudes des vues doivent passer par un index, jamais par un parcours de table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur')
+        cls.controleur = User.objects.create_user('controleur', first_name='controleur')
+        cls.atelier = Atelier.objects.create(nom='Atelier 1')
+        for ordre in range(1, 4):
+            Etape.objects.create(nom=f'Étape {ordre}', ordre=ordre)
+        cls.fiche = FicheSuivi.objects.create(operateur=cls.operateur, atelier=cls.atelier, controleur=cls.controleur)
+        cls.fiche.generer_taches()
+
+    def assertSansParcoursDeTable(self, queryset):
+        plan = queryset.explain()
+        parcours = [ligne for ligne in plan.splitlines() if SCAN_TABLE.search(ligne)]
+        self.assertFalse(parcours, f"Parcours de table dans le plan :\n{plan}")
+
+    def test_accueil(self):
+        fiches = FicheSuivi.objects.filter(operateur=self.operateur).select_related('atelier', 'operateur', 'controleur')
+        self.assertSansParcoursDeTable(fiches.order_by('-date_creation', '-id')[:51])
+        page = fiches.filter(Q(date_creation__lt=self.fiche.date_creation) | Q(date_creation=self.fiche.date_creation, id__lt=self.fiche.id))
+        self.assertSansParcoursDeTable(page.order_by('-date_creation', '-id')[:51])
+
+    def test_taches_de_la_fiche(self):
+        self.assertSansParcoursDeTable(self.fiche.taches.select_related('etape').order_by('etape__ordre'))
+        tache = self.fiche.taches.first()
+        self.assertSansParcoursDeTable(Tache.objects.filter(id=tache.id, fiche=self.fiche))
+        self.assertSansParcoursDeTable(Tache.objects.filter(fiche=self.fiche, etape_id=tache.etape_id))
+
+    def test_etapes_ordonnees(self):
+        self.assertSansParcoursDeTable(Etape.objects.order_by('ordre'))
+
+    def test_chronometre(self):
+        self.assertSansParcoursDeTable(MesureComposants.objects.filter(fiche_id=self.fiche.id, fiche__operateur=self.operateur))
+
+    def test_fiches_a_controler(self):
+        fiches = FicheSuivi.objects.filter(controleur=self.controleur, valide_par_controleur__isnull=True).annotate(
+            taches_en_attente=Count('taches', filter=Q(taches__valide_par_controleur__isnull=True))
+        )
+        self.assertSansParcoursDeTable(fiches.order_by('date_creation', 'id')[:50])
+        self.assertSansParcoursDeTable(Tache.objects.filter(
+            fiche__in=[self.fiche.id], valide_par_controleur__isnull=True, valide_par_operateur__isnull=False
+        ).select_related('etape', 'fiche__atelier'))
+
+    def test_export_par_atelier(self):
+        self.assertSansParcoursDeTable(filtrer_fiches(self.atelier.id, self.fiche.date_creation.date(), self.fiche.date_creation.date()))
+
+
+class BancPerformancesTests(TestCase):
+    """Générateur de données et banc de performances, sur un petit volume."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generer_donnees', ateliers=2, utilisateurs=4, fiches=60, incidents=30, jours=3, stdout=StringIO())
+
+    def test_generer_donnees(self):
+        self.assertEqual(FicheSuivi.objects.count(), 60)
+        self.assertEqual(Tache.objects.count(), 60 * Etape.objects.count())
+        self.assertEqual(Incident.objects.count(), 30)
+        self.assertEqual(FicheSuivi.incidents.through.objects.count(), 30)
+        en_cours = FicheSuivi.objects.filter(valide_par_operateur__isnull=True)
+        self.assertEqual(en_cours.count(), 1)
+        self.assertEqual(MesureComposants.objects.count(), 59)
+        self.assertFalse(Tache.objects.filter(fiche__in=en_cours).exclude(validation='en_attente').exists())
+        with self.assertRaises(CommandError):
+            call_command('generer_donnees', fiches=1, stdout=StringIO())
+
+    @mock.patch('checklist.rendu_pdf.convertir', return_value=b'%PDF-1.4')
+    def test_banc_performances(self, convertir):
+        with tempfile.TemporaryDirectory() as dossier, override_settings(PDF_EXPORT_DIR=dossier):
+            reference = Path(dossier) / 'reference.json'
+            options = {'reference': str(reference), 'hote': 'testserver', 'repetitions': 2, 'echauffement': 1, 'stdout': StringIO()}
+            call_command('banc_performances', enregistrer=True, **options)
+            mesures = json.loads(reference.read_text())
+            self.assertEqual(set(mesures), {
+                'accueil', 'fiche_detail', 'fiche_detail_post', 'chrono_start', 'chrono_pause',
+                'chrono_resume', 'chrono_finish', 'export_csv', 'export_csv_lot', 'export_pdf',
+            })
+            # Les écritures du banc sont annulées : une seconde passe repart du même état
+            self.assertFalse(Tache.objects.filter(date_debut__isnull=False, fiche__valide_par_operateur__isnull=True).exists())
+            call_command('banc_performances', marge_ms=1000, **options)
+
+            mesures['accueil']['requetes'] -= 1
+            reference.write_text(json.dumps(mesures))
+            with self.assertRaisesMessage(CommandError, 'accueil'):
+                call_command('banc_performances', marge_ms=1000, **options)
+
+
+# Volumes des jeux de données : le nombre de requêtes d'une vue ne doit pas en dépendre
+VOLUMES = (1, 10, 1000)
+
+
+class RequetesParVueTests(TestCase):
+    """Nombre de requêtes SQL de chaque vue, identique pour 1, 10 et 1000 lignes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur')
+        cls.controleur = User.objects.create_user('controleur', first_name='controleur')
+        cls.personnel = User.objects.create_user('personnel', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.operateur)
+        # Cache PDF vide à chaque test : un export servi depuis le disque ferait moins de requêtes
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        reglages = override_settings(PDF_EXPORT_DIR=dossier.name)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+    def peupler(self, volume):
+        """`volume` ateliers, étapes, fiches de l'opérateur, incidents et statistiques ; la première fiche a ses tâches."""
+        maintenant = timezone.now()
+        ateliers = Atelier.objects.bulk_create([Atelier(nom=f'Atelier {n}') for n in range(volume)])
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', consignes='Consignes', ordre=n) for n in range(1, volume + 1)])
+        fiches = FicheSuivi.objects.bulk_create([
+            FicheSuivi(operateur=self.operateur, controleur=self.controleur, atelier=ateliers[0]) for _ in range(volume)
+        ])
+        self.atelier, self.fiche = ateliers[0], fiches[0]
+        # Validées par l'opérateur : la file du contrôleur les liste
+        Tache.objects.bulk_create([
+            Tache(fiche=self.fiche, etape=etape, valide_par_operateur=self.operateur, date_validation_operateur=maintenant)
+            for etape in Etape.objects.all()
+        ])
+        self.tache = self.fiche.taches.order_by('etape__ordre').first()
+        incidents = Incident.objects.bulk_create([Incident(description=f'Incident {n}') for n in range(volume)])
+        FicheSuivi.incidents.through.objects.bulk_create([
+            FicheSuivi.incidents.through(fichesuivi=self.fiche, incident=incident) for incident in incidents
+        ])
+        StatistiqueJournaliere.objects.bulk_create([
+            StatistiqueJournaliere(
+                jour=maintenant.date(), atelier=atelier, type_etape='mesure_composants', nombre=1,
+                cle=StatistiqueJournaliere.calculer_cle(maintenant.date(), atelier.id, 'mesure_composants'),
+            )
+            for atelier in ateliers
+        ])
+        MesureComposants.objects.create(fiche=self.fiche, valide=True)
+
+    def assertRequetesConstantes(self, nombre, requete, avant=None):
+        """
+        Exécute `requete()` sur chaque volume de données, caches vidés, et
+        vérifie qu'elle fait exactement `nombre` requêtes SQL. `avant()`
+        prépare l'état sans être compté. Les données de chaque volume sont
+        annulées ensuite.
+        """
+        for volume in VOLUMES:
+            with self.subTest(volume=volume), transaction.atomic():
+                self.peupler(volume)
+                if avant:
+                    avant()
+                cache.clear()
+                referentiel._cache.clear()
+                with self.assertNumQueries(nombre):
+                    response = requete()
+                    # Un flux SSE ne se termine pas : seule son ouverture est comptée
+                    if response.streaming and not response.is_async:
+                        b''.join(response.streaming_content)
+                self.assertLess(response.status_code, 400)
+                transaction.set_rollback(True)
+
+    def test_accueil(self):
+        self.assertRequetesConstantes(3, lambda: self.client.get(reverse('checklist:accueil')))
+
+    def test_controle(self):
+        self.client.force_login(self.controleur)
+        self.assertRequetesConstantes(4, lambda: self.client.get(reverse('checklist:controle')))
+
+    def test_statistiques(self):
+        self.assertRequetesConstantes(3, lambda: self.client.get(reverse('checklist:statistiques')))
+
+    def test_nouvelle_fiche(self):
+        self.assertRequetesConstantes(4, lambda: self.client.get(reverse('checklist:nouvelle_fiche')))
+        self.assertRequetesConstantes(8, lambda: self.client.post(
+            reverse('checklist:nouvelle_fiche'), {'atelier': self.atelier.id, 'controleur': self.controleur.id}
+        ))
+
+    def test_fiche_detail(self):
+        self.assertRequetesConstantes(10, lambda: self.client.get(reverse('checklist:fiche_detail', args=[self.fiche.id])))
+
+    def test_fiche_detail_sans_taches(self):
+        self.assertRequetesConstantes(
+            15, lambda: self.client.get(reverse('checklist:fiche_detail', args=[self.fiche.id])),
+            avant=lambda: self.fiche.taches.all().delete(),
+        )
+
+    def test_fiche_detail_actions(self):
+        url = lambda: reverse('checklist:fiche_detail', args=[self.fiche.id])
+        self.assertRequetesConstantes(8, lambda: self.client.post(url(), {'action': 'add_incident', 'incident_description': 'Fuite'}))
+        self.assertRequetesConstantes(6, lambda: self.client.post(url(), {'action': f'valider_tache_operateur_{self.tache.id}'}))
+        self.assertRequetesConstantes(6, lambda: self.client.post(url(), {'action': 'valider_fiche_operateur'}))
+
+    def test_flux_fiche(self):
+        url = lambda: reverse('checklist:flux_fiche', args=[self.fiche.id])
+        self.async_client.force_login(self.operateur)
+        self.assertRequetesConstantes(3, lambda: async_to_sync(self.async_client.get)(url()))
+        # Sous WSGI le flux est refusé avant toute lecture de la fiche : 204,
+        # le navigateur ne se reconnecte pas
+        reponses = []
+        self.assertRequetesConstantes(2, lambda: reponses.append(self.client.get(url())) or reponses[-1])
+        self.assertEqual({reponse.status_code for reponse in reponses}, {204})
+
+    def test_synchroniser(self):
+        self.assertRequetesConstantes(15, lambda: self.client.post(
+            reverse('checklist:synchroniser', args=[self.fiche.id]),
+            json.dumps({'actions': [{'cle': 'a1', 'action': f'start_tache_{self.tache.id}'}]}),
+            content_type='application/json',
+        ))
+
+    def test_chrono(self):
+        self.assertRequetesConstantes(7, lambda: self.client.post(
+            reverse('checklist:chrono_tache', args=[self.fiche.id, 'tache', self.tache.id, 'start'])
+        ))
+        self.assertRequetesConstantes(12, lambda: self.client.post(
+            reverse('checklist:chrono', args=[self.fiche.id, 'melange_mortier', 'start'])
+        ))
+
+    def test_deposer_signature(self):
+        image = BytesIO()
+        trait = Image.new('L', (200, 80), 'white')
+        ImageDraw.Draw(trait).line((10, 40, 190, 40), fill='black', width=4)
+        trait.save(image, format='PNG')
+
+        def requete():
+            image.seek(0)
+            return self.client.post(reverse('checklist:deposer_signature'), {'signature': image})
+        with tempfile.TemporaryDirectory() as dossier, override_settings(MEDIA_ROOT=dossier):
+            self.assertRequetesConstantes(7, requete)
+
+    @mock.patch('checklist.rendu_pdf.convertir', return_value=b'%PDF-1.4')
+    def test_export_pdf(self, convertir):
+        self.assertRequetesConstantes(9, lambda: self.client.get(reverse('checklist:export_pdf', args=[self.fiche.id])))
+        self.assertRequetesConstantes(4, lambda: self.client.get(
+            reverse('checklist:export_pdf_statut', args=[ExportPDF.objects.create(fiche=self.fiche, empreinte='0' * 64).id])
+        ))
+
+    def test_export_csv(self):
+        self.assertRequetesConstantes(8, lambda: self.client.get(reverse('checklist:export_csv', args=[self.fiche.id])))
+        self.assertRequetesConstantes(7, lambda: self.client.get(reverse('checklist:export_csv_lot') + f'?atelier={self.atelier.id}'))
+
+    def test_export_pdf_lot(self):
+        # La vue inscrit la demande dans la file : l'archive est construite par traiter_exports_pdf
+        self.assertRequetesConstantes(
+            7, lambda: self.client.get(reverse('checklist:export_pdf_lot') + f'?atelier={self.atelier.id}'),
+        )
+
+        def avant():
+            self.export = ExportLotPDF.objects.create(utilisateur=self.operateur, atelier=self.atelier, statut='termine')
+            archive_pdf.chemin_lot(self.export.id).parent.mkdir(parents=True, exist_ok=True)
+            archive_pdf.chemin_lot(self.export.id).write_bytes(b'PK')
+
+        self.assertRequetesConstantes(
+            3, lambda: self.client.get(reverse('checklist:export_pdf_lot_statut', args=[self.export.id])), avant=avant,
+        )
+        self.assertRequetesConstantes(
+            3, lambda: self.client.get(reverse('checklist:export_pdf_lot_fichier', args=[self.export.id])), avant=avant,
+        )
+
+    def test_metriques(self):
+        self.client.force_login(self.personnel)
+        self.assertRequetesConstantes(2, lambda: self.client.get(reverse('checklist:metriques')))
+
+    def test_ateliers(self):
+        self.assertRequetesConstantes(3, lambda: self.client.get(reverse('checklist:atelier_list')))
+        self.assertRequetesConstantes(3, lambda: self.client.post(reverse('checklist:ajouter_atelier'), {'nom': 'Nouvel atelier'}))
+        self.assertRequetesConstantes(4, lambda: self.client.post(
+            reverse('checklist:modifier_atelier', args=[self.atelier.id]), {'nom': 'Atelier renommé'}
+        ))
+        self.assertRequetesConstantes(9, lambda: self.client.post(
+            reverse('checklist:supprimer_atelier', args=[Atelier.objects.create(nom='Vide').id])
+        ))
+
+    def test_signup(self):
+        self.client.logout()
+        self.assertRequetesConstantes(0, lambda: self.client.get(reverse('checklist:signup')))
+        self.assertRequetesConstantes(3, lambda: self.client.post(reverse('checklist:signup'), {
+            'username': 'nouveau', 'email': 'nouveau@example.com', 'role': 'operateur',
+            'password1': 'Mot-de-passe-2024', 'password2': 'Mot-de-passe-2024',
+        }))
+
+    @override_settings(DEBUG=True)
+    def test_plafond_des_vues_asynchrones(self):
+        # Les requêtes d'une autre vue, sur le même thread de l'ORM asynchrone, ne sont pas comptées
+        @plafond_requetes(1)
+        async def vue(request, suite):
+            await User.objects.acount()
+            await suite.wait()
+            return HttpResponse()
+
+        async def autre_vue(suite):
+            await User.objects.acount()
+            await User.objects.acount()
+            suite.set()
+
+        async def servir():
+            suite = asyncio.Event()
+            response, _ = await asyncio.gather(vue(None, suite), autre_vue(suite))
+            return response
+
+        self.assertEqual(async_to_sync(servir)().status_code, 200)
+
+        @plafond_requetes(1)
+        async def vue_gourmande(request):
+            await User.objects.acount()
+            await User.objects.acount()
+            return HttpResponse()
+
+        with self.assertRaises(PlafondRequetesDepasse):
+            async_to_sync(vue_gourmande)(None)
+
+
+class GenerationTachesTests(TestCase):
+    """Tâches générées à la création d'une fiche : une par étape, valeurs par défaut du modèle."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur')
+        cls.atelier = Atelier.objects.create(nom='Atelier Nord')
+        # Créées dans le désordre : l'ordre des tâches suit Etape.ordre
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', ordre=n) for n in (3, 1, 2)])
+
+    def nouvelle_fiche(self):
+        return FicheSuivi.objects.create(operateur=self.operateur, atelier=self.atelier, controleur=self.operateur)
+
+    def verifier_taches(self, taches):
+        self.assertEqual([tache.etape.ordre for tache in taches], [1, 2, 3])
+        defaut = Tache()
+        for tache in taches:
+            for champ in Tache._meta.concrete_fields:
+                if not champ.primary_key and champ.name not in ('fiche', 'etape'):
+                    self.assertEqual(getattr(tache, champ.attname), getattr(defaut, champ.attname), champ.name)
+
+    def test_generer_taches(self):
+        referentiel._cache.clear()
+        fiche = self.nouvelle_fiche()
+        taches = fiche.generer_taches()
+        self.verifier_taches(taches)
+        # Étapes reprises du référentiel en cache, sans relecture
+        self.assertEqual([id(tache.etape) for tache in taches], [id(etape) for etape in referentiel.etapes_ordonnees()])
+        self.verifier_taches(fiche.taches.select_related('etape').order_by('etape__ordre'))
+        # Seconde génération : rien n'est dupliqué
+        self.assertEqual(len(fiche.generer_taches()), 3)
+        self.assertEqual(fiche.taches.count(), 3)
+
+    def test_generer_taches_en_lot(self):
+        fiches = [self.nouvelle_fiche() for _ in range(2)]
+        FicheSuivi.generer_taches_en_lot([fiche.id for fiche in fiches])
+        for fiche in fiches:
+            self.verifier_taches(fiche.taches.select_related('etape').order_by('etape__ordre'))
+
+    def test_etape_absente_du_cache(self):
+        referentiel.etapes_ordonnees()
+        # Étape créée sans invalider le référentiel (autre processus, COMMIT pas encore vu)
+        Etape.objects.bulk_create([Etape(nom='Étape 4', ordre=4)])
+        taches = self.nouvelle_fiche().generer_taches()
+        self.assertEqual([tache.etape.ordre for tache in taches], [1, 2, 3, 4])
+
+
+class ArchivageTests(TestCase):
+    """Archivage des fiches closes et lecture des fiches archivées."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur', first_name='Jean', last_name='Dupont')
+        cls.controleur = User.objects.create_user('controleur', first_name='controleur')
+        cls.atelier = Atelier.objects.create(nom='Atelier Nord')
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', consignes='Consignes', ordre=n) for n in (1, 2)])
+        maintenant = timezone.now()
+
+        cls.ancienne = FicheSuivi.objects.create(
+            atelier=cls.atelier, operateur=cls.operateur, controleur=cls.controleur,
+            valide_par_operateur=cls.operateur, date_validation_operateur=maintenant,
+            valide_par_controleur=cls.controleur, date_validation_controleur=maintenant,
+            retour_experience=RetourExperience.objects.create(commentaire='Bonne prise'),
+        )
+        cls.ancienne.generer_taches()
+        cls.fin_ancienne = maintenant - timedelta(days=399)
+        cls.ancienne.taches.update(validation='conforme', observations='RAS', date_fin=cls.fin_ancienne)
+        MesureComposants.objects.create(fiche=cls.ancienne, ciment=25, valide=True)
+        cls.en_cours = FicheSuivi.objects.create(atelier=cls.atelier, operateur=cls.operateur, controleur=cls.controleur)
+        # Fiche non validée par le contrôleur : jamais archivée, même ancienne
+        cls.non_validee = FicheSuivi.objects.create(
+            atelier=cls.atelier, operateur=cls.operateur, controleur=cls.controleur, valide_par_operateur=cls.operateur,
+        )
+        cls.propre = Incident.objects.create(description='Fuite du malaxeur')
+        cls.partage = Incident.objects.create(description='Coupure de courant')
+        cls.ancienne.incidents.add(cls.propre, cls.partage)
+        cls.en_cours.incidents.add(cls.partage)
+        FicheSuivi.objects.filter(id__in=[cls.ancienne.id, cls.non_validee.id]).update(
+            date_creation=maintenant - timedelta(days=400),
+        )
+
+    def setUp(self):
+        call_command('archive_fiches', stdout=StringIO())
+        self.client.force_login(self.operateur)
+
+    def test_archive_fiches(self):
+        self.assertEqual(list(FicheArchivee.objects.values_list('id', flat=True)), [self.ancienne.id])
+        self.assertEqual(set(FicheSuivi.objects.values_list('id', flat=True)), {self.en_cours.id, self.non_validee.id})
+        self.assertFalse(Tache.objects.filter(fiche_id=self.ancienne.id).exists())
+        self.assertFalse(MesureComposants.objects.filter(fiche_id=self.ancienne.id).exists())
+        self.assertFalse(RetourExperience.objects.exists())
+        # L'incident encore lié à une fiche courante reste dans les tables courantes
+        self.assertEqual(list(Incident.objects.values_list('id', flat=True)), [self.partage.id])
+
+        restauree = archives.restaurer(FicheArchivee.objects.get())
+        self.assertEqual(restauree.fiche.atelier.nom, 'Atelier Nord')
+        self.assertEqual(restauree.fiche.operateur.get_full_name(), 'Jean Dupont')
+        self.assertEqual([t.etape.ordre for t in restauree.taches], [1, 2])
+        self.assertEqual({i.description for i in restauree.incidents}, {'Fuite du malaxeur', 'Coupure de courant'})
+        self.assertEqual(restauree.retour_experience.commentaire, 'Bonne prise')
+        self.assertEqual(restauree.mesure_composants.ciment, 25)
+
+        sortie = StringIO()
+        call_command('archive_fiches', jours=0, essai=True, stdout=sortie)
+        self.assertIn('0 fiches archivables', sortie.getvalue())
+
+    def test_statistiques_conservees(self):
+        # Les étapes archivées ne sont plus relues : les jours jusqu'à la
+        # dernière fin d'étape archivée gardent leurs agrégats
+        archive = FicheArchivee.objects.get()
+        self.assertEqual(archive.derniere_fin, self.fin_ancienne)
+        jour = timezone.localdate(archive.derniere_fin)
+        for date in (jour, jour + timedelta(days=1)):
+            StatistiqueJournaliere.objects.create(
+                jour=date, atelier=self.atelier, type_etape='mesure_composants', nombre=1,
+                cle=StatistiqueJournaliere.calculer_cle(date, self.atelier.id, 'mesure_composants'),
+            )
+        call_command('recalculer_statistiques', debut=jour - timedelta(days=1), stdout=StringIO())
+        self.assertEqual(list(StatistiqueJournaliere.objects.values_list('jour', flat=True)), [jour])
+
+    def test_fiche_detail(self):
+        url = reverse('checklist:fiche_detail', args=[self.ancienne.id])
+        response = self.client.get(url)
+        self.assertContains(response, 'Archivée')
+        self.assertContains(response, 'Fuite du malaxeur')
+        response = self.client.post(url, {'action': 'add_incident', 'incident_description': 'Trop tard'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        self.assertRedirects(self.client.post(url, {'action': 'add_incident', 'incident_description': 'Trop tard'}), url)
+        self.assertFalse(Incident.objects.filter(description='Trop tard').exists())
+
+        self.client.force_login(User.objects.create_user('autre'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_exports(self):
+        contenu = self.client.get(reverse('checklist:export_csv', args=[self.ancienne.id])).content.decode()
+        self.assertIn('Atelier Nord', contenu)
+        self.assertIn('Étape 2', contenu)
+        self.assertIn('Fuite du malaxeur', contenu)
+
+        with mock.patch('checklist.exports.archives.restaurer', wraps=archives.restaurer) as restaurer:
+            response = self.client.get(reverse('checklist:export_csv_lot') + f'?atelier={self.atelier.id}')
+            contenu = b''.join(response.streaming_content).decode()
+        # Chaque archive n'est décompressée qu'une fois pour les quatre sections
+        self.assertEqual(restaurer.call_count, 1)
+        sections = contenu.split('\r\n\r\n')
+        self.assertIn(f'fiche,{self.ancienne.id},Atelier Nord,Jean Dupont', sections[0])
+        self.assertIn(f'tache,{self.ancienne.id},2,Étape 2', sections[1])
+        self.assertIn(f'incident,{self.ancienne.id}', sections[2])
+        self.assertIn(f'mesure,{self.ancienne.id},25.0', sections[3])
+
+        with tempfile.TemporaryDirectory() as dossier, override_settings(PDF_EXPORT_DIR=dossier), \
+                mock.patch('checklist.rendu_pdf.convertir', return_value=b'%PDF-1.4') as convertir:
+            # Inscrit dans la file comme une fiche courante, jamais converti pendant la requête
+            self.assertEqual(self.client.get(reverse('checklist:export_pdf', args=[self.ancienne.id])).status_code, 202)
+            self.assertFalse(convertir.called)
+            export = ExportPDF.objects.get()
+            self.assertEqual((export.fiche_id, export.archive_id), (None, self.ancienne.id))
+            self.assertEqual(
+                self.client.get(reverse('checklist:export_pdf_statut', args=[export.id])).json()['url'],
+                reverse('checklist:export_pdf', args=[self.ancienne.id]),
+            )
+            call_command('traiter_exports_pdf', stdout=StringIO())
+            self.assertIn('Fuite du malaxeur', convertir.call_args.args[0])
+            # Servi ensuite depuis le cache disque
+            response = self.client.get(reverse('checklist:export_pdf', args=[self.ancienne.id]))
+            self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4')
+            self.assertEqual(convertir.call_count, 1)
+
+
+class ActionsFicheTests(TestCase):
+    """Actions postées sur la page d'une fiche : registre, parcours, accès, refus et version du cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur')
+        cls.controleur = User.objects.create_user('controleur', first_name='controleur')
+        cls.atelier = Atelier.objects.create(nom='Atelier 1')
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', consignes='Consignes', ordre=n) for n in (1, 2, 3)])
+        cls.fiche = FicheSuivi.objects.create(operateur=cls.operateur, atelier=cls.atelier, controleur=cls.controleur)
+        cls.fiche.generer_taches()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.operateur)
+        self.url = reverse('checklist:fiche_detail', args=[self.fiche.id])
+
+    def poster(self, donnees, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, donnees, HTTP_X_REQUESTED_WITH='XMLHttpRequest', **kwargs)
+
+    def test_registre_des_actions(self):
+        action, argument = actions.resoudre('add_incident')
+        self.assertEqual((action.fonction, argument), (actions.ajouter_incident, None))
+        action, argument = actions.resoudre('valider_tache_controleur_12')
+        self.assertEqual((action.fonction, argument, action.controleur), (actions.valider_tache_controleur, '12', True))
+        for nom in ('', None, 'supprimer_fiche'):
+            self.assertEqual(actions.resoudre(nom), (None, None))
+        # Action inconnue : retour à la fiche, rien n'est modifié
+        self.assertRedirects(self.client.post(self.url, {'action': 'supprimer_fiche'}), self.url)
+        self.assertEqual(self.poster({'action': 'valider_tache_operateur_abc'}).status_code, 200)
+        self.assertFalse(self.fiche.taches.filter(valide_par_operateur__isnull=False).exists())
+
+    def test_parcours_de_la_fiche(self):
+        mesure = {champ: '1.5' for champ in actions.CHAMPS_MESURE}
+        self.assertEqual(self.poster({'action': 'save_mesure_composants', **mesure}).status_code, 200)
+        # Refus sans commentaire : la saisie reste enregistrée
+        response = self.poster({'action': 'valider_mesure_composants'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], "Tous les champs doivent être remplis avant de valider cette étape.")
+        self.assertEqual(MesureComposants.objects.get(fiche=self.fiche).ciment, 1.5)
+        self.assertEqual(self.poster({'action': 'valider_mesure_composants', 'commentaires_mesure': 'RAS'}).status_code, 200)
+        self.assertTrue(MesureComposants.objects.get(fiche=self.fiche).valide)
+
+        self.assertEqual(self.poster({'action': 'valider_melange_mortier'}).status_code, 400)
+        melange = {etape: 'on' for etape in actions.ETAPES_MELANGE}
+        response = self.poster({'action': 'save_melange_mortier', 'densite': '1.2', 'commentaires_melange': 'RAS', **melange})
+        self.assertEqual(response.json()['message'], "Données du mélange du mortier enregistrées avec succès.")
+        # Le formulaire renvoie les cases cochées avec la validation
+        self.assertEqual(self.poster({'action': 'valider_melange_mortier', **melange}).status_code, 200)
+        melange = MelangeMortier.objects.get(fiche=self.fiche)
+        self.assertEqual((melange.valide, melange.valide_par, melange.densite), (True, self.operateur, 1.2))
+
+        tache = self.fiche.taches.order_by('etape__ordre').first()
+        self.poster({'action': f'valider_tache_operateur_{tache.id}'})
+        self.poster({'action': 'valider_fiche_operateur'})
+        self.poster({'action': 'add_retour', 'retour_commentaire': 'Premier retour'})
+        self.client.force_login(self.controleur)
+        self.poster({'action': f'valider_tache_controleur_{tache.id}'})
+        self.poster({'action': 'valider_fiche_controleur'})
+        self.poster({'action': 'add_retour', 'retour_commentaire': 'Retour corrigé'})
+        # Sans requête AJAX : message puis retour à la fiche
+        response = self.client.post(self.url, {'action': 'add_incident', 'incident_description': 'Fuite'}, follow=True)
+        self.assertRedirects(response, self.url)
+
+        tache.refresh_from_db()
+        self.assertEqual((tache.valide_par_operateur, tache.valide_par_controleur), (self.operateur, self.controleur))
+        fiche = FicheSuivi.objects.select_related('retour_experience').get(id=self.fiche.id)
+        self.assertEqual((fiche.valide_par_operateur, fiche.valide_par_controleur), (self.operateur, self.controleur))
+        self.assertEqual(fiche.retour_experience.commentaire, 'Retour corrigé')
+        self.assertEqual(RetourExperience.objects.count(), 1)
+        self.assertEqual(list(fiche.incidents.values_list('description', flat=True)), ['Fuite'])
+
+    def test_fiche_introuvable(self):
+        url = reverse('checklist:fiche_detail', args=[self.fiche.id + 1000])
+        self.assertEqual(self.client.post(url, {'action': 'add_incident', 'incident_description': 'Fuite'}).status_code, 404)
+
+    def test_actions_reservees_a_l_operateur(self):
+        self.client.force_login(self.controleur)
+        page = self.client.get(self.url)
+        self.assertNotContains(page, 'value="save_mesure_composants"')
+        self.assertNotContains(page, 'value="start_mesure_composants"')
+        self.assertContains(page, "En attente de l'opérateur", count=1)
+        self.assertEqual(self.poster({'action': 'save_mesure_composants', 'ciment': '25'}).status_code, 403)
+        self.assertEqual(self.client.post(self.url, {'action': 'start_mesure_composants'}).status_code, 403)
+        self.assertFalse(MesureComposants.objects.exists())
+        # Les incidents restent ouverts au contrôleur
+        self.assertEqual(self.poster({'action': 'add_incident', 'incident_description': 'Fuite'}).status_code, 200)
+
+        self.client.force_login(self.operateur)
+        page = self.client.get(self.url)
+        self.assertContains(page, 'value="save_mesure_composants"')
+        self.assertNotContains(page, "En attente de l'opérateur")
+
+    def test_flux_selon_le_serveur(self):
+        self.assertNotContains(self.client.get(self.url), 'EventSource')
+        with override_settings(FLUX_SSE=True):
+            self.assertContains(self.client.get(self.url), 'new EventSource')
+
+    def test_version_changee_apres_action(self):
+        version = cache_fiches.version(self.fiche.id)
+        self.assertEqual(self.poster({'action': 'add_incident', 'incident_description': 'Fuite'}).status_code, 200)
+        self.assertNotEqual(cache_fiches.version(self.fiche.id), version)
+
+    def test_version_changee_apres_renommage(self):
+        version = cache_fiches.version(self.fiche.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.operateur.last_login = timezone.now()
+            self.operateur.save(update_fields=['last_login'])
+            User.objects.create_user('autre')
+        self.assertEqual(cache_fiches.version(self.fiche.id), version)
+
+        for objet, champ in ((Etape.objects.first(), 'nom'), (self.atelier, 'nom'), (self.controleur, 'last_name')):
+            with self.captureOnCommitCallbacks(execute=True):
+                setattr(objet, champ, 'Renommé')
+                objet.save()
+            self.assertNotEqual(cache_fiches.version(self.fiche.id), version)
+            version = cache_fiches.version(self.fiche.id)
+
+    def test_page_validee_servie_depuis_le_cache(self):
+        FicheSuivi.objects.filter(id=self.fiche.id).update(
+            valide_par_operateur=self.operateur, valide_par_controleur=self.controleur,
+        )
+        # Première visite : le cookie CSRF n'existe pas encore, rien n'est mis en cache
+        self.client.get(self.url)
+        self.client.get(self.url)
+        # Page complète en cache : seules la session, l'utilisateur et la fiche sont lus
+        with self.assertNumQueries(3):
+            self.assertNotContains(self.client.get(self.url), 'Fuite')
+        self.poster({'action': 'add_incident', 'incident_description': 'Fuite'})
+        self.assertContains(self.client.get(self.url), 'Fuite')
+
+    def test_invalidations_simultanees(self):
+        # Versions renouvelées sans cache.incr, qui n'est pas atomique sur le cache fichier
+        versions = {cache_fiches.version(self.fiche.id)}
+        with mock.patch.object(cache, 'incr', side_effect=AssertionError):
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    cache_fiches.invalider(self.fiche.id)
+                versions.add(cache_fiches.version(self.fiche.id))
+        self.assertEqual(len(versions), 3)
+        # Un incident tout juste créé n'est lié à aucune fiche : aucune requête de plus
+        with self.assertNumQueries(1):
+            Incident.objects.create(description='Fuite')
+
+    def test_action_annulee_sans_invalidation(self):
+        version = cache_fiches.version(self.fiche.id)
+        with mock.patch('checklist.actions.Incident.objects.create', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'action': 'add_incident', 'incident_description': 'Fuite'})
+        self.assertEqual(cache_fiches.version(self.fiche.id), version)
+
+    def test_referentiel_invalide(self):
+        self.assertEqual(referentiel.etapes_ordonnees()[0].nom, 'Étape 1')
+        etape = Etape.objects.get(ordre=1)
+        etape.nom = 'Préparation'
+        with self.captureOnCommitCallbacks(execute=True):
+            etape.save()
+        self.assertEqual(referentiel.etapes_ordonnees()[0].nom, 'Préparation')
+        # Version partagée : un autre processus, qui garde l'ancienne liste, la recharge aussi
+        referentiel._cache['etapes'] = ('ancienne', ())
+        self.assertEqual(len(referentiel.etapes_ordonnees()), 3)
+
+    def test_avertissement_cache_local(self):
+        self.assertEqual(checks.verifier_cache_partage(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([alerte.id for alerte in checks.verifier_cache_partage(None)], ['checklist.W001'])
+
+
+class ChronometresTests(TestCase):
+    """Transitions des chronomètres : accès, transitions refusées et durées cumulées."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur')
+        cls.controleur = User.objects.create_user('controleur', first_name='controleur')
+        cls.atelier = Atelier.objects.create(nom='Atelier 1')
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', consignes='Consignes', ordre=n) for n in (1, 2)])
+        cls.fiche = FicheSuivi.objects.create(operateur=cls.operateur, atelier=cls.atelier, controleur=cls.controleur)
+        cls.tache = cls.fiche.generer_taches()[0]
+
+    def setUp(self):
+        self.client.force_login(self.operateur)
+
+    def url(self, transition, tache_id=None, fiche_id=None):
+        fiche_id = fiche_id or self.fiche.id
+        if tache_id is None:
+            return reverse('checklist:chrono', args=[fiche_id, 'mesure_composants', transition])
+        return reverse('checklist:chrono_tache', args=[fiche_id, 'tache', tache_id, transition])
+
+    def test_acces(self):
+        self.client.force_login(self.controleur)
+        self.assertEqual(self.client.post(self.url('start', self.tache.id)).status_code, 404)
+        self.assertEqual(self.client.post(self.url('start')).status_code, 404)
+        self.client.force_login(self.operateur)
+        self.assertEqual(self.client.post(self.url('start', self.tache.id + 1000)).status_code, 404)
+        # Pause d'une étape fixe jamais démarrée : aucun objet à modifier
+        self.assertEqual(self.client.post(self.url('pause')).status_code, 404)
+        self.assertFalse(TimerEvent.objects.exists())
+
+    def test_transition_impossible(self):
+        self.assertEqual(self.client.post(self.url('start', self.tache.id)).status_code, 200)
+        response = self.client.post(self.url('start', self.tache.id))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['status'], 'En cours')
+        self.assertEqual(self.client.post(self.url('resume', self.tache.id)).status_code, 409)
+        self.assertEqual(TimerEvent.objects.count(), 1)
+
+    def test_durees(self):
+        debut = timezone.now() - timedelta(hours=1)
+        objets = Tache.objects.filter(id=self.tache.id)
+        chrono.actionner('tache', objets, 'start', self.operateur, quand=debut)
+        chrono.actionner('tache', objets, 'pause', self.operateur, quand=debut + timedelta(minutes=10))
+        chrono.actionner('tache', objets, 'resume', self.operateur, quand=debut + timedelta(minutes=15))
+        chrono.actionner('tache', objets, 'pause', self.operateur, quand=debut + timedelta(minutes=20))
+        chrono.actionner('tache', objets, 'resume', self.operateur, quand=debut + timedelta(minutes=22))
+        chrono.actionner('tache', objets, 'finish', self.operateur, quand=debut + timedelta(minutes=30))
+        tache = objets.get()
+        self.assertEqual(tache.duree, timedelta(minutes=23))
+        self.assertEqual(tache.duree_pause, timedelta(minutes=7))
+        self.assertEqual(tache.date_fin, debut + timedelta(minutes=30))
+        self.assertEqual(
+            list(TimerEvent.objects.filter(tache=tache).order_by('horodatage').values_list('type', flat=True)),
+            ['start', 'pause', 'resume', 'pause', 'resume', 'finish'],
+        )
+
+    def test_fin_pendant_une_pause(self):
+        # Le temps actif s'arrête à la pause, le temps de pause court jusqu'à la fin
+        debut = timezone.now() - timedelta(hours=1)
+        chrono.actionner('mesure_composants', MesureComposants.objects.filter(fiche=self.fiche), 'start', fiche_id=self.fiche.id, quand=debut)
+        objets = MesureComposants.objects.filter(fiche=self.fiche)
+        chrono.actionner('mesure_composants', objets, 'pause', quand=debut + timedelta(minutes=5))
+        etat = chrono.actionner('mesure_composants', objets, 'finish', quand=debut + timedelta(minutes=12))
+        self.assertEqual(etat['status'], 'Terminé')
+        mesure = objets.get()
+        self.assertEqual(mesure.duree, timedelta(minutes=5))
+        self.assertEqual(mesure.duree_pause, timedelta(minutes=7))
+        self.assertIsNone(mesure.date_pause)
+
+    def test_double_clic(self):
+        # Deux clics sur « Pause » : le second UPDATE conditionnel ne trouve plus de ligne en cours
+        objets = Tache.objects.filter(id=self.tache.id)
+        debut = timezone.now() - timedelta(minutes=10)
+        chrono.actionner('tache', objets, 'start', quand=debut)
+        chrono.actionner('tache', objets, 'pause', quand=debut + timedelta(minutes=4))
+        with self.assertRaises(chrono.TransitionRefusee):
+            chrono.actionner('tache', objets, 'pause', quand=debut + timedelta(minutes=5))
+        self.assertEqual(objets.get().duree, timedelta(minutes=4))
+        self.assertEqual(TimerEvent.objects.filter(type='pause').count(), 1)
+
+    def test_horodatages_dans_le_desordre(self):
+        # Actions hors ligne rejouées dans le désordre : chaque transition est
+        # ramenée à l'heure de la précédente, aucune durée n'est négative
+        objets = Tache.objects.filter(id=self.tache.id)
+        debut = timezone.now() - timedelta(hours=1)
+        chrono.actionner('tache', objets, 'start', quand=debut)
+        chrono.actionner('tache', objets, 'pause', quand=debut - timedelta(days=365))
+        chrono.actionner('tache', objets, 'resume', quand=debut + timedelta(minutes=10))
+        chrono.actionner('tache', objets, 'finish', quand=debut + timedelta(minutes=5))
+        tache = objets.get()
+        self.assertEqual((tache.duree, tache.duree_pause), (timedelta(0), timedelta(minutes=10)))
+        self.assertEqual(tache.date_fin, debut + timedelta(minutes=10))
+        self.assertEqual(
+            list(TimerEvent.objects.filter(tache=tache).order_by('id').values_list('horodatage', flat=True)),
+            [debut, debut, debut + timedelta(minutes=10), debut + timedelta(minutes=10)],
+        )
+
+    def test_migration_des_chronometres(self):
+        # Chronomètres en cours avant 0007 : début décalé des pauses, temps actif déduit du début
+        migration = import_module('checklist.migrations.0007_timerevent')
+        debut = timezone.now() - timedelta(minutes=30)
+        Tache.objects.filter(id=self.tache.id).update(date_debut=debut, date_pause=debut + timedelta(minutes=12))
+        en_cours = MesureComposants.objects.create(fiche=self.fiche, date_debut=debut)
+        migration.convertir_chronometres(django_apps, None)
+        tache = Tache.objects.get(id=self.tache.id)
+        self.assertEqual((tache.date_reprise, tache.duree), (debut, timedelta(minutes=12)))
+        en_cours.refresh_from_db()
+        self.assertEqual((en_cours.date_reprise, en_cours.duree), (debut, None))
+
+
+class SynchronisationTests(TestCase):
+    """Lots d'actions hors ligne des tablettes : validation du lot et refus action par action."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur')
+        cls.controleur = User.objects.create_user('controleur', first_name='controleur')
+        cls.atelier = Atelier.objects.create(nom='Atelier 1')
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', consignes='Consignes', ordre=n) for n in (1, 2)])
+        cls.fiche = FicheSuivi.objects.create(operateur=cls.operateur, atelier=cls.atelier, controleur=cls.controleur)
+        cls.tache = cls.fiche.generer_taches()[0]
+
+    def setUp(self):
+        self.client.force_login(self.operateur)
+
+    def synchroniser(self, corps):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('checklist:synchroniser', args=[self.fiche.id]), json.dumps(corps), content_type='application/json',
+            )
+
+    def test_lot_invalide(self):
+        for corps in ([], {'actions': 'start'}, {'actions': [{'cle': 'x' * 65, 'action': 'add_incident'}]}):
+            with self.subTest(corps=corps):
+                self.assertEqual(self.synchroniser(corps).status_code, 400)
+        self.assertEqual(self.client.post(
+            reverse('checklist:synchroniser', args=[self.fiche.id]), '{', content_type='application/json',
+        ).json()['error'], "Corps JSON invalide.")
+        self.assertFalse(ActionSynchronisee.objects.exists())
+
+    def test_valeurs_invalides_refusees(self):
+        # Une valeur mal typée refuse son action, le reste du lot s'applique
+        response = self.synchroniser({'actions': [
+            {'cle': 'a1', 'action': 'save_melange_mortier', 'donnees': {'densite': {'a': 1}}},
+            {'cle': 'a2', 'action': 'save_mesure_composants', 'donnees': {'ciment': 'abc'}},
+            {'cle': 'a3', 'action': 'save_mesure_composants', 'donnees': {'ciment': 0, 'eau': '12.5'}},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([resultat['statut'] for resultat in response.json()['resultats']], ['refusee', 'refusee', 'appliquee'])
+        self.assertEqual(
+            dict(ActionSynchronisee.objects.values_list('cle', 'statut')),
+            {'a1': 'refusee', 'a2': 'refusee', 'a3': 'appliquee'},
+        )
+        mesure = MesureComposants.objects.get(fiche=self.fiche)
+        self.assertEqual((mesure.ciment, mesure.eau), (0, 12.5))
+        self.assertFalse(MelangeMortier.objects.exists())
+
+    def test_cle_rejouee(self):
+        lot = {'actions': [
+            {'cle': 'b1', 'action': 'add_incident', 'donnees': {'incident_description': 'Fuite'}},
+            {'cle': 'b2', 'action': 'valider_mesure_composants'},
+        ]}
+        premier = self.synchroniser(lot).json()['resultats']
+        self.assertEqual([resultat['statut'] for resultat in premier], ['appliquee', 'refusee'])
+        self.assertEqual(premier[1]['erreur'], "Vous devez d'abord saisir les données de mesure des composants.")
+        # Lot renvoyé après une coupure : rien n'est rejoué, les résultats enregistrés reviennent
+        second = self.synchroniser(lot).json()['resultats']
+        self.assertEqual([(resultat['statut'], resultat['deja_recue']) for resultat in second], [('appliquee', True), ('refusee', True)])
+        self.assertEqual(second[1]['erreur'], premier[1]['erreur'])
+        self.assertEqual(self.fiche.incidents.count(), 1)
+        self.assertEqual(ActionSynchronisee.objects.count(), 2)
+        # La clé est propre à l'utilisateur
+        self.client.force_login(self.controleur)
+        self.assertNotIn('deja_recue', self.synchroniser({'actions': lot['actions'][:1]}).json()['resultats'][0])
+        self.assertEqual(self.fiche.incidents.count(), 2)
+
+    def test_chronometres_a_l_heure_de_la_tablette(self):
+        debut = timezone.now() - timedelta(minutes=20)
+        response = self.synchroniser({'actions': [
+            {'cle': 'c1', 'action': f'start_tache_{self.tache.id}', 'horodatage': debut.isoformat()},
+            {'cle': 'c2', 'action': f'finish_tache_{self.tache.id}', 'horodatage': (debut + timedelta(minutes=8)).isoformat()},
+            {'cle': 'c3', 'action': 'start_melange_mortier'},
+        ]})
+        self.assertEqual([resultat['statut'] for resultat in response.json()['resultats']], ['appliquee', 'appliquee', 'refusee'])
+        tache = Tache.objects.get(id=self.tache.id)
+        self.assertEqual((tache.date_debut, tache.duree), (debut, timedelta(minutes=8)))
+        self.assertEqual(response.json()['etat']['taches'][0]['status'], 'Terminé')
+        # Heure de tablette en avance : ramenée à l'heure du serveur
+        self.synchroniser({'actions': [
+            {'cle': 'c4', 'action': 'start_mesure_composants', 'horodatage': (timezone.now() + timedelta(days=1)).isoformat()},
+        ]})
+        self.assertLessEqual(MesureComposants.objects.get(fiche=self.fiche).date_debut, timezone.now())
+
+
+class StatistiquesTests(TestCase):
+    """Agrégats journaliers : valeurs recalculées, recalcul idempotent et tableau de bord."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur')
+        cls.atelier = Atelier.objects.create(nom='Atelier 1')
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', consignes='Consignes', ordre=n) for n in (1, 2)])
+        cls.etape = Etape.objects.get(ordre=1)
+        cls.fiches = [
+            FicheSuivi.objects.create(operateur=cls.operateur, atelier=cls.atelier, controleur=cls.operateur)
+            for _ in range(3)
+        ]
+        FicheSuivi.generer_taches_en_lot([fiche.id for fiche in cls.fiches])
+        cls.jour = timezone.localdate() - timedelta(days=3)
+        fin = timezone.make_aware(datetime.combine(cls.jour, datetime.min.time())) + timedelta(hours=10)
+        for minutes, (fiche, validation, densite) in enumerate(zip(
+            cls.fiches, ('conforme', 'non_conforme', 'conforme'), (1.02, 1.07, 1.15),
+        ), start=1):
+            Tache.objects.filter(fiche=fiche, etape=cls.etape).update(
+                date_fin=fin, duree=timedelta(minutes=10 * minutes), duree_pause=timedelta(minutes=minutes), validation=validation,
+            )
+            MelangeMortier.objects.create(fiche=fiche, densite=densite, date_fin=fin, duree=timedelta(minutes=5))
+
+    def statistique(self, **filtres):
+        return StatistiqueJournaliere.objects.get(jour=self.jour, atelier=self.atelier, **filtres)
+
+    def test_recalcul(self):
+        self.assertEqual(statistiques.recalculer(self.jour, self.jour), 2)
+        tache = self.statistique(type_etape='tache', etape=self.etape)
+        self.assertEqual((tache.nombre, tache.nombre_non_conforme), (3, 1))
+        self.assertEqual((tache.duree_totale, tache.pause_totale), (timedelta(minutes=60), timedelta(minutes=6)))
+        melange = self.statistique(type_etape='melange_mortier')
+        self.assertEqual((melange.nombre, melange.nombre_densite, melange.duree_totale), (3, 3, timedelta(minutes=15)))
+        self.assertAlmostEqual(melange.densite_somme, 3.24)
+        self.assertAlmostEqual(melange.densite_somme_carres, 1.02 ** 2 + 1.07 ** 2 + 1.15 ** 2)
+        self.assertEqual((melange.densite_min, melange.densite_max), (1.02, 1.15))
+        self.assertEqual(melange.densite_histogramme, {'1.0': 2, '1.1': 1})
+
+        # Recalculé, le jour garde les mêmes lignes ; une étape rouverte en sort
+        Tache.objects.filter(fiche=self.fiches[0], etape=self.etape).update(date_fin=None)
+        self.assertEqual(statistiques.recalculer(self.jour, self.jour), 2)
+        self.assertEqual(StatistiqueJournaliere.objects.count(), 2)
+        self.assertEqual(self.statistique(type_etape='tache', etape=self.etape).nombre, 2)
+
+        lignes = {ligne['type_etape']: ligne for ligne in statistiques.tableau(self.jour, self.jour)}
+        self.assertEqual(lignes['tache']['duree_moyenne'], timedelta(minutes=25))
+        self.assertEqual(lignes['tache']['taux_non_conforme'], 50)
+        self.assertAlmostEqual(lignes['melange_mortier']['densite_moyenne'], 1.08)
+        self.assertAlmostEqual(lignes['melange_mortier']['densite_ecart_type'], math.sqrt(((0.06 ** 2) + (0.01 ** 2) + (0.07 ** 2)) / 3))
+
+    def test_recalcul_a_la_fin_d_une_etape(self):
+        # L'étape terminée recalcule son jour après le COMMIT
+        tache = Tache.objects.get(fiche=self.fiches[0], etape__ordre=2)
+        objets = Tache.objects.filter(id=tache.id)
+        debut = timezone.now() - timedelta(minutes=12)
+        with self.captureOnCommitCallbacks(execute=True):
+            chrono.actionner('tache', objets, 'start', fiche_id=self.fiches[0].id, quand=debut)
+        self.assertFalse(StatistiqueJournaliere.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            chrono.actionner('tache', objets, 'finish', fiche_id=self.fiches[0].id, quand=debut + timedelta(minutes=12))
+        ligne = StatistiqueJournaliere.objects.get(etape=tache.etape)
+        self.assertEqual((ligne.jour, ligne.nombre, ligne.duree_totale), (timezone.localdate(debut + timedelta(minutes=12)), 1, timedelta(minutes=12)))
+
+    def test_commande(self):
+        sortie = StringIO()
+        call_command('recalculer_statistiques', stdout=sortie)
+        self.assertIn('2 lignes de statistiques écrites.', sortie.getvalue())
+        call_command('recalculer_statistiques', debut=self.jour, fin=self.jour, stdout=sortie)
+        self.assertEqual(StatistiqueJournaliere.objects.count(), 2)
+
+
+class ImportTests(TestCase):
+    """Import des fiches par django-import-export : tâches générées et aller-retour export/import."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user('operateur')
+        User.objects.create_user('controleur', first_name='controleur')
+        Atelier.objects.bulk_create([Atelier(nom='Nord'), Atelier(nom='Sud')])
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', consignes='Consignes', ordre=n) for n in (1, 2, 3)])
+
+    def test_aller_retour(self):
+        with tempfile.TemporaryDirectory() as dossier:
+            fichier = Path(dossier) / 'fiches.csv'
+            fichier.write_text('atelier,operateur,controleur\n' + 'Nord,operateur,controleur\nSud,operateur,controleur\n' * 2 + 'Nord,operateur,controleur\n')
+            sortie = StringIO()
+            call_command('importer', 'fiches', str(fichier), stdout=sortie)
+        self.assertIn('5 créées', sortie.getvalue())
+        self.assertEqual(FicheSuivi.objects.count(), 5)
+        etapes = list(Etape.objects.order_by('ordre').values_list('id', flat=True))
+        for fiche in FicheSuivi.objects.all():
+            self.assertEqual(list(fiche.taches.order_by('etape__ordre').values_list('etape_id', flat=True)), etapes)
+
+        exporte = FicheSuiviResource().export()
+        self.assertEqual(exporte.headers[:4], ['id', 'atelier', 'operateur', 'controleur'])
+        self.assertEqual(sorted(exporte['atelier']), ['Nord', 'Nord', 'Nord', 'Sud', 'Sud'])
+        self.assertEqual(set(exporte['operateur']), {'operateur'})
+        # Réimporté, le fichier met à jour les mêmes fiches (par id) sans nouvelles tâches
+        del exporte['atelier']
+        exporte.append_col(['Sud'] * len(exporte), header='atelier')
+        resultat = FicheSuiviResource().import_data(exporte)
+        self.assertFalse(resultat.has_errors() or resultat.has_validation_errors())
+        self.assertEqual((resultat.totals['new'], resultat.totals['update']), (0, 5))
+        self.assertEqual(set(FicheSuivi.objects.values_list('atelier__nom', flat=True)), {'Sud'})
+        self.assertEqual(Tache.objects.count(), 15)
+
+
+def image_signature(decalage=0):
+    image = BytesIO()
+    trait = Image.new('L', (200, 80), 'white')
+    ImageDraw.Draw(trait).line((10, 40 + decalage, 190, 40 - decalage), fill='black', width=4)
+    trait.save(image, format='PNG')
+    return image.getvalue()
+
+
+class SignaturesTests(TestCase):
+    """Signatures dédoublonnées : propriété par déposant, reprise des dépôts et anciens fichiers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur')
+        cls.controleur = User.objects.create_user('controleur', first_name='controleur')
+
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        self.dossier = Path(dossier.name)
+        reglages = override_settings(MEDIA_ROOT=dossier.name)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+    def derniere(self, utilisateur):
+        return Signature.objects.filter(id__in=signatures.derniere(utilisateur)).first()
+
+    def test_meme_image_deux_deposants(self):
+        premiere = signatures.enregistrer(image_signature(), self.operateur)
+        autre = signatures.enregistrer(image_signature(10), self.operateur)
+        self.assertEqual(self.derniere(self.operateur), autre)
+        # Le contrôleur dépose la première image : fichier partagé, l'opérateur garde la sienne
+        self.assertEqual(signatures.enregistrer(image_signature(), self.controleur), premiere)
+        self.assertEqual(Signature.objects.count(), 2)
+        self.assertEqual(self.derniere(self.controleur), premiere)
+        self.assertEqual(self.derniere(self.operateur), autre)
+        premiere.refresh_from_db()
+        self.assertEqual(premiere.utilisateur, self.operateur)
+        # Redéposée, une image redevient la signature courante
+        signatures.enregistrer(image_signature(), self.operateur)
+        self.assertEqual(self.derniere(self.operateur), premiere)
+        self.assertEqual(DepotSignature.objects.count(), 3)
+
+    def test_depot_et_validation(self):
+        atelier = Atelier.objects.create(nom='Atelier 1')
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', ordre=n) for n in (1, 2)])
+        fiche = FicheSuivi.objects.create(operateur=self.operateur, atelier=atelier, controleur=self.controleur)
+        taches = fiche.generer_taches()
+        self.client.force_login(self.operateur)
+
+        def deposer(contenu, nom='signature.png'):
+            fichier = BytesIO(contenu)
+            fichier.name = nom
+            return self.client.post(reverse('checklist:deposer_signature'), {'signature': fichier})
+
+        self.assertEqual(deposer(b'pas une image').status_code, 400)
+        # Même trait déposé deux fois : un seul fichier, rangé par empreinte
+        empreintes = {deposer(image_signature()).json()['empreinte'] for _ in range(2)}
+        self.assertEqual(len(empreintes), 1)
+        self.assertEqual(len(list(self.dossier.glob('signatures/*/*.png'))), 1)
+        # Chaque tâche validée reprend la signature déposée, sans copie
+        for tache in taches:
+            self.client.post(reverse('checklist:fiche_detail', args=[fiche.id]), {'action': f'valider_tache_operateur_{tache.id}'})
+        self.assertEqual(
+            set(fiche.taches.values_list('signature_operateur__empreinte', flat=True)), empreintes,
+        )
+        self.assertEqual(Signature.objects.count(), 1)
+
+    def test_reprise_des_depots(self):
+        # Avant 0019, un second déposant prenait la signature au premier
+        migration = import_module('checklist.migrations.0018_depotsignature')
+        atelier = Atelier.objects.create(nom='Atelier 1')
+        Etape.objects.create(nom='Étape 1', ordre=1)
+        fiche = FicheSuivi.objects.create(operateur=self.operateur, atelier=atelier, controleur=self.controleur)
+        tache = fiche.generer_taches()[0]
+        signature = signatures.enregistrer(image_signature(), self.controleur)
+        Tache.objects.filter(id=tache.id).update(
+            valide_par_operateur=self.operateur, signature_operateur=signature, date_validation_operateur=timezone.now(),
+        )
+        DepotSignature.objects.all().delete()
+        migration.copier_depots(django_apps, None)
+        self.assertEqual(self.derniere(self.operateur), signature)
+        self.assertEqual(self.derniere(self.controleur), signature)
+
+    def test_normalisation_de_la_migration(self):
+        # Copie figée dans 0015 : mêmes octets, donc mêmes empreintes, que l'application
+        migration = import_module('checklist.migrations.0015_signature')
+        for contenu in (image_signature(), image_signature(15)):
+            self.assertEqual(migration.normaliser(contenu), signatures.normaliser(contenu))
+        self.assertIsNone(migration.normaliser(b'pas une image'))
+
+    def test_purge_des_anciens_fichiers(self):
+        signature = signatures.enregistrer(image_signature(), self.operateur)
+        (self.dossier / 'signatures').mkdir(exist_ok=True)
+        for nom in ('tache_1.png', 'tache_2.png'):
+            (self.dossier / 'signatures' / nom).write_bytes(image_signature())
+        sortie = StringIO()
+        call_command('purger_signatures', essai=True, stdout=sortie)
+        self.assertIn('2 ancienne(s)', sortie.getvalue())
+        self.assertTrue((self.dossier / 'signatures' / 'tache_1.png').exists())
+        call_command('purger_signatures', stdout=StringIO())
+        self.assertEqual(sorted(p.name for p in (self.dossier / 'signatures').iterdir()), [signature.empreinte[:2]])
+        self.assertTrue((self.dossier / signature.fichier.name).exists())
+
+
+class ExportsTests(TestCase):
+    """Exports CSV et PDF : filtres, cache disque des PDF et archives par lot."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operateur = User.objects.create_user('operateur', first_name='Jean', last_name='Dupont')
+        cls.controleur = User.objects.create_user('controleur', first_name='controleur')
+        cls.atelier = Atelier.objects.create(nom='Atelier Nord')
+        Etape.objects.bulk_create([Etape(nom=f'Étape {n}', consignes='Consignes', ordre=n) for n in (1, 2)])
+        cls.fiche = FicheSuivi.objects.create(operateur=cls.operateur, atelier=cls.atelier, controleur=cls.controleur)
+        cls.fiche.generer_taches()
+
+    def setUp(self):
+        self.client.force_login(self.operateur)
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        self.dossier = Path(dossier.name)
+        reglages = override_settings(PDF_EXPORT_DIR=dossier.name)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+    def test_filtres_invalides(self):
+        for parametres in ('?debut=hier', '?fin=2024-02-30', '?atelier=nord'):
+            with self.subTest(parametres=parametres):
+                self.assertEqual(self.client.get(reverse('checklist:export_csv_lot') + parametres).status_code, 400)
+                self.assertEqual(self.client.get(reverse('checklist:export_pdf_lot') + parametres).status_code, 400)
+        response = self.client.get(reverse('checklist:export_csv_lot') + '?debut=2000-01-01&fin=2000-12-31')
+        self.assertNotIn(f'fiche,{self.fiche.id}', b''.join(response.streaming_content).decode())
+
+    @mock.patch('checklist.rendu_pdf.convertir', return_value=b'%PDF-1.4')
+    def test_export_pdf_par_la_file(self, convertir):
+        url = reverse('checklist:export_pdf', args=[self.fiche.id])
+        self.assertEqual(self.client.get(url).status_code, 202)
+        # Générée par traiter_exports_pdf, puis servie depuis le cache disque
+        call_command('traiter_exports_pdf', stdout=StringIO())
+        self.assertEqual(ExportPDF.objects.get().statut, 'termine')
+        self.assertIn('Atelier Nord', convertir.call_args.args[0])
+        self.assertEqual(b''.join(self.client.get(url).streaming_content), b'%PDF-1.4')
+        self.assertEqual(convertir.call_count, 1)
+
+    def test_export_pdf_lot_par_la_file(self):
+        url = reverse('checklist:export_pdf_lot') + f'?atelier={self.atelier.id}'
+        self.assertEqual(self.client.get(url + '0').status_code, 400)
+        # Demande rejouée (page rechargée) : une seule archive à construire
+        self.assertEqual(self.client.get(url).status_code, 202)
+        self.assertEqual(self.client.get(url).status_code, 202)
+        export = ExportLotPDF.objects.get()
+        statut = reverse('checklist:export_pdf_lot_statut', args=[export.id])
+        self.assertEqual(self.client.get(statut).json()['statut'], 'en_attente')
+        # PDF déjà en cache : l'archive ne lance aucune conversion
+        empreinte = pdf.calculer_empreinte(pdf.rendre_html(pdf.pour_rendu(FicheSuivi.objects).get(id=self.fiche.id)))
+        pdf.ecrire_cache(empreinte, b'%PDF-1.4')
+        sortie = StringIO()
+        call_command('traiter_exports_pdf', stdout=sortie)
+        self.assertIn('1 archive(s) par lot construite(s)', sortie.getvalue())
+        donnees = self.client.get(statut).json()
+        self.assertEqual(donnees['statut'], 'termine')
+        response = self.client.get(donnees['url'])
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(archive.read(f'fiche_{self.fiche.id}.pdf'), b'%PDF-1.4')
+        # L'archive n'est servie qu'à son demandeur
+        self.client.force_login(self.controleur)
+        self.assertEqual(self.client.get(donnees['url']).status_code, 404)
+        self.assertEqual(self.client.get(statut).status_code, 404)
+        # Expirée : la ligne et le fichier sont supprimés
+        ExportLotPDF.objects.filter(id=export.id).update(date_fin=timezone.now() - timedelta(days=2))
+        self.assertEqual(archive_pdf.purger_lots(timedelta(days=1)), 1)
+        self.assertFalse(archive_pdf.chemin_lot(export.id).exists())
+
+    def test_export_csv_lot_en_asgi(self):
+        # Flux asynchrone sous ASGI, sinon Django le lirait en entier avant l'envoi
+        self.async_client.force_login(self.operateur)
+
+        async def telecharger():
+            response = await self.async_client.get(reverse('checklist:export_csv_lot'))
+            self.assertTrue(response.is_async)
+            return b''.join([morceau async for morceau in response.streaming_content])
+
+        with mock.patch('checklist.views.TAILLE_ENVOI_FLUX', 10):
+            contenu = async_to_sync(telecharger)()
+        self.assertEqual(contenu, b''.join(self.client.get(reverse('checklist:export_csv_lot')).streaming_content))
+        self.assertIn(f'fiche,{self.fiche.id}', contenu.decode())
+
+    def test_purge_du_cache_pdf(self):
+        maintenant = time.time()
+        for numero, age in enumerate((40, 20, 10, 0)):
+            chemin = pdf.ecrire_cache(f'{numero:02d}' + '0' * 62, b'%PDF' + b'.' * 1020)
+            os.utime(chemin, (maintenant - age * 86400,) * 2)
+        # Le plus ancien dépasse 30 jours, puis la taille ramène le cache à 2 Ko
+        self.assertEqual(pdf.purger_cache(age_max=timedelta(days=30), taille_max=2048), 2)
+        self.assertEqual(sorted(chemin.name[:2] for chemin in self.dossier.glob('??/*.pdf')), ['02', '03'])
+        # Un PDF servi redevient récent
+        self.assertTrue(pdf.en_cache('02' + '0' * 62))
+        self.assertIsNone(pdf.en_cache('00' + '0' * 62))
+        os.utime(pdf.chemin_cache('03' + '0' * 62), (maintenant - 5 * 86400,) * 2)
+        sortie = StringIO()
+        call_command('traiter_exports_pdf', age_max=1, stdout=sortie)
+        self.assertIn('1 PDF purgé(s)', sortie.getvalue())
+        self.assertEqual([chemin.name[:2] for chemin in self.dossier.glob('??/*.pdf')], ['02'])
@@ -5,10 +5,23 @@ app_name = 'checklist'
 
 urlpatterns = [
     path('', views.accueil, name='accueil'),
+    path('controle/', views.controle, name='controle'),
+    path('statistiques/', views.statistiques, name='statistiques'),
     path('nouvelle/', views.nouvelle_fiche, name='nouvelle_fiche'),
     path('fiche/<int:fiche_id>/', views.fiche_detail, name='fiche_detail'),
+    path('fiche/<int:fiche_id>/flux/', views.flux_fiche, name='flux_fiche'),
+    path('fiche/<int:fiche_id>/synchroniser/', views.synchroniser, name='synchroniser'),
+    path('fiche/<int:fiche_id>/chrono/<slug:cible>/<slug:transition>/', views.chrono, name='chrono'),
+    path('fiche/<int:fiche_id>/chrono/<slug:cible>/<int:tache_id>/<slug:transition>/', views.chrono, name='chrono_tache'),
+    path('signature/', views.deposer_signature, name='deposer_signature'),
     path('export/pdf/<int:fiche_id>/', views.export_pdf, name='export_pdf'),
+    path('export/pdf/statut/<int:export_id>/', views.export_pdf_statut, name='export_pdf_statut'),
+    path('export/pdf/', views.export_pdf_lot, name='export_pdf_lot'),
+    path('export/pdf/lot/<int:export_id>/statut/', views.export_pdf_lot_statut, name='export_pdf_lot_statut'),
+    path('export/pdf/lot/<int:export_id>/', views.export_pdf_lot_fichier, name='export_pdf_lot_fichier'),
+    path('export/csv/', views.export_csv_lot, name='export_csv_lot'),
     path('export/csv/<int:fiche_id>/', views.export_csv, name='export_csv'),
+    path('metriques/', views.metriques_prometheus, name='metriques'),
     path('signup/', views.signup, name='signup'),
     path('ateliers/', views.atelier_list, name='atelier_list'),
     path('ateliers/ajouter/', views.ajouter_atelier, name='ajouter_atelier'),
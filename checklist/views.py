@@ -1,17 +1,47 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.decorators.http import require_http_methods
-from .models import FicheSuivi, Atelier, Etape, Tache, Incident, RetourExperience, MesureComposants, MelangeMortier
+from .models import FicheSuivi, FicheArchivee, Atelier, Tache, MesureComposants, MelangeMortier, ExportPDF, ExportLotPDF
 from django.utils import timezone
-from django.http import HttpResponse, JsonResponse
-from django.template.loader import render_to_string
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 import csv
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.contrib import messages
+from django.conf import settings
+from django.core.cache import cache
 from django import forms
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes, force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from .requetes import plafond_requetes
+from . import actions
+from . import chrono as chrono_etapes
+from . import exports
+from . import pdf
+from . import cache_fiches
+from . import referentiel
+from . import diffusion
+from . import synchronisation
+from . import signatures
+from . import archive_pdf
+from . import archives
+from . import metriques
+from asgiref.sync import sync_to_async
+from . import statistiques as stats
+import asyncio
 import json
+from datetime import timedelta
+
+# Nombre de fiches affichées par page sur l'accueil
+FICHES_PAR_PAGE = 50
+# Nombre de tâches listées dans la file du contrôleur
+TACHES_A_CONTROLER = 100
 
 # Create your views here.
 
@@ -28,33 +58,143 @@ class CustomUserCreationForm(UserCreationForm):
         fields = ("username", "email", "role", "password1", "password2")
 
 
+def _encoder_curseur(fiche):
+    return urlsafe_base64_encode(f"{fiche.date_creation.isoformat()}|{fiche.id}".encode())
+
+
+def _decoder_curseur(curseur):
+    # Un curseur invalide renvoie simplement à la première page
+    try:
+        date_iso, fiche_id = force_str(urlsafe_base64_decode(curseur)).rsplit('|', 1)
+        date_creation = parse_datetime(date_iso)
+        if date_creation is None:
+            return None
+        return date_creation, int(fiche_id)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _utilisateur(request):
+    # Utilisateur chargé par l'ORM asynchrone ; remis dans request.user pour que
+    # les gabarits ne le relisent pas par une requête synchrone.
+    request.user = await request.auser()
+    return request.user
+
+
+@login_required
+@plafond_requetes(2)
+async def accueil(request):
+    # Pagination par curseur sur (date_creation, id) : le coût d'une page ne dépend
+    # pas du nombre total de fiches de l'opérateur.
+    user = await _utilisateur(request)
+    fiches = (
+        FicheSuivi.objects.filter(operateur=user)
+        .select_related('atelier', 'operateur', 'controleur')
+        .order_by('-date_creation', '-id')
+    )
+    curseur = _decoder_curseur(request.GET.get('apres', ''))
+    if curseur:
+        date_creation, fiche_id = curseur
+        fiches = fiches.filter(Q(date_creation__lt=date_creation) | Q(date_creation=date_creation, id__lt=fiche_id))
+    fiches = [fiche async for fiche in fiches[:FICHES_PAR_PAGE + 1]]
+    page_suivante = None
+    if len(fiches) > FICHES_PAR_PAGE:
+        fiches = fiches[:FICHES_PAR_PAGE]
+        page_suivante = _encoder_curseur(fiches[-1])
+    return render(request, 'checklist/accueil.html', {
+        'fiches': fiches,
+        'page_suivante': page_suivante,
+        'premiere_page': curseur is None,
+    })
+
+
 @login_required
-def accueil(request):
-    fiches = FicheSuivi.objects.filter(operateur=request.user)
-    return render(request, 'checklist/accueil.html', {'fiches': fiches})
+async def controle(request):
+    # File du contrôleur : fiches à valider et nombre de tâches en attente,
+    # calculé en SQL dans une seule requête agrégée.
+    user = await _utilisateur(request)
+    fiches = [
+        fiche async for fiche in
+        FicheSuivi.objects.filter(controleur=user, valide_par_controleur__isnull=True)
+        .select_related('atelier', 'operateur')
+        .annotate(taches_en_attente=Count('taches', filter=Q(taches__valide_par_controleur__isnull=True)))
+        .order_by('date_creation', 'id')[:FICHES_PAR_PAGE]
+    ]
+    # Tâches de ces fiches déjà validées par l'opérateur, prêtes pour le contrôle
+    # (lues par l'index partiel des tâches en attente du contrôleur)
+    taches = []
+    if fiches:
+        taches = [
+            tache async for tache in
+            Tache.objects.filter(
+                fiche__in=[fiche.id for fiche in fiches],
+                valide_par_controleur__isnull=True,
+                valide_par_operateur__isnull=False,
+            )
+            .select_related('etape', 'fiche__atelier')
+            .order_by('date_validation_operateur')[:TACHES_A_CONTROLER]
+        ]
+    return render(request, 'checklist/controle.html', {'fiches': fiches, 'taches': taches})
+
+
+@login_required
+@plafond_requetes(1)
+def statistiques(request):
+    # Tableau de bord lu dans les agrégats journaliers, jamais dans l'historique brut
+    try:
+        fin = parse_date(request.GET.get('fin', '')) or timezone.localdate()
+        debut = parse_date(request.GET.get('debut', '')) or fin - timedelta(days=30)
+    except ValueError:
+        return HttpResponse("Période invalide.", status=400)
+    return render(request, 'checklist/statistiques.html', {
+        'lignes': stats.tableau(debut, fin),
+        'debut': debut,
+        'fin': fin,
+    })
 
 
 @login_required
 def nouvelle_fiche(request):
-    ateliers = Atelier.objects.all()
-    controleurs = User.objects.filter(is_active=True, first_name="controleur")
+    ateliers = referentiel.ateliers()
+    controleurs = referentiel.controleurs()
     if request.method == 'POST':
         atelier_id = request.POST.get('atelier')
         controleur_id = request.POST.get('controleur')
         if atelier_id and controleur_id:
-            fiche = FicheSuivi.objects.create(
-                operateur=request.user,
-                atelier_id=atelier_id,
-                controleur_id=controleur_id
-            )
+            with transaction.atomic():
+                fiche = FicheSuivi.objects.create(
+                    operateur=request.user,
+                    atelier_id=atelier_id,
+                    controleur_id=controleur_id
+                )
+                # Fiche toute neuve : ses tâches sont insérées sans être relues
+                FicheSuivi.generer_taches_en_lot([fiche.id])
             return redirect('checklist:fiche_detail', fiche.id)
     return render(request, 'checklist/nouvelle_fiche.html', {'ateliers': ateliers, 'controleurs': controleurs})
 
 
 @login_required
 def fiche_detail(request, fiche_id):
-    fiche = FicheSuivi.objects.get(id=fiche_id, operateur=request.user)
-    taches = fiche.taches.select_related('etape').order_by('etape__ordre')
+    if request.method == 'POST':
+        return _executer_action(request, fiche_id)
+    # La version est lue avant les données : une modification concurrente
+    # ne peut qu'être cachée sous une version déjà périmée.
+    version = cache_fiches.version(fiche_id)
+    try:
+        fiche = FicheSuivi.objects.get(Q(operateur=request.user) | Q(controleur=request.user), id=fiche_id)
+    except FicheSuivi.DoesNotExist:
+        return _fiche_archivee(request, fiche_id)
+    client = cache_fiches.cle_client(request)
+    # Une fiche validée par l'opérateur et le contrôleur ne change plus guère :
+    # la page entière est servie depuis le cache tant que sa version tient.
+    cle_page = None
+    if fiche.valide_par_operateur_id and fiche.valide_par_controleur_id and client and not messages.get_messages(request):
+        cle_page = cache_fiches.cle_page(fiche.id, version, client)
+        contenu = cache.get(cle_page)
+        if contenu is not None:
+            return HttpResponse(contenu)
+    # Validations affichées par tâche : les comptes sont joints, pas relus un à un
+    taches = list(fiche.taches.select_related('etape', 'valide_par_operateur', 'valide_par_controleur').order_by('etape__ordre'))
     incidents = fiche.incidents.order_by('-date')
     retour_experience = fiche.retour_experience
     mesure_composants = None
@@ -67,493 +207,18 @@ def fiche_detail(request, fiche_id):
         melange_mortier = fiche.melange_mortier
     except MelangeMortier.DoesNotExist:
         pass
-    # Pour la création initiale, générer les tâches si elles n'existent pas
-    if taches.count() == 0:
-        for etape in Etape.objects.order_by('ordre'):
-            Tache.objects.create(fiche=fiche, etape=etape)
-        taches = fiche.taches.select_related('etape').order_by('etape__ordre')
+    # Les tâches sont générées à la création de la fiche ; les fiches plus
+    # anciennes qui n'en ont pas encore sont complétées ici.
+    if not taches:
+        taches = fiche.generer_taches()
+        cache_fiches.invalider(fiche.id)
     # Gestion séquentielle : verrouillage des étapes non atteintes
     etape_active = None
     for tache in taches:
         if tache.validation != 'conforme':
             etape_active = tache
             break
-    if request.method == 'POST':
-        action = request.POST.get('action')
-        
-        # Vérifier si c'est une requête AJAX
-        is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
-        
-        # Ajout d'un incident
-        if action == 'add_incident':
-            description = request.POST.get('incident_description')
-            if description:
-                incident = Incident.objects.create(description=description)
-                fiche.incidents.add(incident)
-            return redirect('checklist:fiche_detail', fiche.id)
-        # Ajout ou modification du retour d'expérience
-        if action == 'add_retour':
-            commentaire = request.POST.get('retour_commentaire')
-            if commentaire:
-                if retour_experience:
-                    retour_experience.commentaire = commentaire
-                    retour_experience.save()
-                else:
-                    retour_experience = RetourExperience.objects.create(commentaire=commentaire)
-                    fiche.retour_experience = retour_experience
-                    fiche.save()
-            return redirect('checklist:fiche_detail', fiche.id)
-        # Validation globale opérateur
-        if action == 'valider_fiche_operateur' and fiche.valide_par_operateur is None and request.user == fiche.operateur:
-            fiche.valide_par_operateur = request.user
-            fiche.date_validation_operateur = timezone.now()
-            fiche.save()
-            return redirect('checklist:fiche_detail', fiche.id)
-        # Validation globale contrôleur
-        if action == 'valider_fiche_controleur' and fiche.valide_par_controleur is None and request.user == fiche.controleur:
-            fiche.valide_par_controleur = request.user
-            fiche.date_validation_controleur = timezone.now()
-            fiche.save()
-            return redirect('checklist:fiche_detail', fiche.id)
-        # Validation opérateur sur une étape
-        if action and action.startswith('valider_tache_operateur_'):
-            tache_id = action.replace('valider_tache_operateur_', '')
-            try:
-                tache = Tache.objects.get(id=tache_id, fiche=fiche)
-                if tache.valide_par_operateur is None and request.user == fiche.operateur:
-                    tache.valide_par_operateur = request.user
-                    tache.date_validation_operateur = timezone.now()
-                    tache.save()
-            except Tache.DoesNotExist:
-                pass
-            return redirect('checklist:fiche_detail', fiche.id)
-        # Validation contrôleur sur une étape
-        if action and action.startswith('valider_tache_controleur_'):
-            tache_id = action.replace('valider_tache_controleur_', '')
-            try:
-                tache = Tache.objects.get(id=tache_id, fiche=fiche)
-                if tache.valide_par_controleur is None and request.user == fiche.controleur:
-                    tache.valide_par_controleur = request.user
-                    tache.date_validation_controleur = timezone.now()
-                    tache.save()
-            except Tache.DoesNotExist:
-                pass
-            return redirect('checklist:fiche_detail', fiche.id)
-        # Gestion des étapes fixes
-        if action == 'save_mesure_composants':
-            data = {
-                'fiche': fiche,
-                'ciment': request.POST.get('ciment') or None,
-                'sable': request.POST.get('sable') or None,
-                'agent_moussant': request.POST.get('agent_moussant') or None,
-                'fibre_verre': request.POST.get('fibre_verre') or None,
-                'dsp_xl': request.POST.get('dsp_xl') or None,
-                'hdr': request.POST.get('hdr') or None,
-                'eau': request.POST.get('eau') or None,
-                'commentaires': request.POST.get('commentaires_mesure', ''),
-            }
-            MesureComposants.objects.update_or_create(fiche=fiche, defaults=data)
-            return redirect('checklist:fiche_detail', fiche.id)
-        
-        if action == 'valider_mesure_composants':
-            try:
-                mesure = fiche.mesure_composants
-                
-                # Récupérer et sauvegarder les données du formulaire
-                if 'ciment' in request.POST and request.POST.get('ciment'):
-                    mesure.ciment = float(request.POST.get('ciment'))
-                if 'sable' in request.POST and request.POST.get('sable'):
-                    mesure.sable = float(request.POST.get('sable'))
-                if 'agent_moussant' in request.POST and request.POST.get('agent_moussant'):
-                    mesure.agent_moussant = float(request.POST.get('agent_moussant'))
-                if 'fibre_verre' in request.POST and request.POST.get('fibre_verre'):
-                    mesure.fibre_verre = float(request.POST.get('fibre_verre'))
-                if 'dsp_xl' in request.POST and request.POST.get('dsp_xl'):
-                    mesure.dsp_xl = float(request.POST.get('dsp_xl'))
-                if 'hdr' in request.POST and request.POST.get('hdr'):
-                    mesure.hdr = float(request.POST.get('hdr'))
-                if 'eau' in request.POST and request.POST.get('eau'):
-                    mesure.eau = float(request.POST.get('eau'))
-                if 'commentaires_mesure' in request.POST:
-                    mesure.commentaires = request.POST.get('commentaires_mesure')
-                
-                mesure.save()
-                
-                # Vérifier que tous les champs sont remplis
-                if not all([
-                    mesure.ciment is not None,
-                    mesure.sable is not None,
-                    mesure.agent_moussant is not None,
-                    mesure.fibre_verre is not None,
-                    mesure.dsp_xl is not None,
-                    mesure.hdr is not None,
-                    mesure.eau is not None,
-                    mesure.commentaires
-                ]):
-                    error_message = "Tous les champs doivent être remplis avant de valider cette étape."
-                    if is_ajax:
-                        return JsonResponse({'success': False, 'error': error_message})
-                    messages.error(request, error_message)
-                    return redirect('checklist:fiche_detail', fiche.id)
-                
-                # Si tout est ok, valider l'étape
-                mesure.valide = True
-                mesure.date_validation = timezone.now()
-                mesure.valide_par = request.user
-                mesure.save()
-                
-                success_message = "Étape de mesure des composants validée avec succès."
-                if is_ajax:
-                    return JsonResponse({'success': True, 'message': success_message})
-                messages.success(request, success_message)
-            except MesureComposants.DoesNotExist:
-                error_message = "Vous devez d'abord saisir les données de mesure des composants."
-                if is_ajax:
-                    return JsonResponse({'success': False, 'error': error_message})
-                messages.error(request, error_message)
-            except ValueError:
-                error_message = "Les valeurs saisies ne sont pas valides. Veuillez vérifier vos données."
-                if is_ajax:
-                    return JsonResponse({'success': False, 'error': error_message})
-                messages.error(request, error_message)
-            
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        if action == 'save_melange_mortier':
-            try:
-                melange = fiche.melange_mortier
-            except MelangeMortier.DoesNotExist:
-                melange = MelangeMortier.objects.create(fiche=fiche)
-                
-            # Enregistrer les données du formulaire
-            melange.commentaires = request.POST.get('commentaires_melange', '')
-            if request.POST.get('densite'):
-                melange.densite = float(request.POST.get('densite'))
-                
-            # Enregistrer l'état des étapes
-            melange.etape_verser_eau = 'etape_verser_eau' in request.POST
-            melange.etape_ajouter_fibre = 'etape_ajouter_fibre' in request.POST
-            melange.etape_melanger_1min = 'etape_melanger_1min' in request.POST
-            melange.etape_verser_ciment = 'etape_verser_ciment' in request.POST
-            melange.etape_ajuster_eau = 'etape_ajuster_eau' in request.POST
-            melange.etape_mesurer_densite = 'etape_mesurer_densite' in request.POST
-                
-            melange.save()
-            messages.success(request, "Données du mélange du mortier enregistrées avec succès.")
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        if action == 'valider_melange_mortier':
-            try:
-                # Vérifier que l'étape précédente est validée
-                if not fiche.mesure_composants.valide:
-                    error_message = "Vous devez d'abord valider l'étape de mesure des composants."
-                    if is_ajax:
-                        return JsonResponse({'success': False, 'error': error_message})
-                    messages.error(request, error_message)
-                    return redirect('checklist:fiche_detail', fiche.id)
-                    
-                melange = fiche.melange_mortier
-                
-                # Récupérer et sauvegarder les données du formulaire
-                if 'densite' in request.POST and request.POST.get('densite'):
-                    melange.densite = float(request.POST.get('densite'))
-                if 'commentaires_melange' in request.POST:
-                    melange.commentaires = request.POST.get('commentaires_melange')
-                
-                # Sauvegarder l'état des cases à cocher
-                melange.etape_verser_eau = 'etape_verser_eau' in request.POST
-                melange.etape_ajouter_fibre = 'etape_ajouter_fibre' in request.POST
-                melange.etape_melanger_1min = 'etape_melanger_1min' in request.POST
-                melange.etape_verser_ciment = 'etape_verser_ciment' in request.POST
-                melange.etape_ajuster_eau = 'etape_ajuster_eau' in request.POST
-                melange.etape_mesurer_densite = 'etape_mesurer_densite' in request.POST
-                
-                melange.save()
-                
-                # Vérifier que tous les champs sont remplis
-                if not all([
-                    melange.densite is not None,
-                    melange.commentaires,
-                    melange.etape_verser_eau,
-                    melange.etape_ajouter_fibre,
-                    melange.etape_melanger_1min,
-                    melange.etape_verser_ciment,
-                    melange.etape_ajuster_eau,
-                    melange.etape_mesurer_densite
-                ]):
-                    error_message = "Tous les champs doivent être remplis et toutes les étapes doivent être cochées avant de valider cette étape."
-                    if is_ajax:
-                        return JsonResponse({'success': False, 'error': error_message})
-                    messages.error(request, error_message)
-                    return redirect('checklist:fiche_detail', fiche.id)
-                
-                # Si tout est ok, valider l'étape
-                melange.valide = True
-                melange.date_validation = timezone.now()
-                melange.valide_par = request.user
-                melange.save()
-                
-                success_message = "Étape de mélange du mortier validée avec succès."
-                if is_ajax:
-                    return JsonResponse({'success': True, 'message': success_message})
-                messages.success(request, success_message)
-            except MesureComposants.DoesNotExist:
-                error_message = "Vous devez d'abord compléter et valider l'étape de mesure des composants."
-                if is_ajax:
-                    return JsonResponse({'success': False, 'error': error_message})
-                messages.error(request, error_message)
-            except MelangeMortier.DoesNotExist:
-                error_message = "Vous devez d'abord saisir les données de mélange du mortier."
-                if is_ajax:
-                    return JsonResponse({'success': False, 'error': error_message})
-                messages.error(request, error_message)
-            except ValueError:
-                error_message = "Les valeurs saisies ne sont pas valides. Veuillez vérifier vos données."
-                if is_ajax:
-                    return JsonResponse({'success': False, 'error': error_message})
-                messages.error(request, error_message)
-            
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        # Gestion séquentielle : verrouillage des étapes non atteintes
-        if action == 'valider_etape_fixe':
-            etape_id = request.POST.get('etape_id')
-            try:
-                etape = Etape.objects.get(id=etape_id)
-                if not etape.valide:
-                    etape.valide = True
-                    etape.date_validation = timezone.now()
-                    etape.valide_par = request.user
-                    etape.save()
-            except Etape.DoesNotExist:
-                pass
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        if action == 'save_etape_fixe':
-            etape_id = request.POST.get('etape_id')
-            try:
-                etape = Etape.objects.get(id=etape_id)
-                data = {
-                    'fiche': fiche,
-                    'commentaires': request.POST.get('commentaires_etape', ''),
-                }
-                etape.objects.update_or_create(fiche=fiche, defaults=data)
-            except Etape.DoesNotExist:
-                pass
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        # --- Gestion du temps pour l'étape Mesure des composants ---
-        if action == 'start_mesure_composants':
-            try:
-                mesure = fiche.mesure_composants
-                if not mesure.date_debut:
-                    mesure.date_debut = timezone.now()
-                    mesure.save()
-            except MesureComposants.DoesNotExist:
-                # Créer l'objet s'il n'existe pas encore
-                mesure = MesureComposants.objects.create(fiche=fiche, date_debut=timezone.now())
-            
-            if is_ajax:
-                return JsonResponse({
-                    'success': True,
-                    'action': 'start_mesure_composants',
-                    'status': 'En cours',
-                    'has_pause': True,
-                    'has_finish': True,
-                    'has_start': False,
-                    'has_resume': False,
-                    'duree': str(mesure.duree) if mesure.duree else None
-                })
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        if action == 'pause_mesure_composants':
-            try:
-                mesure = fiche.mesure_composants
-                if mesure.date_debut and not mesure.date_fin and not mesure.date_pause:
-                    mesure.date_pause = timezone.now()
-                    mesure.save()
-            except MesureComposants.DoesNotExist:
-                pass
-                
-            if is_ajax:
-                return JsonResponse({
-                    'success': True,
-                    'action': 'pause_mesure_composants',
-                    'status': 'En pause',
-                    'has_pause': False,
-                    'has_finish': True,
-                    'has_start': False,
-                    'has_resume': True,
-                    'duree': str(mesure.duree) if mesure.duree else None
-                })
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        if action == 'resume_mesure_composants':
-            try:
-                mesure = fiche.mesure_composants
-                if mesure.date_pause:
-                    # Calculer le temps passé en pause et ajuster la date de début
-                    pause_duration = timezone.now() - mesure.date_pause
-                    mesure.date_debut += pause_duration
-                    mesure.date_pause = None
-                    mesure.save()
-            except MesureComposants.DoesNotExist:
-                pass
-                
-            if is_ajax:
-                return JsonResponse({
-                    'success': True,
-                    'action': 'resume_mesure_composants',
-                    'status': 'En cours',
-                    'has_pause': True,
-                    'has_finish': True,
-                    'has_start': False,
-                    'has_resume': False,
-                    'duree': str(mesure.duree) if mesure.duree else None
-                })
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        if action == 'finish_mesure_composants':
-            try:
-                mesure = fiche.mesure_composants
-                if mesure.date_debut and not mesure.date_fin:
-                    mesure.date_fin = timezone.now()
-                    # Calculer la durée totale
-                    if mesure.date_pause:
-                        # Si en pause, calculer jusqu'au moment de la pause
-                        mesure.duree = mesure.date_pause - mesure.date_debut
-                    else:
-                        mesure.duree = mesure.date_fin - mesure.date_debut
-                    mesure.save()
-            except MesureComposants.DoesNotExist:
-                pass
-                
-            if is_ajax:
-                return JsonResponse({
-                    'success': True,
-                    'action': 'finish_mesure_composants',
-                    'status': 'Terminé',
-                    'has_pause': False,
-                    'has_finish': False,
-                    'has_start': False,
-                    'has_resume': False,
-                    'duree': str(mesure.duree) if mesure.duree else None
-                })
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        # --- Gestion du temps pour l'étape Mélange du mortier ---
-        if action == 'start_melange_mortier':
-            # Vérifier que l'étape précédente est validée
-            try:
-                if not fiche.mesure_composants.valide:
-                    messages.error(request, "Vous devez d'abord valider l'étape de mesure des composants.")
-                    if is_ajax:
-                        return JsonResponse({"error": "Vous devez d'abord valider l'étape de mesure des composants."}, status=400)
-                    return redirect('checklist:fiche_detail', fiche.id)
-            except MesureComposants.DoesNotExist:
-                messages.error(request, "Vous devez d'abord compléter et valider l'étape de mesure des composants.")
-                if is_ajax:
-                    return JsonResponse({"error": "Vous devez d'abord compléter et valider l'étape de mesure des composants."}, status=400)
-                return redirect('checklist:fiche_detail', fiche.id)
-                
-            try:
-                melange = fiche.melange_mortier
-                if not melange.date_debut:
-                    melange.date_debut = timezone.now()
-                    melange.save()
-            except MelangeMortier.DoesNotExist:
-                # Créer l'objet s'il n'existe pas encore
-                melange = MelangeMortier.objects.create(fiche=fiche, date_debut=timezone.now())
-                
-            if is_ajax:
-                return JsonResponse({
-                    'success': True,
-                    'action': 'start_melange_mortier',
-                    'status': 'En cours',
-                    'has_pause': True,
-                    'has_finish': True,
-                    'has_start': False,
-                    'has_resume': False,
-                    'duree': str(melange.duree) if melange.duree else None
-                })
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        if action == 'pause_melange_mortier':
-            try:
-                melange = fiche.melange_mortier
-                if melange.date_debut and not melange.date_fin and not melange.date_pause:
-                    melange.date_pause = timezone.now()
-                    melange.save()
-            except MelangeMortier.DoesNotExist:
-                pass
-                
-            if is_ajax:
-                return JsonResponse({
-                    'success': True,
-                    'action': 'pause_melange_mortier',
-                    'status': 'En pause',
-                    'has_pause': False,
-                    'has_finish': True,
-                    'has_start': False,
-                    'has_resume': True,
-                    'duree': str(melange.duree) if melange.duree else None
-                })
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        if action == 'resume_melange_mortier':
-            try:
-                melange = fiche.melange_mortier
-                if melange.date_pause:
-                    # Calculer le temps passé en pause et ajuster la date de début
-                    pause_duration = timezone.now() - melange.date_pause
-                    melange.date_debut += pause_duration
-                    melange.date_pause = None
-                    melange.save()
-            except MelangeMortier.DoesNotExist:
-                pass
-                
-            if is_ajax:
-                return JsonResponse({
-                    'success': True,
-                    'action': 'resume_melange_mortier',
-                    'status': 'En cours',
-                    'has_pause': True,
-                    'has_finish': True,
-                    'has_start': False,
-                    'has_resume': False,
-                    'duree': str(melange.duree) if melange.duree else None
-                })
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-        if action == 'finish_melange_mortier':
-            try:
-                melange = fiche.melange_mortier
-                if melange.date_debut and not melange.date_fin:
-                    melange.date_fin = timezone.now()
-                    # Calculer la durée totale
-                    if melange.date_pause:
-                        # Si en pause, calculer jusqu'au moment de la pause
-                        melange.duree = melange.date_pause - melange.date_debut
-                    else:
-                        melange.duree = melange.date_fin - melange.date_debut
-                    melange.save()
-            except MelangeMortier.DoesNotExist:
-                pass
-                
-            if is_ajax:
-                return JsonResponse({
-                    'success': True,
-                    'action': 'finish_melange_mortier',
-                    'status': 'Terminé',
-                    'has_pause': False,
-                    'has_finish': False,
-                    'has_start': False,
-                    'has_resume': False,
-                    'duree': str(melange.duree) if melange.duree else None
-                })
-            return redirect('checklist:fiche_detail', fiche.id)
-            
-    return render(request, 'checklist/fiche_detail.html', {
+    response = render(request, 'checklist/fiche_detail.html', {
         'fiche': fiche,
         'taches': taches,
         'etape_active': etape_active,
@@ -561,47 +226,244 @@ def fiche_detail(request, fiche_id):
         'retour_experience': retour_experience,
         'mesure_composants': mesure_composants,
         'melange_mortier': melange_mortier,
+        # Fragments mis en cache par version de fiche et par client ; sans
+        # cookie CSRF (première visite), rien n'est mis en cache.
+        'version': version,
+        'cache_version': f'{version}:{client}',
+        'flux_actif': settings.FLUX_SSE,
+        'cache_duree': settings.FICHE_CACHE_DUREE if client else 0,
+    })
+    if cle_page:
+        cache.set(cle_page, response.content, settings.FICHE_CACHE_DUREE)
+    return response
+
+
+def _fiche_archivee(request, fiche_id):
+    # Fiche sortie des tables courantes : page en lecture seule, lue dans l'instantané
+    archive = get_object_or_404(FicheArchivee, Q(operateur=request.user) | Q(controleur=request.user), id=fiche_id)
+    restauree = archives.restaurer(archive)
+    return render(request, 'checklist/fiche_archivee.html', {
+        'fiche': restauree.fiche,
+        'archive': archive,
+        'taches': restauree.taches,
+        'incidents': restauree.incidents,
+        'retour_experience': restauree.retour_experience,
+        'mesure_composants': restauree.mesure_composants,
+        'melange_mortier': restauree.melange_mortier,
     })
 
 
+# Commentaire SSE envoyé sans événement pour garder la connexion ouverte
+INTERVALLE_PING = 15
+
+
+@login_required
+async def flux_fiche(request, fiche_id):
+    # Flux SSE des changements d'une fiche (chronomètres, validations,
+    # incidents) : à servir par le point d'entrée ASGI.
+    if not isinstance(request, ASGIRequest):
+        # Sous WSGI le flux sans fin bloquerait un worker ; 204 indique au
+        # navigateur de ne pas se reconnecter.
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not await FicheSuivi.objects.filter(Q(operateur=user) | Q(controleur=user), id=fiche_id).aexists():
+        return HttpResponse("Fiche introuvable.", status=404)
+
+    async def evenements():
+        async with diffusion.Abonnement(fiche_id) as abonnement:
+            # Version courante, lue après l'abonnement : le client recharge si
+            # la fiche a changé depuis l'affichage de sa page.
+            version = await sync_to_async(cache_fiches.version)(fiche_id)
+            yield 'retry: 5000\n\n' + diffusion.formater({'type': 'version', 'version': str(version)})
+            while True:
+                try:
+                    evenement = await asyncio.wait_for(abonnement.file.get(), INTERVALLE_PING)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                yield diffusion.formater(evenement)
+
+    response = StreamingHttpResponse(evenements(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _executer_action(request, fiche_id):
+    # Chaque action ne charge que la fiche et les relations qu'elle déclare
+    nom = request.POST.get('action')
+    action, argument = actions.resoudre(nom)
+    if action is None:
+        return redirect('checklist:fiche_detail', fiche_id)
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    try:
+        fiche = FicheSuivi.objects.select_related(*action.charge).get(Q(operateur=request.user) | Q(controleur=request.user), id=fiche_id)
+    except FicheSuivi.DoesNotExist:
+        if not FicheArchivee.objects.filter(id=fiche_id).exists():
+            raise Http404("Fiche introuvable.")
+        erreur = "Cette fiche est archivée : elle ne peut plus être modifiée."
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': erreur}, status=400)
+        messages.error(request, erreur)
+        return redirect('checklist:fiche_detail', fiche_id)
+    if not action.controleur and request.user.id != fiche.operateur_id:
+        erreur = "Action réservée à l'opérateur de la fiche."
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': erreur}, status=403)
+        return HttpResponse(erreur, status=403)
+    refus = None
+    with transaction.atomic():
+        # Un refus n'annule pas la saisie déjà enregistrée par l'action
+        try:
+            resultat = action.fonction(request, fiche, request.POST, argument) or {}
+        except actions.ActionRefusee as e:
+            refus = str(e)
+    # Les validations passent par des UPDATE, sans signal post_save : la
+    # version change une fois l'action validée. Une action interrompue par
+    # une exception est annulée et ne périme pas le cache.
+    cache_fiches.invalider(fiche.id)
+    if refus is not None:
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': refus}, status=400)
+        messages.error(request, refus)
+        return redirect('checklist:fiche_detail', fiche.id)
+    if is_ajax:
+        return JsonResponse({'success': True, 'action': nom, **resultat})
+    if 'message' in resultat:
+        messages.success(request, resultat['message'])
+    return redirect('checklist:fiche_detail', fiche.id)
+
+
+@login_required
+@require_http_methods(["POST"])
+def chrono(request, fiche_id, cible, transition, tache_id=None):
+    # Endpoint léger des boutons de chronomètre : un UPDATE conditionnel puis
+    # la relecture de l'état, sans le chargement complet de la fiche.
+    modele = chrono_etapes.CIBLES.get(cible)
+    if modele is None or transition not in chrono_etapes.TRANSITIONS or (modele is Tache) != (tache_id is not None):
+        return JsonResponse({'success': False, 'error': "Action inconnue."}, status=404)
+    objets = modele.objects.filter(fiche_id=fiche_id, fiche__operateur=request.user)
+    if tache_id is not None:
+        objets = objets.filter(id=tache_id)
+    fiche_id_creation = None
+    if transition == 'start' and modele is not Tache:
+        # Le démarrage peut créer l'objet de l'étape : vérifier l'accès à la fiche
+        fiche = FicheSuivi.objects.select_related('mesure_composants').filter(id=fiche_id, operateur=request.user).first()
+        if fiche is None:
+            return JsonResponse({'success': False, 'error': "Fiche introuvable."}, status=404)
+        if modele is MelangeMortier:
+            try:
+                actions.verifier_mesure_validee(actions.relation(fiche, 'mesure_composants'))
+            except actions.ActionRefusee as e:
+                return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        fiche_id_creation = fiche.id
+    try:
+        with transaction.atomic():
+            etat = chrono_etapes.actionner(cible, objets, transition, request.user, fiche_id_creation)
+    except chrono_etapes.ChronometreIntrouvable as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
+    except chrono_etapes.TransitionRefusee as e:
+        # Transition impossible depuis l'état courant (double clic, autre appareil)
+        return JsonResponse({'success': False, 'error': str(e), **e.etat}, status=409)
+    return JsonResponse({'success': True, 'action': f'{transition}_{cible}', **etat})
+
+
+@login_required
+@require_http_methods(["POST"])
+def synchroniser(request, fiche_id):
+    # Lot d'actions mises en file hors ligne par une tablette :
+    # {"actions": [{"cle", "action", "horodatage", "donnees"}, ...]}
+    try:
+        corps = json.loads(request.body)
+    except ValueError:
+        corps = None
+    if not isinstance(corps, dict):
+        return JsonResponse({'success': False, 'error': "Corps JSON invalide."}, status=400)
+    try:
+        resultats, etat = synchronisation.synchroniser(request, fiche_id, corps.get('actions'))
+    except synchronisation.LotInvalide as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except FicheSuivi.DoesNotExist:
+        return JsonResponse({'success': False, 'error': "Fiche introuvable."}, status=404)
+    except IntegrityError:
+        # Le même lot est synchronisé en parallèle : le renvoyer suffit
+        return JsonResponse({'success': False, 'error': "Synchronisation concurrente, réessayez."}, status=409)
+    return JsonResponse({'success': True, 'resultats': resultats, 'etat': etat})
+
+
+def metriques_prometheus(request):
+    # Collecteur Prometheus (jeton) ou membre du personnel connecté
+    jeton = settings.METRIQUES_JETON
+    if not (jeton and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {jeton}')) and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(metriques.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+@require_http_methods(["POST"])
+def deposer_signature(request):
+    # Image PNG/JPEG du pad de signature, reprise ensuite par chaque tâche validée
+    fichier = request.FILES.get('signature')
+    if fichier is None:
+        return JsonResponse({'success': False, 'error': "Aucune image de signature."}, status=400)
+    if fichier.size > 2 * 1024 * 1024:
+        return JsonResponse({'success': False, 'error': "Image de signature trop volumineuse."}, status=400)
+    try:
+        signature = signatures.enregistrer(fichier.read(), request.user)
+    except signatures.SignatureInvalide as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return JsonResponse({'success': True, 'empreinte': signature.empreinte, 'url': signature.fichier.url})
+
+
 @login_required
 def export_pdf(request, fiche_id):
-    from xhtml2pdf import pisa  # Utilisation de xhtml2pdf qui fonctionne mieux sur Windows
-    from io import BytesIO
-    
-    fiche = FicheSuivi.objects.get(id=fiche_id)
-    taches = fiche.taches.select_related('etape').order_by('etape__ordre')
-    incidents = fiche.incidents.order_by('-date')
-    retour_experience = fiche.retour_experience
-    
-    # Générer le HTML
-    html_string = render_to_string('checklist/export_pdf.html', {
-        'fiche': fiche,
-        'taches': taches,
-        'incidents': incidents,
-        'retour_experience': retour_experience,
+    # Le PDF est généré en arrière-plan et mis en cache sous l'empreinte du
+    # HTML rendu : une fiche inchangée est servie directement depuis le disque.
+    try:
+        fiche = pdf.pour_rendu(FicheSuivi.objects).get(id=fiche_id)
+    except FicheSuivi.DoesNotExist:
+        # Fiche archivée : rendue depuis son instantané, par la même file d'export
+        demande = get_object_or_404(FicheArchivee, id=fiche_id)
+        restauree = archives.restaurer(demande)
+        fiche, html = restauree.fiche, pdf.rendre_html_archive(restauree)
+    else:
+        demande, html = fiche, pdf.rendre_html(fiche)
+    empreinte = pdf.calculer_empreinte(html)
+    chemin = pdf.en_cache(empreinte)
+    if chemin:
+        return FileResponse(open(chemin, 'rb'), as_attachment=True, filename=f"fiche_{fiche.id}.pdf", content_type='application/pdf')
+    export = pdf.demander(demande, html, empreinte)
+    if export.statut == 'termine':
+        return FileResponse(open(pdf.chemin_cache(empreinte), 'rb'), as_attachment=True, filename=f"fiche_{fiche.id}.pdf", content_type='application/pdf')
+    if export.statut == 'erreur':
+        return HttpResponse("Erreur lors de la génération du PDF", status=500)
+    return render(request, 'checklist/export_pdf_attente.html', {'fiche': fiche, 'export': export}, status=202)
+
+
+@login_required
+async def export_pdf_statut(request, export_id):
+    export = await ExportPDF.objects.filter(id=export_id).values('fiche_id', 'archive_id', 'statut', 'erreur').afirst()
+    if export is None:
+        return JsonResponse({'statut': 'inconnu'}, status=404)
+    return JsonResponse({
+        'statut': export['statut'],
+        'erreur': export['erreur'],
+        # Une fiche archivée garde l'identifiant de la fiche d'origine
+        'url': reverse('checklist:export_pdf', args=[export['fiche_id'] or export['archive_id']]),
     })
-    
-    # Créer un fichier PDF à partir du HTML
-    result = BytesIO()
-    pdf = pisa.pisaDocument(BytesIO(html_string.encode("UTF-8")), result)
-    
-    # Vérifier si la création du PDF a réussi
-    if not pdf.err:
-        response = HttpResponse(result.getvalue(), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="fiche_{fiche.id}.pdf"'
-        return response
-    
-    # En cas d'erreur, renvoyer un message d'erreur
-    return HttpResponse("Erreur lors de la génération du PDF", status=500)
 
 
 @login_required
 def export_csv(request, fiche_id):
-    fiche = FicheSuivi.objects.get(id=fiche_id)
-    taches = fiche.taches.select_related('etape').order_by('etape__ordre')
-    incidents = fiche.incidents.order_by('-date')
-    retour_experience = fiche.retour_experience
+    try:
+        fiche = FicheSuivi.objects.get(id=fiche_id)
+        taches = fiche.taches.select_related('etape').order_by('etape__ordre')
+        incidents = fiche.incidents.order_by('-date')
+        retour_experience = fiche.retour_experience
+    except FicheSuivi.DoesNotExist:
+        restauree = archives.restaurer(get_object_or_404(FicheArchivee, id=fiche_id))
+        fiche, taches, incidents = restauree.fiche, restauree.taches, restauree.incidents
+        retour_experience = restauree.retour_experience
     response = HttpResponse(content_type='text/csv')
     response['Content-Disposition'] = f'attachment; filename="fiche_{fiche.id}.csv"'
     writer = csv.writer(response)
@@ -626,9 +488,119 @@ def export_csv(request, fiche_id):
     return response
 
 
+def _date_du_filtre(request, nom):
+    # parse_date renvoie None pour un texte qui n'est pas une date : le filtre serait ignoré
+    if not request.GET.get(nom):
+        return None
+    date = parse_date(request.GET[nom])
+    if date is None:
+        raise ValueError(request.GET[nom])
+    return date
+
+
+def _filtres_export(request):
+    # Filtres atelier/debut/fin des exports par lot ; ValueError si invalides
+    atelier_id = int(request.GET['atelier']) if request.GET.get('atelier') else None
+    return atelier_id, _date_du_filtre(request, 'debut'), _date_du_filtre(request, 'fin')
+
+
+def _fiches_a_exporter(request):
+    # Fiches courantes et fiches archivées répondant aux filtres de la requête
+    filtres = _filtres_export(request)
+    return exports.filtrer_fiches(*filtres), exports.filtrer_archives(*filtres)
+
+
+# Taille des envois d'un flux servi en ASGI, lus par passage dans le thread synchrone
+TAILLE_ENVOI_FLUX = 64 * 1024
+
+
+def _flux(request, morceaux):
+    # Sous ASGI, Django lit un itérateur synchrone en entier avant l'envoi
+    # (sync_to_async(list)) : le flux est alors relayé par un itérateur
+    # asynchrone qui lit les morceaux par lots dans le thread synchrone.
+    if not isinstance(request, ASGIRequest):
+        return morceaux
+    return _flux_async(iter(morceaux))
+
+
+def _envoi(morceaux):
+    # Morceaux regroupés en un envoi d'environ TAILLE_ENVOI_FLUX octets ; vide à la fin du flux
+    envoi = bytearray()
+    for morceau in morceaux:
+        envoi += force_bytes(morceau)
+        if len(envoi) >= TAILLE_ENVOI_FLUX:
+            break
+    return bytes(envoi)
+
+
+async def _flux_async(morceaux):
+    try:
+        while envoi := await sync_to_async(_envoi)(morceaux):
+            yield envoi
+    finally:
+        # Client parti en cours de route : le générateur est fermé dans le
+        # thread où il s'exécute, ses curseurs et fichiers temporaires avec.
+        if hasattr(morceaux, 'close'):
+            await sync_to_async(morceaux.close)()
+
+
+@login_required
+def export_csv_lot(request):
+    # Export de toutes les fiches d'un atelier sur une période, envoyé au fil de la lecture
+    try:
+        fiches, archivees = _fiches_a_exporter(request)
+    except ValueError:
+        return HttpResponse("Paramètres d'export invalides.", status=400)
+    response = StreamingHttpResponse(_flux(request, exports.flux_csv(fiches, archivees)), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="fiches.csv"'
+    return response
+
+
+@login_required
+def export_pdf_lot(request):
+    # PDF des fiches d'un atelier sur une période, dans une archive ZIP : la
+    # demande rejoint la file de traiter_exports_pdf, qui convertit les fiches
+    # dans ses propres processus. Une demande identique en attente est reprise.
+    try:
+        atelier_id, debut, fin = _filtres_export(request)
+    except ValueError:
+        return HttpResponse("Paramètres d'export invalides.", status=400)
+    atelier = Atelier.objects.filter(id=atelier_id).first() if atelier_id is not None else None
+    if atelier_id is not None and atelier is None:
+        return HttpResponse("Paramètres d'export invalides.", status=400)
+    export, _ = ExportLotPDF.objects.get_or_create(
+        utilisateur=request.user, atelier=atelier, debut=debut, fin=fin, statut='en_attente',
+    )
+    return render(request, 'checklist/export_pdf_lot_attente.html', {'export': export}, status=202)
+
+
+@login_required
+async def export_pdf_lot_statut(request, export_id):
+    utilisateur = await _utilisateur(request)
+    export = await ExportLotPDF.objects.filter(id=export_id, utilisateur=utilisateur).values('statut', 'erreur').afirst()
+    if export is None:
+        return JsonResponse({'statut': 'inconnu'}, status=404)
+    return JsonResponse({
+        'statut': export['statut'],
+        'erreur': export['erreur'],
+        'url': reverse('checklist:export_pdf_lot_fichier', args=[export_id]),
+    })
+
+
+@login_required
+def export_pdf_lot_fichier(request, export_id):
+    export = get_object_or_404(ExportLotPDF, id=export_id, utilisateur=request.user, statut='termine')
+    try:
+        archive = open(archive_pdf.chemin_lot(export.id), 'rb')
+    except FileNotFoundError:
+        raise Http404("Archive expirée.")
+    return FileResponse(archive, as_attachment=True, filename='fiches_pdf.zip', content_type='application/zip')
+
+
 @login_required
-def atelier_list(request):
-    ateliers = Atelier.objects.all()
+async def atelier_list(request):
+    await _utilisateur(request)
+    ateliers = await sync_to_async(referentiel.ateliers)()
     return render(request, "checklist/atelier_list.html", {"ateliers": ateliers})
 
 
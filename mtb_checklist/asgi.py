@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Le flux SSE des fiches (checklist:flux_fiche) est une vue asynchrone : servi
+ici (uvicorn, daphne...), chaque navigateur connecté n'occupe qu'une tâche
+asyncio au lieu d'un thread. Sans REDIS_URL, la diffusion des événements est
+propre au processus : lancer alors un seul processus ASGI.
 """
 
 import os
@@ -12,5 +17,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mtb_checklist.settings')
+# Lu par les réglages : flux SSE des fiches et connexions à la base
+os.environ['SERVEUR_ASGI'] = '1'
 
 application = get_asgi_application()
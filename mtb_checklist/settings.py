@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,11 +39,14 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'checklist',
+    'import_export',
     'tailwind',
     'theme',
 ]
 
 MIDDLEWARE = [
+    # En premier : mesure aussi la session et l'authentification
+    'checklist.metriques.MetriquesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +60,8 @@ ROOT_URLCONF = 'mtb_checklist.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates dont les rendus sont chronométrés par requête
+        'BACKEND': 'checklist.metriques.GabaritsMesures',
         'DIRS': [
             BASE_DIR / 'theme' / 'templates',  # Ajout du dossier templates personnalisé
         ],
@@ -77,13 +82,58 @@ WSGI_APPLICATION = 'mtb_checklist.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# Profil de production SQLite : journal WAL (lectures non bloquées par les
+# écritures), synchronisation allégée, 256 Mo mappés en mémoire et 64 Mo de
+# cache de pages par connexion.
+SQLITE_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA mmap_size=268435456;'
+        'PRAGMA cache_size=-65536;'
+        'PRAGMA temp_store=MEMORY;'
+    ),
+    # Attente d'un verrou (secondes) avant "database is locked"
+    'timeout': 20,
+    # Les blocs atomic prennent le verrou d'écriture dès BEGIN : pas
+    # d'échec immédiat lors du passage d'une lecture à une écriture.
+    'transaction_mode': 'IMMEDIATE',
 }
 
+# Base choisie par l'environnement : DB_ENGINE=postgresql avec DB_NAME,
+# DB_USER, DB_PASSWORD, DB_HOST et DB_PORT ; SQLite (db.sqlite3) par défaut.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'mtb_checklist'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': SQLITE_OPTIONS,
+        }
+    }
+
+# Point d'entrée ASGI (mtb_checklist/asgi.py le signale) : flux SSE des fiches
+# et connexions à la base adaptées
+SERVEUR_ASGI = os.environ.get('SERVEUR_ASGI') == '1'
+
+# Connexions persistantes, vérifiées avant réutilisation à chaque requête.
+# Sous ASGI chaque requête a son propre thread : les connexions persistantes
+# s'y accumuleraient sans être réutilisées, elles sont désactivées par défaut.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 0 if SERVEUR_ASGI else 60))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -128,6 +178,66 @@ LOGIN_URL = '/accounts/login/'
 # Redirige vers la page de login après déconnexion
 LOGOUT_REDIRECT_URL = '/accounts/login/'
 
+# Cache partagé entre les processus du serveur : les versions de fiches et
+# du référentiel y sont tenues, un cache propre à chaque processus laisserait
+# les autres servir des pages périmées. Redis si REDIS_URL est défini (paquet
+# redis requis), sinon fichiers dans CACHE_DIR.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', BASE_DIR / 'cache'),
+            # Fragments et pages par fiche et par client : la limite par défaut
+            # (300 fichiers) ferait purger le cache à presque chaque écriture
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 50000))},
+        }
+    }
+
+# Durée de vie (secondes) des fragments et pages de fiches en cache ; les
+# clés changent à chaque modification, la durée ne sert qu'à libérer la place.
+FICHE_CACHE_DUREE = 24 * 3600
+
+# Fichiers déposés : signatures, rangées par empreinte
+MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_URL = 'media/'
+
+# Exports PDF : cache sur disque et nombre de threads de génération
+# (0 = génération synchrone dans la requête)
+PDF_EXPORT_DIR = BASE_DIR / 'exports' / 'pdf'
+PDF_EXPORT_WORKERS = 2
+# Purge du cache PDF par traiter_exports_pdf : fichiers non servis depuis ce
+# nombre de jours, puis les plus anciens au-delà de la taille (Mo, None : sans limite)
+PDF_CACHE_AGE_MAX = 30
+PDF_CACHE_TAILLE_MAX = None
+# Métriques par requête (/metriques/) : au-delà de ce seuil (secondes), la
+# requête est journalisée avec ses requêtes SQL les plus lentes. Le jeton,
+# s'il est défini, ouvre l'accès au collecteur (Authorization: Bearer).
+METRIQUES_SEUIL_LENT = 1.0
+METRIQUES_JETON = os.environ.get('METRIQUES_JETON')
+
+# Flux SSE des fiches (mises à jour en direct) : servi uniquement par le point
+# d'entrée ASGI (SERVEUR_ASGI). Sous WSGI, chaque page ouverte
+# bloquerait un worker pour de bon : les pages n'ouvrent le flux que si
+# FLUX_SSE est actif, par défaut sous ASGI ; FLUX_SSE=1 l'active aussi pour
+# des pages servies en WSGI quand le proxy envoie /fiche/<id>/flux/ à un
+# processus ASGI. Sans Redis (REDIS_URL), les événements ne quittent pas le
+# processus : un seul processus ASGI doit alors servir les flux et les actions.
+FLUX_SSE = os.environ.get('FLUX_SSE', '1' if SERVEUR_ASGI else '0') == '1'
+
+# Exports PDF par lot : archives ZIP construites par traiter_exports_pdf (à
+# lancer en service avec --boucle), avec ce nombre de processus de conversion
+# (None : un par cœur), puis supprimées ce nombre de jours après leur création
+PDF_LOT_PROCESSUS = None
+PDF_LOT_AGE_MAX = 1
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 